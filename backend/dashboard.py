@@ -1,184 +1,717 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 import asyncio
 import httpx
+import json
 import logging
-from typing import Dict, List
-from datetime import datetime
-import statistics
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime, timezone
 from db.csv_api import *
 from db.schema import *
+from dashboard_events import DASHBOARD_EVENTS_MODE, DASHBOARD_EVENTS_TOPIC, kafka_bootstrap, kafka_module
 
 app = FastAPI()
 
-# Store active WebSocket connections
-connections: List[WebSocket] = []
+# Store active WebSocket connections with the update mode each one asked for
+connections: Dict[WebSocket, str] = {}   # websocket -> "full" or "diff"
 conn_lock = asyncio.Lock()
 
-# Cache for dashboard stats
-stats_cache = {
-    "queue_stats": {},
-    "checkin_stats": {}
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "4"))   # broadcasts per second at most
+SEND_TIMEOUT = 2.0                                         # seconds before a slow client is dropped
+APPLIED_BATCHES_KEPT = 10000                               # event batch ids remembered to skip resends
+
+CATEGORIES = ["vip", "premium", "standard"]
+
+
+def parse_timestamp(value: str):
+    """Epoch seconds for the timestamp formats found in requests_status.csv (naive means UTC)"""
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class DashboardAggregates:
+    """Running dashboard statistics, updated per event instead of rescanning the CSVs.
+
+    Averages are kept as sums and counts: the mean waiting time of the requests
+    currently waiting is now minus the mean of their waiting timestamps, and the
+    mean check-in duration is a running sum over completed check-outs.
+    """
+
+    def __init__(self):
+        self.matches: Dict[str, None] = {}                          # ordered set of match ids
+        self.waiting: Dict[Tuple[str, str], Dict[str, float]] = {}  # (match, category) -> {request_id: waiting since}
+        self.waiting_sum: Dict[Tuple[str, str], float] = {}
+        self.queue_length: Dict[Tuple[str, str], int] = {}          # last length reported by the queue service
+        self.request_keys: Dict[str, Tuple[str, str]] = {}          # request_id -> (match, category)
+        self.checked_in: Dict[str, Dict[str, float]] = {}           # match -> {request_id: checked in at}
+        self.duration_sum: Dict[str, float] = {}                    # match -> seconds over completed check-outs
+        self.duration_count: Dict[str, int] = {}
+
+    def add_match(self, match_id: str):
+        if match_id not in self.matches:
+            self.matches[match_id] = None
+            self.checked_in.setdefault(match_id, {})
+            self.duration_sum.setdefault(match_id, 0.0)
+            self.duration_count.setdefault(match_id, 0)
+
+    # ── updates ──
+
+    def request_status(self, request_id: str, match_id: str, category: str, status: str, timestamp):
+        """A request entered a new status; match and category are only needed the first time"""
+        if match_id and category:
+            self.add_match(match_id)
+            self.request_keys[request_id] = (match_id, category.lower())
+        key = self.request_keys.get(request_id)
+        if key is None:
+            return
+        if status.lower() == "waiting":
+            if timestamp is not None and request_id not in self.waiting.setdefault(key, {}):
+                self.waiting[key][request_id] = timestamp
+                self.waiting_sum[key] = self.waiting_sum.get(key, 0.0) + timestamp
+        else:
+            since = self.waiting.get(key, {}).pop(request_id, None)
+            if since is not None:
+                self.waiting_sum[key] -= since
+            self.request_keys.pop(request_id, None)   # only waiting requests need their key
+
+    def queue_update(self, match_id: str, category: str, queue_length: int):
+        self.add_match(match_id)
+        self.queue_length[(match_id, category.lower())] = queue_length
+
+    def check_in(self, match_id: str, request_id: str, timestamp):
+        self.add_match(match_id)
+        self.checked_in[match_id][request_id] = timestamp
+
+    def check_out(self, match_id: str, request_id: str, timestamp) -> Optional[float]:
+        """Returns the seconds between check-in and check-out when both are known"""
+        self.add_match(match_id)
+        checked_in_at = self.checked_in[match_id].pop(request_id, None)
+        if checked_in_at is not None and timestamp is not None:
+            self.duration_sum[match_id] += timestamp - checked_in_at
+            self.duration_count[match_id] += 1
+            return timestamp - checked_in_at
+        return None
+
+    # ── reads ──
+
+    def queue_stats(self) -> dict:
+        now = datetime.now(timezone.utc).timestamp()
+        stats = {}
+        for match_id in self.matches:
+            stats[match_id] = {}
+            for category in CATEGORIES:
+                key = (match_id, category)
+                waiting = self.waiting.get(key, {})
+                avg = (now - self.waiting_sum[key] / len(waiting)) / 60 if waiting else 0  # in minutes
+                stats[match_id][category] = {
+                    "waiting_count": self.queue_length.get(key, len(waiting)),
+                    "avg_waiting_time": avg
+                }
+        return stats
+
+    def checkin_stats(self) -> dict:
+        stats = {}
+        for match_id in self.matches:
+            count = self.duration_count[match_id]
+            stats[match_id] = {
+                "checked_in_count": len(self.checked_in[match_id]),
+                "avg_checkin_duration": self.duration_sum[match_id] / count / 60 if count else 0  # in minutes
+            }
+        return stats
+
+    # ── startup ──
+
+    @classmethod
+    def from_storage(cls):
+        """Rebuild from the CSVs with one pass over each file"""
+        aggregates = cls()
+        for match in read_all(matches_db):
+            aggregates.add_match(match["match_id"])
+
+        requests = {}
+        for req in read_all(request_db):
+            requests[req["request_id"]] = req
+            aggregates.add_match(req["match_id"])
+
+        waiting_at, checkin_at, checkout_at = {}, {}, {}
+        for record in read_all(requests_status_db):
+            status = record["status"]
+            if status == "Waiting":
+                waiting_at.setdefault(record["request_id"], record["timestamp"])
+            elif status == "checked_in":
+                checkin_at[record["request_id"]] = record["timestamp"]
+            elif status == "checked_out":
+                checkout_at[record["request_id"]] = record["timestamp"]
+
+        for request_id, req in requests.items():
+            match_id = req["match_id"]
+            latest = req["latest_status"]
+            if req.get("catagory"):
+                aggregates.request_keys[request_id] = (match_id, req["catagory"].lower())
+            if latest == "Waiting" and request_id in waiting_at:
+                aggregates.request_status(request_id, match_id, req.get("catagory"), latest,
+                                          parse_timestamp(waiting_at[request_id]))
+            elif latest == "checked_in":
+                aggregates.check_in(match_id, request_id, parse_timestamp(checkin_at.get(request_id)))
+            elif latest == "checked_out" and request_id in checkin_at and request_id in checkout_at:
+                aggregates.check_in(match_id, request_id, parse_timestamp(checkin_at[request_id]))
+                aggregates.check_out(match_id, request_id, parse_timestamp(checkout_at[request_id]))
+        return aggregates
+
+
+# Time-series history kept in fixed memory
+
+HISTOGRAM_PRECISION = 0.02            # relative error of a reported percentile
+HISTOGRAM_MIN = 0.01                  # seconds; anything shorter lands in bucket 0
+HISTOGRAM_MAX = 7 * 24 * 3600.0       # seconds; longer values are clamped
+RESOLUTIONS = {                       # name -> (seconds per slot, slots kept)
+    "1s": (1, 300),                   # last 5 minutes
+    "10s": (10, 360),                 # last hour
+    "1m": (60, 1440),                 # last day
 }
+ALL_CATEGORIES = "all"                # series key for check-ins, which carry no category
+
+
+class LogHistogram:
+    """Log-bucketed histogram in the HDR style: bounded size, mergeable by adding counts.
+
+    Bucket i covers [MIN * g^(i-1), MIN * g^i) with g = 1 + precision, so any
+    percentile is reported within HISTOGRAM_PRECISION of the true value and at
+    most ~1000 buckets exist between HISTOGRAM_MIN and HISTOGRAM_MAX.
+    """
+
+    GROWTH = math.log1p(HISTOGRAM_PRECISION)
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, value: float):
+        value = min(max(value, 0.0), HISTOGRAM_MAX)
+        index = 0 if value < HISTOGRAM_MIN else int(math.log(value / HISTOGRAM_MIN) / self.GROWTH) + 1
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LogHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, q: float) -> float:
+        if not self.total:
+            return 0.0
+        rank = q / 100 * self.total
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                if index == 0:
+                    return 0.0
+                # midpoint of the bucket, capped by the largest value seen
+                return min(HISTOGRAM_MIN * math.exp((index - 0.5) * self.GROWTH), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Count and percentiles, in seconds"""
+        return {
+            "count": self.total,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max
+        }
+
+
+class HistorySlot:
+    """What happened in one time step of one series"""
+    __slots__ = ("start", "queue_length", "queue_max", "check_ins", "check_outs", "wait", "duration")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.queue_length = None   # last reported length in the step
+        self.queue_max = None
+        self.check_ins = 0
+        self.check_outs = 0
+        self.wait = None           # LogHistogram, created on first sample
+        self.duration = None
+
+    def point(self) -> dict:
+        return {
+            "t": self.start,
+            "queue_length": self.queue_length,
+            "queue_max": self.queue_max,
+            "check_ins": self.check_ins,
+            "check_outs": self.check_outs,
+            "wait": self.wait.summary() if self.wait else None,
+            "checkin_duration": self.duration.summary() if self.duration else None
+        }
+
+
+class HistoryRing:
+    """Fixed number of slots; a slot is reused once its step has scrolled out of the window"""
+
+    def __init__(self, step: int, size: int):
+        self.step = step
+        self.slots: List[Optional[HistorySlot]] = [None] * size
+
+    def slot(self, now: float) -> HistorySlot:
+        start = int(now // self.step) * self.step
+        index = (start // self.step) % len(self.slots)
+        slot = self.slots[index]
+        if slot is None or slot.start != start:
+            slot = self.slots[index] = HistorySlot(start)
+        return slot
+
+    def points(self, now: float, window: float) -> List[dict]:
+        oldest = now - min(window, self.step * len(self.slots))
+        live = [slot for slot in self.slots if slot is not None and slot.start + self.step > oldest]
+        return [slot.point() for slot in sorted(live, key=lambda slot: slot.start)]
+
+
+class HistoryStore:
+    """Per match and category time series at every resolution, plus lifetime histograms.
+
+    Memory is fixed per series: the rings never grow and histograms are bounded.
+    """
+
+    def __init__(self):
+        self.series: Dict[Tuple[str, str], Dict[str, HistoryRing]] = {}
+        self.wait_totals: Dict[Tuple[str, str], LogHistogram] = {}
+        self.duration_totals: Dict[str, LogHistogram] = {}
+
+    def slots(self, match_id: str, category: str, now: float = None):
+        now = time.time() if now is None else now
+        key = (match_id, category.lower())
+        if key not in self.series:
+            self.series[key] = {name: HistoryRing(step, size) for name, (step, size) in RESOLUTIONS.items()}
+        return [ring.slot(now) for ring in self.series[key].values()]
+
+    def record_queue_length(self, match_id: str, category: str, queue_length: int):
+        for slot in self.slots(match_id, category):
+            slot.queue_length = queue_length
+            slot.queue_max = queue_length if slot.queue_max is None else max(slot.queue_max, queue_length)
+
+    def record_wait(self, match_id: str, category: str, seconds: float):
+        for slot in self.slots(match_id, category):
+            slot.wait = slot.wait or LogHistogram()
+            slot.wait.record(seconds)
+        self.wait_totals.setdefault((match_id, category.lower()), LogHistogram()).record(seconds)
+
+    def record_check_in(self, match_id: str):
+        for slot in self.slots(match_id, ALL_CATEGORIES):
+            slot.check_ins += 1
+
+    def record_check_out(self, match_id: str, duration: Optional[float]):
+        for slot in self.slots(match_id, ALL_CATEGORIES):
+            slot.check_outs += 1
+            if duration is not None:
+                slot.duration = slot.duration or LogHistogram()
+                slot.duration.record(duration)
+        if duration is not None:
+            self.duration_totals.setdefault(match_id, LogHistogram()).record(duration)
+
+    def history(self, match_id: str, category: str, resolution: str, window: float) -> List[dict]:
+        rings = self.series.get((match_id, category.lower()))
+        if not rings:
+            return []
+        return rings[resolution].points(time.time(), window)
+
+    def percentiles(self) -> dict:
+        """Lifetime wait percentiles per match and category (and merged over categories),
+        plus check-in duration percentiles per match"""
+        stats: Dict[str, dict] = {}
+        for (match_id, category), histogram in self.wait_totals.items():
+            match_stats = stats.setdefault(match_id, {"wait": {}})
+            match_stats["wait"][category] = histogram.summary()
+        for match_id, match_stats in stats.items():
+            merged = LogHistogram()
+            for (other, _), histogram in self.wait_totals.items():
+                if other == match_id:
+                    merged.merge(histogram)
+            match_stats["wait"][ALL_CATEGORIES] = merged.summary()
+        for match_id, histogram in self.duration_totals.items():
+            stats.setdefault(match_id, {"wait": {}})["checkin_duration"] = histogram.summary()
+        return stats
+
+
+# Live attendance: who is inside and how fast gates are moving
+
+ATTENDANCE_WINDOW = 300               # seconds of per-second counts kept per counter
+ATTENDANCE_REFRESH = 5.0              # seconds between pushes while gates are busy
+
+
+class SlidingCounter:
+    """Counts over the last ATTENDANCE_WINDOW seconds in a fixed ring of one-second buckets"""
+
+    def __init__(self, window: int = ATTENDANCE_WINDOW):
+        self.counts = [0] * window
+        self.seconds = [-1] * window   # which second each bucket currently holds
+        self.total = 0                 # lifetime count, including scans too old for the window
+
+    def add(self, at: float, now: float):
+        self.total += 1
+        second = int(min(at, now))     # clamp gate clocks that run ahead
+        if second <= now - len(self.counts):
+            return                     # e.g. an offline replay from earlier in the day
+        index = second % len(self.counts)
+        if self.seconds[index] != second:
+            self.seconds[index] = second
+            self.counts[index] = 0
+        self.counts[index] += 1
+
+    def count(self, span: int, now: float) -> int:
+        """Events in the last span seconds"""
+        oldest = int(now) - span
+        return sum(c for c, second in zip(self.counts, self.seconds) if second > oldest)
+
+
+class AttendanceCounters:
+    """Entries and exits per match and per gate, updated on every check-in/out event"""
+
+    def __init__(self):
+        self.entries: Dict[Tuple[str, Optional[str]], SlidingCounter] = {}   # (match, gate or None) -> counter
+        self.exits: Dict[Tuple[str, Optional[str]], SlidingCounter] = {}
+        self.gates: Dict[str, Dict[str, None]] = {}                          # match -> ordered set of gates
+
+    def record(self, kind: str, match_id: str, gate_id: Optional[str], at: Optional[float]):
+        now = time.time()
+        counters = self.entries if kind == "check_in" else self.exits
+        keys = [(match_id, None)]
+        if gate_id:
+            self.gates.setdefault(match_id, {})[gate_id] = None
+            keys.append((match_id, gate_id))
+        for key in keys:
+            counters.setdefault(key, SlidingCounter()).add(now if at is None else at, now)
+
+    def rates(self, key: Tuple[str, Optional[str]], now: float) -> dict:
+        entries, exits = self.entries.get(key), self.exits.get(key)
+        return {
+            "entries_total": entries.total if entries else 0,
+            "exits_total": exits.total if exits else 0,
+            "entries_per_minute": entries.count(60, now) if entries else 0,
+            "exits_per_minute": exits.count(60, now) if exits else 0,
+            "entries_per_minute_5m": entries.count(300, now) / 5 if entries else 0,
+            "exits_per_minute_5m": exits.count(300, now) / 5 if exits else 0
+        }
+
+    def busy_matches(self) -> Set[str]:
+        """Matches with scans inside the window, whose rates change even without new events"""
+        now = time.time()
+        return {match_id for (match_id, gate), counter in list(self.entries.items()) + list(self.exits.items())
+                if gate is None and counter.count(ATTENDANCE_WINDOW, now)}
+
+    def stats(self, inside: Dict[str, int]) -> dict:
+        now = time.time()
+        stats = {}
+        for match_id in set(inside) | {match_id for match_id, _ in self.entries} | {match_id for match_id, _ in self.exits}:
+            stats[match_id] = {
+                "inside": inside.get(match_id, 0),
+                **self.rates((match_id, None), now),
+                "gates": {gate: self.rates((match_id, gate), now) for gate in self.gates.get(match_id, {})}
+            }
+        return stats
+
+
+aggregates = DashboardAggregates()
+history = HistoryStore()
+attendance = AttendanceCounters()
+applied_batches: "OrderedDict[str, None]" = OrderedDict()   # recently applied event batch ids, oldest first
 
 async def get_queue_stats():
     """Get statistics about queues for each match and category"""
-    matches = read_all(matches_db)
-    categories = ["vip", "premium", "standard"]
-    stats = {}
-    
-    for match in matches:
-        match_id = match["match_id"]
-        stats[match_id] = {}
-        for category in categories:
-            # Get requests in Waiting status
-            waiting_requests = search_records(request_db, {
-                "match_id": match_id,
-                "catagory": category.upper(),
-                "latest_status": "Waiting"
-            })
-            stats[match_id][category] = {
-                "waiting_count": len(waiting_requests)
-            }
-            
-            # Calculate average waiting time
-            if waiting_requests:
-                waiting_times = []
-                for req in waiting_requests:
-                    status_records = search_records(requests_status_db, {
-                        "request_id": req["request_id"],
-                        "status": "Waiting"
-                    })
-                    if status_records:
-                        timestamp = datetime.strptime(status_records[0]["timestamp"], "%Y-%m-%dT%H:%M:%SZ")
-                        waiting_time = (datetime.utcnow() - timestamp).total_seconds() / 60  # in minutes
-                        waiting_times.append(waiting_time)
-                if len(waiting_times) > 0:
-                    stats[match_id][category]["avg_waiting_time"] = statistics.mean(waiting_times)
-                else:
-                    stats[match_id][category]["avg_waiting_time"] = 0
-            else:
-                stats[match_id][category]["avg_waiting_time"] = 0
-    
-    return stats
+    return aggregates.queue_stats()
 
 async def get_checkin_stats():
     """Get statistics about checked-in users and average check-in duration"""
-    matches = read_all(matches_db)
-    stats = {}
-    
-    for match in matches:
-        match_id = match["match_id"]
-        stats[match_id] = {}
-        
-        # Get currently checked in users
-        checked_in_requests = search_records(request_db, {
-            "match_id": match_id,
-            "latest_status": "checked_in"
-        })
-        stats[match_id]["checked_in_count"] = len(checked_in_requests)
-        
-        # Calculate average check-in duration for completed check-ins
-        checkout_durations = []
-        completed_checkouts = search_records(request_db, {
-            "match_id": match_id,
-            "latest_status": "checked_out"
-        })
-        
-        for req in completed_checkouts:
-            status_records = search_records(requests_status_db, {
-                "request_id": req["request_id"]
-            })
-            
-            checkin_time = None
-            checkout_time = None
-            
-            for record in status_records:
-                if record["status"] == "checked_in":
-                    checkin_time = datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S.%fZ")
-                elif record["status"] == "checked_out":
-                    checkout_time = datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S.%fZ")
-            
-            if checkin_time and checkout_time:
-                duration = (checkout_time - checkin_time).total_seconds() / 60  # in minutes
-                checkout_durations.append(duration)
-        
-        if checkout_durations:
-            stats[match_id]["avg_checkin_duration"] = statistics.mean(checkout_durations)
-        else:
-            stats[match_id]["avg_checkin_duration"] = 0
-    
-    return stats
+    return aggregates.checkin_stats()
+
+async def get_attendance_stats():
+    """Inside count and entry/exit throughput per match, and per gate where known"""
+    return attendance.stats({match_id: len(inside) for match_id, inside in aggregates.checked_in.items()})
 
-async def broadcast_stats():
-    """Broadcast current stats to all connected clients"""
+async def send_to(connection: WebSocket, payload: dict):
+    try:
+        await asyncio.wait_for(connection.send_json(payload), SEND_TIMEOUT)
+    except Exception:
+        # Remove dead or stalled connections
+        connections.pop(connection, None)
+
+async def broadcast_stats(changed_matches: Optional[Set[str]] = None):
+    """Broadcast current stats to all connected clients.
+
+    Clients in diff mode only receive the matches in changed_matches.
+    """
     dashboard_data = {
-        "queue_stats": stats_cache["queue_stats"],
-        "checkin_stats": stats_cache["checkin_stats"]
+        "queue_stats": await get_queue_stats(),
+        "checkin_stats": await get_checkin_stats(),
+        "percentiles": history.percentiles(),
+        "attendance": await get_attendance_stats()
     }
-    
-    for connection in connections[:]:  # Use a slice copy to avoid modification during iteration
+    diff_data = dashboard_data
+    if changed_matches is not None:
+        diff_data = {"type": "diff"}
+        for section, stats in dashboard_data.items():
+            diff_data[section] = {m: s for m, s in stats.items() if m in changed_matches}
+
+    await asyncio.gather(*(
+        send_to(connection, diff_data if mode == "diff" else dashboard_data)
+        for connection, mode in list(connections.items())
+    ))
+
+
+class BroadcastCoalescer:
+    """Collapses bursts of events into at most BROADCAST_RATE broadcasts per second.
+
+    Events only mark their match dirty; a single background task sends the
+    current stats, waits out the interval, and sends again if anything changed
+    meanwhile.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.dirty_matches: Set[str] = set()
+        self.wakeup = asyncio.Event()
+
+    def mark_dirty(self, match_id: Optional[str]):
+        if match_id:
+            self.dirty_matches.add(match_id)
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            changed, self.dirty_matches = self.dirty_matches, set()
+            try:
+                await broadcast_stats(changed)
+            except Exception as e:
+                logging.error(f"Failed to broadcast stats: {e}")
+            await asyncio.sleep(self.interval)
+
+
+coalescer = BroadcastCoalescer(BROADCAST_RATE)
+
+async def refresh_attendance():
+    """Per-minute rates decay without new scans, so keep pushing busy matches"""
+    while True:
+        await asyncio.sleep(ATTENDANCE_REFRESH)
+        for match_id in attendance.busy_matches():
+            coalescer.mark_dirty(match_id)
+
+@app.on_event("startup")
+async def load_aggregates():
+    """Build the aggregates from storage once; events keep them current afterwards"""
+    global aggregates
+    aggregates = await asyncio.to_thread(DashboardAggregates.from_storage)
+    asyncio.create_task(coalescer.run())
+    asyncio.create_task(refresh_attendance())
+    if DASHBOARD_EVENTS_MODE == "kafka":
+        start_events_consumer(asyncio.get_running_loop())
+
+def apply_event(event_type: str, event_data: dict) -> Optional[str]:
+    """Fold one event into the aggregates and the history; returns the match it touched"""
+    match_id = event_data.get("match_id")
+    if match_id is None and event_data.get("request_id") in aggregates.request_keys:
+        # resolved up front: request_status forgets the key once a request leaves "waiting"
+        match_id = aggregates.request_keys[event_data["request_id"]][0]
+
+    if event_type == "queue_update":
+        aggregates.queue_update(event_data["match_id"], event_data["category"], event_data["queue_length"])
+        history.record_queue_length(event_data["match_id"], event_data["category"], event_data["queue_length"])
+
+    elif event_type == "request_status":
+        aggregates.request_status(
+            event_data["request_id"],
+            event_data.get("match_id"),
+            event_data.get("catagory"),
+            event_data["status"],
+            parse_timestamp(event_data.get("timestamp"))
+        )
+
+    elif event_type == "queue_wait":
+        # measured by the queue service, from registration to admission; status
+        # updates cannot pair up a wait since every status gets a new request_id
+        aggregates.add_match(event_data["match_id"])
+        history.record_wait(event_data["match_id"], event_data["category"], float(event_data["wait"]))
+
+    elif event_type == "check_in":
+        aggregates.check_in(event_data["match_id"], event_data["request_id"], parse_timestamp(event_data["timestamp"]))
+        history.record_check_in(event_data["match_id"])
+        attendance.record(event_type, event_data["match_id"], event_data.get("gate_id"),
+                          parse_timestamp(event_data["timestamp"]))
+
+    elif event_type == "check_out":
+        duration = aggregates.check_out(event_data["match_id"], event_data["request_id"],
+                                        parse_timestamp(event_data["timestamp"]))
+        history.record_check_out(event_data["match_id"], duration)
+        attendance.record(event_type, event_data["match_id"], event_data.get("gate_id"),
+                          parse_timestamp(event_data["timestamp"]))
+
+    return match_id
+
+def apply_events(events: List[dict]) -> int:
+    """Fold a batch of events in order, skipping malformed ones; returns how many applied"""
+    applied = 0
+    for event in events:
         try:
-            await connection.send_json(dashboard_data)
-        except:
-            # Remove dead connections
-            connections.remove(connection)
+            match_id = apply_event(event["type"], event["data"])
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Skipping malformed dashboard event {event}: {e}")
+            continue
+        coalescer.mark_dirty(match_id)
+        applied += 1
+    return applied
 
 @app.post("/events")
 async def handle_events(request: Request):
     """Handle real-time events from other services"""
     data = await request.json()
-    event_type = data["type"]
-    event_data = data["data"]
-    
-    if event_type == "queue_update":
-        match_id = event_data["match_id"]
-        category = event_data["category"]
-        if match_id not in stats_cache["queue_stats"]:
-            stats_cache["queue_stats"][match_id] = {}
-        if category not in stats_cache["queue_stats"][match_id]:
-            stats_cache["queue_stats"][match_id][category] = {}
-            
-        stats_cache["queue_stats"][match_id][category]["waiting_count"] = event_data["queue_length"]
-        # Update average waiting time
-        queue_stats = await get_queue_stats()
-        if match_id in queue_stats and category in queue_stats[match_id]:
-            stats_cache["queue_stats"][match_id][category]["avg_waiting_time"] = queue_stats[match_id][category]["avg_waiting_time"]
-    
-    elif event_type in ["check_in", "check_out"]:
-        # Update check-in stats
-        checkin_stats = await get_checkin_stats()
-        stats_cache["checkin_stats"] = checkin_stats
-    
-    # Broadcast updated stats to all connected clients
-    await broadcast_stats()
+    match_id = apply_event(data["type"], data["data"])
+
+    # The broadcast happens in the background, coalesced with other events
+    coalescer.mark_dirty(match_id)
     
     return {"status": "success"}
 
+def apply_batch(batch_id: Optional[str], events: List[dict]) -> int:
+    """apply_events for one emitter batch; a batch_id seen before is a resend and is skipped"""
+    if batch_id is not None:
+        if batch_id in applied_batches:
+            return 0
+        applied_batches[batch_id] = None
+        if len(applied_batches) > APPLIED_BATCHES_KEPT:
+            applied_batches.popitem(last=False)
+    return apply_events(events)
+
+@app.post("/events/batch")
+async def handle_event_batch(request: Request):
+    """Handle a batch of events: {"batch_id": ..., "events": [{"type": ..., "data": {...}}, ...]}"""
+    data = await request.json()
+    applied = apply_batch(data.get("batch_id"), data.get("events", []))
+    return {"status": "success", "applied": applied}
+
+def start_events_consumer(loop: asyncio.AbstractEventLoop):
+    """Read event batches from the Kafka events topic instead of receiving POSTs"""
+    kafka = kafka_module()
+
+    def run():
+        consumer = kafka.Consumer({
+            "bootstrap.servers": kafka_bootstrap(),
+            "group.id": "dashboard",
+            "auto.offset.reset": "latest"
+        })
+        consumer.subscribe([DASHBOARD_EVENTS_TOPIC])
+        logging.info(f"Consuming dashboard events from {DASHBOARD_EVENTS_TOPIC}")
+        while True:
+            msg = consumer.poll(1.0)
+            if msg is None:
+                continue
+            if msg.error():
+                logging.error(f"Dashboard events consumer error: {msg.error()}")
+                continue
+            try:
+                batch = json.loads(msg.value())
+                batch_id, events = batch.get("batch_id"), batch["events"]
+            except (ValueError, KeyError, AttributeError) as e:
+                logging.warning(f"Skipping unreadable dashboard event batch: {e}")
+                continue
+            # the aggregates belong to the event loop
+            loop.call_soon_threadsafe(apply_batch, batch_id, events)
+
+    threading.Thread(target=run, daemon=True).start()
+
+def history_request(match_id: str, category: str, resolution: str, window: float) -> dict:
+    if resolution not in RESOLUTIONS:
+        return {"type": "error", "message": f"resolution must be one of {list(RESOLUTIONS)}"}
+    return {
+        "type": "history",
+        "match_id": match_id,
+        "category": category,
+        "resolution": resolution,
+        "points": history.history(match_id, category, resolution, window)
+    }
+
+@app.get("/history/{match_id}")
+async def get_history(match_id: str, category: str = ALL_CATEGORIES, resolution: str = "10s", window: float = 3600):
+    """Time series for one match and category (use "all" for check-ins), oldest point first.
+
+    Each point has the queue length, check-in/out counts and wait/check-in
+    duration percentiles (seconds) for its time step.
+    """
+    return history_request(match_id, category, resolution, window)
+
+@app.get("/attendance")
+async def get_attendance():
+    """Live attendance counters (also pushed over /ws)"""
+    return await get_attendance_stats()
+
+@app.get("/percentiles")
+async def get_percentiles():
+    """Lifetime wait and check-in duration percentiles, in seconds"""
+    return history.percentiles()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    """Live stats; connect with ?mode=diff to receive only the matches that changed"""
     await websocket.accept()
     
-    # Initialize cache if empty
-    if not stats_cache["queue_stats"]:
-        stats_cache["queue_stats"] = await get_queue_stats()
-    if not stats_cache["checkin_stats"]:
-        stats_cache["checkin_stats"] = await get_checkin_stats()
-    
     async with conn_lock:
-        connections.append(websocket)
+        connections[websocket] = "diff" if websocket.query_params.get("mode") == "diff" else "full"
     
     try:
         # Send initial stats
         await websocket.send_json({
-            "queue_stats": stats_cache["queue_stats"],
-            "checkin_stats": stats_cache["checkin_stats"]
+            "queue_stats": await get_queue_stats(),
+            "checkin_stats": await get_checkin_stats(),
+            "percentiles": history.percentiles(),
+            "attendance": await get_attendance_stats()
         })
         
         while True:
-            # Keep the connection alive
-            await websocket.receive_text()
+            # Clients may ask for a series: {"action": "history", "match_id": ..., "category": ...}
+            message = await websocket.receive_text()
+            try:
+                request = json.loads(message)
+            except ValueError:
+                continue
+            if isinstance(request, dict) and request.get("action") == "history":
+                try:
+                    category = request.get("category", ALL_CATEGORIES)
+                    resolution = request.get("resolution", "10s")
+                    window = float(request.get("window", 3600))
+                    if not isinstance(category, str) or not isinstance(resolution, str):
+                        raise TypeError("category and resolution must be strings")
+                    if not math.isfinite(window) or window <= 0:
+                        raise ValueError("window must be a positive number of seconds")
+                    reply = history_request(str(request.get("match_id")), category, resolution, window)
+                except (ValueError, TypeError) as e:
+                    reply = {"type": "error", "message": f"Invalid history request: {e}"}
+                await websocket.send_json(reply)
     except WebSocketDisconnect:
-        connections.remove(websocket)
+        pass
+    finally:
+        connections.pop(websocket, None)
 
 if __name__ == "__main__":
     import uvicorn
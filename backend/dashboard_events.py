@@ -0,0 +1,174 @@
+# dashboard_events.py
+"""
+Buffered delivery of dashboard events, shared by the backend routes and queuing.py.
+
+Services used to POST every status change to dashboard:8003/events and wait for
+the answer. DashboardEmitter.emit() only appends to an in-memory buffer; a
+background task ships the buffer as one POST to /events/batch when it reaches
+DASHBOARD_BATCH_SIZE events or DASHBOARD_FLUSH_INTERVAL seconds have passed.
+The task runs on the loop given to start() at service startup; emit() may be
+called from any thread, e.g. queuing.py's consumer threads.
+Events that carry a key replace the buffered event with the same key, so a
+burst of queue_update events for one topic is sent as its latest value.
+Every batch carries a batch_id. A batch whose send failed is sent again under
+the same id, and the dashboard skips ids it has already applied, so a send that
+timed out after the dashboard applied it is not counted twice.
+
+With DASHBOARD_EVENTS_MODE=kafka the batch is produced as one message on
+DASHBOARD_EVENTS_TOPIC instead, and the dashboard consumes that topic.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+import httpx
+
+DASHBOARD_URL = os.getenv("DASHBOARD_URL", "http://dashboard:8003")
+DASHBOARD_EVENTS_MODE = os.getenv("DASHBOARD_EVENTS_MODE", "http")   # "http" or "kafka"
+DASHBOARD_EVENTS_TOPIC = os.getenv("DASHBOARD_EVENTS_TOPIC", "dashboard.events")
+DASHBOARD_BATCH_SIZE = int(os.getenv("DASHBOARD_BATCH_SIZE", "200"))
+DASHBOARD_FLUSH_INTERVAL = float(os.getenv("DASHBOARD_FLUSH_INTERVAL", "0.25"))
+DASHBOARD_MAX_BUFFER = 50000   # events kept while the dashboard is unreachable
+
+
+def kafka_module():
+    """confluent_kafka, or the local stand-in when LOCAL_BROKER is set"""
+    if os.getenv("LOCAL_BROKER"):
+        import local_broker
+        return local_broker
+    import confluent_kafka
+    return confluent_kafka
+
+
+def kafka_bootstrap() -> str:
+    return os.getenv("LOCAL_BROKER") or os.getenv("KAFKA_BOOTSTRAP", "kafka:9092")
+
+
+class DashboardEmitter:
+    """Collects dashboard events and sends them in batches from a background task."""
+
+    def __init__(self, mode: str = DASHBOARD_EVENTS_MODE, batch_size: int = DASHBOARD_BATCH_SIZE,
+                 flush_interval: float = DASHBOARD_FLUSH_INTERVAL):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer: OrderedDict = OrderedDict()   # key -> {"type", "data"}
+        self.sequence = itertools.count()          # keys for events that never coalesce
+        self.source = uuid.uuid4().hex             # batch ids are unique per emitter
+        self.batches = itertools.count()
+        self.retry: Optional[Tuple[str, list]] = None   # (batch_id, items) of the batch that failed last
+        self.lock = threading.Lock()               # guards buffer, sequence and counters
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.full: Optional[asyncio.Event] = None   # belongs to self.loop
+        self.task: Optional[asyncio.Task] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self.producer = None
+        self.counters = {"emitted": 0, "coalesced": 0, "sent": 0, "batches": 0, "failed": 0, "dropped": 0}
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Run the sender on loop (default: the running one); call once at startup, from that loop"""
+        if self.task is not None and not self.task.done():
+            return
+        self.loop = loop or asyncio.get_running_loop()
+        self.full = asyncio.Event()
+        self.task = self.loop.create_task(self.run())
+
+    def emit(self, event_type: str, data: dict, key: Hashable = None):
+        """Queue an event without waiting; safe from any thread. Sent once start() has run."""
+        with self.lock:
+            key = (event_type, key) if key is not None else next(self.sequence)
+            if key in self.buffer:
+                self.counters["coalesced"] += 1
+                del self.buffer[key]   # re-append so the latest value keeps its place in time
+            self.buffer[key] = {"type": event_type, "data": data}
+            self.counters["emitted"] += 1
+            self._trim()
+            full = len(self.buffer) >= self.batch_size
+        if full and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.full.set)
+
+    def _trim(self):
+        while len(self.buffer) > DASHBOARD_MAX_BUFFER:
+            self.buffer.popitem(last=False)
+            self.counters["dropped"] += 1
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            await self.flush()
+
+    async def flush(self):
+        while True:
+            with self.lock:
+                if self.retry is not None:
+                    batch_id, items = self.retry
+                    self.retry = None
+                elif not self.buffer:
+                    return
+                else:
+                    count = min(len(self.buffer), self.batch_size)
+                    items = [self.buffer.popitem(last=False) for _ in range(count)]
+                    batch_id = f"{self.source}-{next(self.batches)}"
+            batch = [event for _, event in items]
+            try:
+                await self.send(batch_id, batch)
+            except BaseException as e:
+                # the dashboard may have applied it anyway; resend under the same id so it is applied once
+                with self.lock:
+                    self.retry = (batch_id, items)
+                if not isinstance(e, Exception):
+                    raise
+                with self.lock:
+                    self.counters["failed"] += len(batch)
+                logging.error(f"Failed to notify dashboard of {len(batch)} events: {e}")
+                return
+            with self.lock:
+                self.counters["sent"] += len(batch)
+                self.counters["batches"] += 1
+
+    async def send(self, batch_id: str, batch: List[dict]):
+        if self.mode == "kafka":
+            await asyncio.to_thread(self.produce, batch_id, batch)
+            return
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=5.0)
+        response = await self.client.post(f"{DASHBOARD_URL}/events/batch",
+                                          json={"batch_id": batch_id, "events": batch})
+        response.raise_for_status()
+
+    def produce(self, batch_id: str, batch: List[dict]):
+        if self.producer is None:
+            self.producer = kafka_module().Producer({"bootstrap.servers": kafka_bootstrap()})
+        errors = []
+        self.producer.produce(DASHBOARD_EVENTS_TOPIC, value=json.dumps({"batch_id": batch_id, "events": batch}),
+                              on_delivery=lambda err, msg: err and errors.append(err))
+        remaining = self.producer.flush(5)
+        if remaining:
+            raise RuntimeError(f"{remaining} dashboard event messages still queued after 5s")
+        if errors:
+            raise RuntimeError(f"Dashboard event batch was not delivered: {errors[0]}")
+
+    async def close(self):
+        """Send whatever is still buffered; call on shutdown"""
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.flush()
+        if self.client:
+            await self.client.aclose()
+
+    def metrics(self) -> dict:
+        with self.lock:
+            buffered = len(self.buffer) + (len(self.retry[1]) if self.retry else 0)
+            return {**self.counters, "buffered": buffered, "mode": self.mode}
@@ -14,6 +14,12 @@ def add_record(file_path: str, fieldnames: List[str], data: Dict):
         writer = csv.DictWriter(file, fieldnames=fieldnames)
         writer.writerow(data)
 
+# CREATE MANY (one open for a whole batch)
+def add_records(file_path: str, fieldnames: List[str], rows: List[Dict]):
+    with open(file_path, mode='a', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writerows(rows)
+
 # READ ALL
 def read_all(file_path: str) -> List[Dict]:
     if not os.path.exists(file_path):
@@ -40,6 +46,17 @@ def update_record(file_path: str, fieldnames: List[str], record_id: str, updated
                 row.update(updated_data)
             writer.writerow(row)
 
+# UPDATE MANY BY ID (one rewrite for a whole batch)
+def update_records(file_path: str, fieldnames: List[str], updates: Dict[str, Dict], id_field: str = 'id'):
+    records = read_all(file_path)
+    with open(file_path, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in records:
+            if row[id_field] in updates:
+                row.update(updates[row[id_field]])
+            writer.writerow(row)
+
 # DELETE BY ID
 def delete_record(file_path: str, fieldnames: List[str], record_id: str, id_field: str = 'id'):
     records = read_all(file_path)
@@ -0,0 +1,120 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .csv_api import add_record, read_all, update_records
+from .schema import request_db, request_fields, reservations_db, reservations_fields
+
+# Unknown ids trigger a reload, at most this often, to pick up rows written by other processes
+RELOAD_INTERVAL = 1.0
+
+
+class GateIndex:
+    """
+    In-memory index for turnstile scans: reservation_id -> (reservation, request).
+
+    A reservation belongs to the user's first request for the same match, which
+    is what check_in/check_out used to find by scanning requests.csv and then
+    reservations.csv once per request. Both files are append-only for the rows
+    indexed here, so the index is loaded once and kept current by the backend's
+    own writes, with a throttled reload when an id is not found.
+
+    Check-in state lives here too. The requests.csv latest_status column is
+    written back in batches by flush() instead of rewriting the file per scan.
+    """
+
+    def __init__(self, reservations_path: str = reservations_db, requests_path: str = request_db):
+        self.reservations_path = reservations_path
+        self.requests_path = requests_path
+        self.lock = threading.Lock()
+        self.reservations: Dict[str, dict] = {}                 # reservation_id -> row
+        self.requests: Dict[str, dict] = {}                     # request_id -> row
+        self.first_request: Dict[Tuple[str, str], str] = {}    # (user_name, match_id) -> request_id
+        self.pending_status: Dict[str, str] = {}               # request_id -> latest_status to write
+        self.last_scan: Dict[str, float] = {}                  # request_id -> epoch of the last gate transition
+        self.loaded = False
+        self.last_reload = {"reservations": 0.0, "requests": 0.0}
+
+    # ── loading ──
+
+    def load(self):
+        with self.lock:
+            self._load_reservations()
+            self._load_requests()
+            self.loaded = True
+
+    def _load_reservations(self):
+        for row in read_all(self.reservations_path):
+            self.reservations.setdefault(row["reservation_id"], row)
+        self.last_reload["reservations"] = time.monotonic()
+
+    def _load_requests(self):
+        for row in read_all(self.requests_path):
+            if row["request_id"] in self.requests:
+                continue   # the in-memory status is newer than the file
+            self._index_request(row)
+        self.last_reload["requests"] = time.monotonic()
+
+    def _index_request(self, row: dict):
+        self.requests[row["request_id"]] = row
+        self.first_request.setdefault((row["user_name"], row["match_id"]), row["request_id"])
+
+    def _reload_allowed(self, name: str) -> bool:
+        return time.monotonic() - self.last_reload[name] >= RELOAD_INTERVAL
+
+    # ── writes made by the backend ──
+
+    def add_reservation(self, reservation: dict):
+        with self.lock:
+            add_record(self.reservations_path, reservations_fields, reservation)
+            if self.loaded:
+                self.reservations[reservation["reservation_id"]] = dict(reservation)
+
+    def add_request(self, request: dict):
+        with self.lock:
+            add_record(self.requests_path, request_fields, request)
+            if self.loaded:
+                self._index_request(dict(request))
+
+    # ── turnstile path ──
+
+    def resolve(self, reservation_id: str) -> Tuple[Optional[dict], Optional[dict]]:
+        """The reservation and the request it belongs to; None for whichever is missing"""
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            reservation = self.reservations.get(reservation_id)
+            if reservation is None and self._reload_allowed("reservations"):
+                self._load_reservations()
+                reservation = self.reservations.get(reservation_id)
+            if reservation is None:
+                return None, None
+
+            key = (reservation["user_name"], reservation["match_id"])
+            request_id = self.first_request.get(key)
+            if request_id is None and self._reload_allowed("requests"):
+                self._load_requests()
+                request_id = self.first_request.get(key)
+            return reservation, self.requests.get(request_id) if request_id else None
+
+    def set_status(self, request_id: str, status: str, scanned_at: Optional[float] = None):
+        """Record a request's new latest_status now; flush() writes it to the CSV"""
+        with self.lock:
+            self.requests[request_id]["latest_status"] = status
+            self.pending_status[request_id] = status
+            if scanned_at is not None:
+                self.last_scan[request_id] = max(scanned_at, self.last_scan.get(request_id, scanned_at))
+
+    def flush(self) -> int:
+        """Write pending latest_status changes to requests.csv in one rewrite"""
+        with self.lock:
+            if not self.pending_status:
+                return 0
+            pending, self.pending_status = self.pending_status, {}
+            update_records(
+                self.requests_path,
+                request_fields,
+                {request_id: {"latest_status": status} for request_id, status in pending.items()},
+                "request_id"
+            )
+            return len(pending)
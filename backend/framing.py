@@ -0,0 +1,84 @@
+# framing.py
+"""
+Length-prefixed JSON frames for the coordinator protocol (reserving.py <-> waiting.py).
+
+A frame is a 4-byte big-endian payload length followed by that many bytes of
+UTF-8 JSON. Unlike reading a socket with recv(4096) and hoping it holds one
+line, the readers here reassemble frames that TCP split across reads and
+separate frames that arrived together.
+"""
+
+import asyncio
+import json
+import select
+import socket
+import struct
+
+HEADER = struct.Struct(">I")
+MAX_FRAME = 1 << 20   # 1 MiB; a batch of a few thousand users fits easily
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame(payload) -> bytes:
+    body = json.dumps(payload).encode()
+    if len(body) > MAX_FRAME:
+        raise FrameError(f"frame of {len(body)} bytes exceeds {MAX_FRAME}")
+    return HEADER.pack(len(body)) + body
+
+
+def decode_length(header: bytes) -> int:
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise FrameError(f"frame of {length} bytes exceeds {MAX_FRAME}")
+    return length
+
+
+async def read_frame(reader: asyncio.StreamReader, header: bytes = b""):
+    """Next frame from an asyncio stream; header may hold bytes already consumed"""
+    header += await reader.readexactly(HEADER.size - len(header))
+    body = await reader.readexactly(decode_length(header))
+    return json.loads(body)
+
+
+def send_frame(sock: socket.socket, payload):
+    sock.sendall(encode_frame(payload))
+
+
+class FrameReader:
+    """Buffered frame reader for a blocking socket"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def complete(self) -> bool:
+        """Whether a whole frame is already buffered"""
+        if len(self.buffer) < HEADER.size:
+            return False
+        return len(self.buffer) >= HEADER.size + decode_length(bytes(self.buffer[:HEADER.size]))
+
+    def ready(self, timeout: float) -> bool:
+        """Wait up to timeout for a whole frame; True if read_frame() will not block"""
+        if self.complete():
+            return True
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if readable:
+            self.fill()
+        return self.complete()
+
+    def fill(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("connection closed by peer")
+        self.buffer += chunk
+
+    def read_frame(self):
+        while not self.complete():
+            self.fill()
+        length = decode_length(bytes(self.buffer[:HEADER.size]))
+        body = bytes(self.buffer[HEADER.size:HEADER.size + length])
+        del self.buffer[:HEADER.size + length]
+        return json.loads(body)
@@ -0,0 +1,98 @@
+# gate_benchmark.py
+"""
+Turnstile throughput: resolving scanned reservations at kick-off.
+
+Builds a throwaway db/ with one match of N reservations (one request each) and
+compares the old check-in lookup, which scanned reservations.csv and
+requests.csv per scan, with GateIndex. The old path is timed on a sample
+because it is quadratic-ish in the file sizes.
+
+    python gate_benchmark.py --reservations 50000 --sample 20
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from db.csv_api import add_record, initialize_db, search_records
+from db.gate_index import GateIndex
+from db.schema import request_db, request_fields, reservations_db, reservations_fields
+
+
+def build_dataset(count: int, match_id: str = "1"):
+    initialize_db(reservations_db, reservations_fields)
+    initialize_db(request_db, request_fields)
+    for i in range(count):
+        user_name = f"fan_{i}"
+        add_record(request_db, request_fields, {
+            "request_id": f"req-{i}", "user_name": user_name, "match_id": match_id,
+            "catagory": "Standard", "latest_status": "Reserved"
+        })
+        add_record(reservations_db, reservations_fields, {
+            "reservation_id": f"res-{i}", "user_name": user_name, "match_id": match_id, "seat_id": str(i)
+        })
+
+
+def scan_lookup(reservation_id: str):
+    """The lookup check_in/check_out did before the index"""
+    reservation = search_records(reservations_db, {"reservation_id": reservation_id})
+    if not reservation:
+        return None
+    request_records = search_records(request_db, {
+        "user_name": reservation[0]["user_name"],
+        "match_id": reservation[0]["match_id"]
+    })
+    for req in request_records:
+        if search_records(reservations_db, {
+            "user_name": req["user_name"],
+            "match_id": req["match_id"],
+            "seat_id": reservation[0]["seat_id"]
+        }):
+            return req
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gate check-in lookup benchmark")
+    parser.add_argument("--reservations", type=int, default=50000)
+    parser.add_argument("--sample", type=int, default=20, help="scans timed on the old path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.mkdir("db")
+
+        started = time.perf_counter()
+        build_dataset(args.reservations)
+        print(f"Built {args.reservations} reservations in {time.perf_counter() - started:.1f}s")
+
+        step = max(1, args.reservations // args.sample)
+        sample = [f"res-{i}" for i in range(0, args.reservations, step)][:args.sample]
+        started = time.perf_counter()
+        for reservation_id in sample:
+            assert scan_lookup(reservation_id) is not None
+        per_scan = (time.perf_counter() - started) / len(sample)
+        print(f"Old scan lookup: {per_scan * 1000:.1f} ms per scan, {1 / per_scan:.1f} scans/s")
+
+        index = GateIndex()
+        started = time.perf_counter()
+        index.load()
+        print(f"GateIndex load:  {time.perf_counter() - started:.2f}s (once at startup)")
+
+        started = time.perf_counter()
+        for i in range(args.reservations):
+            reservation, request = index.resolve(f"res-{i}")
+            assert request is not None and request["latest_status"] != "checked_in"
+            index.set_status(request["request_id"], "checked_in")
+        elapsed = time.perf_counter() - started
+        print(f"GateIndex check-in of all {args.reservations}: {elapsed:.2f}s, "
+              f"{args.reservations / elapsed:.0f} scans/s")
+
+        started = time.perf_counter()
+        written = index.flush()
+        print(f"Batched latest_status write of {written} rows: {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,21 @@
 # service.py
 from fastapi import FastAPI, Request
-from confluent_kafka import Producer
+import asyncio
+import httpx
 import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from rate_limit import EdgeLimiter, client_ip
+if os.getenv("LOCAL_BROKER"):
+    # stand-in broker for running the services on one machine, see local_broker.py
+    from local_broker import KafkaException, Producer
+else:
+    from confluent_kafka import KafkaException, Producer
 
 # logging
 import logging
@@ -10,11 +23,32 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(mess
 logger = logging.getLogger("kafka_api")
 
 app = FastAPI()
-req_ids = []
+
+# Request ID dedup: how long an ID is remembered, how many are kept in memory,
+# and an optional SQLite file shared by replicas (and surviving restarts)
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "1000000"))
+DEDUP_DB = os.getenv("DEDUP_DB", "")
+PUBLISH_BATCH_MAX = int(os.getenv("PUBLISH_BATCH_MAX", "1000"))   # entries accepted per /publish/batch call
+# Addresses of gateways that coalesce many users; only they may batch past the per-IP limit
+TRUSTED_GATEWAYS = {ip.strip() for ip in os.getenv("PUBLISH_TRUSTED_GATEWAYS", "").split(",") if ip.strip()}
+
+# Known topics and sold-out categories, refreshed from the backend
+BACKEND_API = os.getenv("BACKEND_API", "http://backend:8001/api/general")
+TOPIC_REFRESH_INTERVAL = float(os.getenv("TOPIC_REFRESH_INTERVAL", "10"))
+TOPIC_MISS_REFRESH = 2.0   # an unknown topic triggers an early refresh at most this often
+CATEGORIES = ["vip", "premium", "standard"]
+
+# Per-user / per-IP token buckets and load shedding (PUBLISH_USER_RATE, PUBLISH_MAX_INFLIGHT, ...)
+limiter = EdgeLimiter("PUBLISH")
 
 # Kafka Producer configuration
 producer_config = {
-    'bootstrap.servers': 'kafka:9092'  # Update as needed
+    'bootstrap.servers': os.getenv("LOCAL_BROKER") or os.getenv("KAFKA_BOOTSTRAP", "kafka:9092"),
+    # how long librdkafka waits to fill a batch, and how big batches get
+    'linger.ms': int(os.getenv("PRODUCER_LINGER_MS", "5")),
+    'batch.num.messages': int(os.getenv("PRODUCER_BATCH_MESSAGES", "10000")),
+    'queue.buffering.max.messages': int(os.getenv("PRODUCER_QUEUE_MESSAGES", "100000")),
 }
 producer = Producer(producer_config)
 
@@ -26,18 +60,312 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def refused(refusal):
+    status_code, retry_after, reason = refusal
+    return JSONResponse(
+        status_code=status_code,
+        content={"status": "error", "details": reason},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+@app.middleware("http")
+async def shed_load(request: Request, call_next):
+    """Refuse publishes with 503 once too many are in flight"""
+    if not request.url.path.startswith("/publish"):
+        return await call_next(request)
+    refusal = limiter.enter()
+    if refusal:
+        return refused(refusal)
+    try:
+        return await call_next(request)
+    finally:
+        limiter.leave()
+
 def delivery_report(err, msg):
     if err is not None:
         logging.info(f"Delivery failed for record {msg.key()}: {err}")
     else:
-        logging.info(f"Record {msg.key()} successfully produced to {msg.topic()} [{msg.partition()}] at offset {msg.offset()}")
+        logging.debug(f"Record {msg.key()} successfully produced to {msg.topic()} [{msg.partition()}] at offset {msg.offset()}")
+
+
+class SharedDedup:
+    """Request IDs in a SQLite file, so replicas on a shared volume agree and restarts remember"""
+
+    PURGE_EVERY = 10000   # inserts between sweeps of expired IDs
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.inserts = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS request_ids (request_id TEXT PRIMARY KEY, expires_at REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS request_ids_expiry ON request_ids (expires_at)")
+
+    def seen_or_add(self, request_id: str) -> bool:
+        with self.lock:
+            return self._seen_or_add_locked(request_id)
+
+    def seen_or_add_many(self, request_ids):
+        """Same as seen_or_add for a whole batch, in one transaction"""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                result = [self._seen_or_add_locked(request_id) for request_id in request_ids]
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _seen_or_add_locked(self, request_id: str) -> bool:
+        now = time.time()
+        # inserts a new ID or revives an expired one; a live duplicate changes no row
+        cursor = self.conn.execute(
+            "INSERT INTO request_ids VALUES (?, ?) ON CONFLICT(request_id) DO UPDATE "
+            "SET expires_at = excluded.expires_at WHERE request_ids.expires_at < ?",
+            (request_id, now + self.ttl, now)
+        )
+        self.inserts += 1
+        if self.inserts % self.PURGE_EVERY == 0:
+            self.conn.execute("DELETE FROM request_ids WHERE expires_at < ?", (now,))
+        return cursor.rowcount == 0
+
+    def discard(self, request_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM request_ids WHERE request_id = ?", (request_id,))
+
+
+class DedupStore:
+    """Bounded set of recently seen request IDs with time-based expiry.
+
+    IDs sit in an OrderedDict in arrival order; with a fixed TTL that is also
+    expiry order, so expired IDs are dropped from the front as new ones come in
+    and every operation is O(1). Past max_entries the oldest IDs are evicted
+    early. With a shared store the local set only caches positive answers.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, shared: SharedDedup = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.expiry: OrderedDict = OrderedDict()   # request_id -> monotonic expiry
+
+    def _evict(self, now: float):
+        while self.expiry:
+            request_id, expires_at = next(iter(self.expiry.items()))
+            if expires_at > now and len(self.expiry) <= self.max_entries:
+                break
+            self.expiry.popitem(last=False)
+
+    def _seen_locally(self, request_id: str, now: float) -> bool:
+        expires_at = self.expiry.get(request_id)
+        return expires_at is not None and expires_at > now
+
+    def _remember(self, request_id: str, now: float):
+        self.expiry[request_id] = now + self.ttl
+        self.expiry.move_to_end(request_id)
+        self._evict(now)
+
+    async def seen_or_add(self, request_id: str) -> bool:
+        """True if the ID was seen within the TTL; otherwise records it"""
+        now = time.monotonic()
+        if self._seen_locally(request_id, now):
+            return True
+        duplicate = False
+        if self.shared is not None:
+            duplicate = await asyncio.to_thread(self.shared.seen_or_add, request_id)
+        self._remember(request_id, now)
+        return duplicate
+
+    async def seen_or_add_many(self, request_ids):
+        """seen_or_add for a batch; repeats within the batch count as duplicates"""
+        now = time.monotonic()
+        result = [self._seen_locally(request_id, now) for request_id in request_ids]
+        fresh = [i for i, seen in enumerate(result) if not seen]
+        if self.shared is not None and fresh:
+            shared = await asyncio.to_thread(self.shared.seen_or_add_many, [request_ids[i] for i in fresh])
+            for i, duplicate in zip(fresh, shared):
+                result[i] = duplicate
+        for i in fresh:
+            if self._seen_locally(request_ids[i], now):
+                result[i] = True   # repeated earlier in this batch
+            else:
+                self._remember(request_ids[i], now)
+        return result
+
+    async def discard(self, request_id: str):
+        """Forget an ID whose publish failed, so the client can retry it"""
+        self.expiry.pop(request_id, None)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.discard, request_id)
+
+
+dedup = DedupStore(DEDUP_TTL, DEDUP_MAX_ENTRIES, SharedDedup(DEDUP_DB, DEDUP_TTL) if DEDUP_DB else None)
+
+
+class TopicCache:
+    """Valid match.{id}.{category} topics and the categories that are sold out.
+
+    Joins for unknown topics or sold-out categories are rejected here instead
+    of queueing users who can never get a seat. Until the first refresh
+    succeeds every topic is let through.
+    """
+
+    def __init__(self):
+        self.topics = set()
+        self.sold_out = set()
+        self.loaded = False
+        self.refreshed_at = 0.0
+        self.attempted_at = 0.0   # last refresh attempt, failed ones included
+        self.lock = asyncio.Lock()
+
+    async def refresh(self, max_age: float = None):
+        """Reload from the backend; with max_age, skip if an attempt was made that recently.
+
+        The age is checked under the lock, so joins that queue up behind one
+        refresh reuse its result instead of running one refresh each.
+        """
+        async with self.lock:
+            if max_age is not None and time.monotonic() - self.attempted_at <= max_age:
+                return
+            self.attempted_at = time.monotonic()
+            async with httpx.AsyncClient() as client:
+                matches = (await client.get(BACKEND_API + "/matches")).json()
+                availability = (await client.get(BACKEND_API + "/availability")).json()
+            self.topics = {f"match.{match['match_id']}.{cat}" for match in matches for cat in CATEGORIES}
+            self.sold_out = {
+                f"match.{match_id}.{catagory.lower()}"
+                for match_id, counts in availability.items()
+                for catagory, available in counts.items()
+                if available == 0
+            }
+            self.loaded = True
+            self.refreshed_at = time.monotonic()
+
+    async def rejection(self, topic: str):
+        """Why a join for this topic must be refused, or None if it may go ahead"""
+        if not self.loaded:
+            return None
+        if topic not in self.topics and time.monotonic() - self.attempted_at > TOPIC_MISS_REFRESH:
+            # the match may have been added since the last refresh
+            try:
+                await self.refresh(max_age=TOPIC_MISS_REFRESH)
+            except Exception as e:
+                logging.error(f"Failed to refresh topics: {e}")
+        if topic not in self.topics:
+            return f"Unknown topic {topic}."
+        if topic in self.sold_out:
+            return "This category is sold out."
+        return None
+
+
+topic_cache = TopicCache()
+
+async def refresh_topic_cache():
+    while True:
+        try:
+            await topic_cache.refresh()
+        except Exception as e:
+            logging.error(f"Failed to refresh topics: {e}")
+        await asyncio.sleep(TOPIC_REFRESH_INTERVAL)
+
+
+class AsyncProducer:
+    """Lets each request await the delivery of its own message.
+
+    produce() only enqueues into librdkafka and returns a future. A single
+    background thread drives producer.poll(), which fires the delivery
+    callbacks, and each callback resolves its request's future on the event
+    loop. Concurrent joins therefore share broker round trips (linger.ms)
+    instead of paying one flush each.
+    """
+
+    def __init__(self, producer):
+        self.producer = producer
+        self.loop = None
+        self.stop = threading.Event()
+        self.thread = None
+
+    def start(self, loop):
+        self.loop = loop
+        self.thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self.thread.start()
+
+    def _poll_loop(self):
+        while not self.stop.is_set():
+            self.producer.poll(0.1)
+
+    def _resolve(self, future, err, msg):
+        if future.done():
+            return
+        if err is not None:
+            future.set_exception(KafkaException(err))
+        else:
+            future.set_result(msg)
+
+    async def _enqueue(self, topic: str, value: str):
+        future = self.loop.create_future()
+
+        def on_delivery(err, msg):
+            delivery_report(err, msg)
+            self.loop.call_soon_threadsafe(self._resolve, future, err, msg)
+
+        while True:
+            try:
+                self.producer.produce(topic, value=value, on_delivery=on_delivery)
+                break
+            except BufferError:
+                # local queue is full; the poll thread is draining it
+                await asyncio.sleep(0.01)
+        return future
+
+    async def produce(self, topic: str, value: str):
+        return await (await self._enqueue(topic, value))
+
+    async def produce_many(self, messages):
+        """Enqueue (topic, value) pairs back to back and wait for all deliveries.
+
+        Returns one message or exception per pair, in order.
+        """
+        futures = [await self._enqueue(topic, value) for topic, value in messages]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def close(self):
+        self.stop.set()
+        if self.thread:
+            self.thread.join()
+        self.producer.flush()
+
+
+async_producer = AsyncProducer(producer)
+
+@app.on_event("startup")
+async def start_producer():
+    async_producer.start(asyncio.get_running_loop())
+    asyncio.create_task(refresh_topic_cache())
+
+@app.on_event("shutdown")
+async def stop_producer():
+    await asyncio.to_thread(async_producer.close)
 
 @app.post("/publish")
 async def publish_message(request: Request, topic: str = None, request_id: str = None, username: str = None):
 
-    if request_id in req_ids:
+    if not topic or not request_id or not username:
+        logging.info(f"Missing required fields: topic={topic}, request_id={request_id}, username={username}")
+        return {"status": "error", "details": "Both 'topic' and 'message' fields are required."}
+
+    refusal = limiter.check(username, client_ip(request.headers, request.client))
+    if refusal:
+        return refused(refusal)
+
+    rejection = await topic_cache.rejection(topic)
+    if rejection:
+        return {"status": "error", "details": rejection}
+
+    if await dedup.seen_or_add(request_id):
         return {"status": "error", "details": "Request ID already exists."}
-    req_ids.append(request_id)
 
     # create json message containing request_id and username
     message = {
@@ -45,20 +373,94 @@ async def publish_message(request: Request, topic: str = None, request_id: str =
         "username": username
     }
 
-    if not topic or not request_id or not username:
-        logging.info(f"Missing required fields: topic={topic}, request_id={request_id}, username={username}")
-        return {"status": "error", "details": "Both 'topic' and 'message' fields are required."}
-
     try:
         logging.info(f"Producing message to topic {topic}: {message}")
-        producer.produce(topic, value=json.dumps(message), callback=delivery_report)
-        producer.flush()
+        await async_producer.produce(topic, json.dumps(message))
         return {"status": "success", "topic": topic, "message": message}
     except Exception as e:
         logging.error(f"Failed to produce message: {e}")
+        await dedup.discard(request_id)
         return {"status": "error", "details": str(e)}
     
 
+@app.post("/publish/batch")
+async def publish_batch(request: Request, data: dict):
+    """
+    Publish many queue joins in one call
+    Input:
+    {
+        "entries": [
+            {"topic": "match.1.vip", "request_id": "uuid", "username": "john"},
+            ...
+        ]
+    }
+    Returns one result per entry, in order.
+    """
+    entries = data.get("entries") or []
+    if len(entries) > PUBLISH_BATCH_MAX:
+        return {"status": "error", "details": f"At most {PUBLISH_BATCH_MAX} entries per batch."}
+
+    # every entry costs the address a token, except for trusted gateways that pay once per call;
+    # each user still pays per entry below
+    ip = client_ip(request.headers, request.client)
+    cost = 1 if ip in TRUSTED_GATEWAYS else max(len(entries), 1)
+    if cost > limiter.ips.burst:
+        return {"status": "error", "details": f"At most {int(limiter.ips.burst)} entries per batch from this address."}
+    refusal = limiter.check(None, ip, cost=cost)
+    if refusal:
+        return refused(refusal)
+
+    results = [None] * len(entries)
+    valid = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not all(entry.get(field) for field in ("topic", "request_id", "username")):
+            results[i] = {"status": "error", "details": "'topic', 'request_id' and 'username' are required."}
+            continue
+        refusal = limiter.check(entry["username"], None)
+        if refusal:
+            results[i] = {"status": "error", "details": refusal[2], "retry_after": refusal[1]}
+            continue
+        rejection = await topic_cache.rejection(entry["topic"])
+        if rejection:
+            results[i] = {"status": "error", "details": rejection}
+        else:
+            valid.append(i)
+
+    duplicates = await dedup.seen_or_add_many([entries[i]["request_id"] for i in valid])
+    to_send = []
+    for i, duplicate in zip(valid, duplicates):
+        if duplicate:
+            results[i] = {"status": "error", "details": "Request ID already exists."}
+        else:
+            to_send.append(i)
+
+    messages = [
+        (entries[i]["topic"], {"request_id": entries[i]["request_id"], "username": entries[i]["username"]})
+        for i in to_send
+    ]
+    logging.info(f"Producing batch of {len(messages)} messages")
+    delivered = await async_producer.produce_many([(topic, json.dumps(message)) for topic, message in messages])
+    for i, (topic, message), outcome in zip(to_send, messages, delivered):
+        if isinstance(outcome, Exception):
+            logging.error(f"Failed to produce message: {outcome}")
+            await dedup.discard(message["request_id"])
+            results[i] = {"status": "error", "details": str(outcome)}
+        else:
+            results[i] = {"status": "success", "topic": topic, "message": message}
+
+    return {
+        "status": "success",
+        "published": sum(1 for result in results if result["status"] == "success"),
+        "results": results
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Rate limiting and load shedding counters"""
+    return limiter.metrics()
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,385 @@
+# local_broker.py
+"""
+Stand-in for the Kafka broker when running the queue services on one machine.
+
+It implements the slice of confluent_kafka that queuing.py and kafka_api.py use
+(Producer, Consumer, AdminClient, NewTopic, TopicPartition, KafkaError,
+KafkaException) on top of a tiny HTTP server, so several local processes can
+share topics and committed offsets without a real cluster. Every topic has a
+single partition and a consumer group's position is its committed offset.
+
+Start the broker, then point the services at it with LOCAL_BROKER:
+
+    python local_broker.py --port 9099
+    LOCAL_BROKER=127.0.0.1:9099 uvicorn queuing:app --port 8002
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+OFFSET_BEGINNING = -2
+OFFSET_END = -1
+OFFSET_INVALID = -1001
+
+
+# ─── SERVER ─────────────────────────────────────────────────────────────────────
+
+class BrokerState:
+    def __init__(self):
+        self.logs: Dict[str, List[Tuple[str, str]]] = {}      # topic -> [(key, value)]
+        self.committed: Dict[Tuple[str, str], int] = {}       # (group, topic) -> next offset
+        self.cond = threading.Condition()
+
+    def create_topics(self, topics):
+        results = {}
+        with self.cond:
+            for topic in topics:
+                if topic in self.logs:
+                    results[topic] = KafkaError.TOPIC_ALREADY_EXISTS
+                else:
+                    self.logs[topic] = []
+                    results[topic] = None
+        return {"results": results}
+
+    def delete_topics(self, topics):
+        results = {}
+        with self.cond:
+            for topic in topics:
+                results[topic] = None if self.logs.pop(topic, None) is not None else KafkaError.UNKNOWN_TOPIC_OR_PART
+        return {"results": results}
+
+    def produce(self, topic, messages):
+        with self.cond:
+            log = self.logs.setdefault(topic, [])
+            first = len(log)
+            log.extend((m.get("key"), m["value"]) for m in messages)
+            self.cond.notify_all()
+        return {"offsets": list(range(first, first + len(messages)))}
+
+    def fetch(self, topic, offset, max_messages, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while len(self.logs.get(topic, [])) <= offset:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {"messages": []}
+                self.cond.wait(remaining)
+            log = self.logs[topic]
+            batch = log[offset:offset + max_messages]
+        return {"messages": [
+            {"offset": offset + i, "key": key, "value": value}
+            for i, (key, value) in enumerate(batch)
+        ]}
+
+    def commit(self, group, topic, offset):
+        with self.cond:
+            self.committed[(group, topic)] = offset
+        return {}
+
+    def committed_offset(self, group, topic):
+        with self.cond:
+            return {"offset": self.committed.get((group, topic))}
+
+    def watermarks(self, topic):
+        with self.cond:
+            return {"low": 0, "high": len(self.logs.get(topic, []))}
+
+
+def serve(host: str, port: int):
+    state = BrokerState()
+    routes = {
+        "/create_topics": lambda body: state.create_topics(body["topics"]),
+        "/delete_topics": lambda body: state.delete_topics(body["topics"]),
+        "/produce": lambda body: state.produce(body["topic"], body["messages"]),
+        "/fetch": lambda body: state.fetch(body["topic"], body["offset"], body["max"], body["timeout"]),
+        "/commit": lambda body: state.commit(body["group"], body["topic"], body["offset"]),
+        "/committed": lambda body: state.committed_offset(body["group"], body["topic"]),
+        "/watermarks": lambda body: state.watermarks(body["topic"]),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            route = routes.get(self.path)
+            if route is None:
+                self.send_error(404)
+                return
+            payload = json.dumps(route(body)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"[LocalBroker] Listening on {host}:{port}")
+    server.serve_forever()
+
+
+# ─── CLIENT ─────────────────────────────────────────────────────────────────────
+
+def _call(servers: str, path: str, body: dict, timeout: float = 30.0) -> dict:
+    request = urllib.request.Request(
+        f"http://{servers.split(',')[0]}{path}",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class KafkaError:
+    UNKNOWN_TOPIC_OR_PART = 3
+    TOPIC_ALREADY_EXISTS = 36
+    _PARTITION_EOF = -191
+
+    def __init__(self, code: int, reason: str = ""):
+        self._code = code
+        self._reason = reason
+
+    def code(self) -> int:
+        return self._code
+
+    def str(self) -> str:
+        return self._reason
+
+    def __str__(self):
+        return f"KafkaError(code={self._code}, {self._reason!r})"
+
+
+class KafkaException(Exception):
+    pass
+
+
+class TopicPartition:
+    def __init__(self, topic: str, partition: int = 0, offset: int = OFFSET_INVALID):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+
+    def __repr__(self):
+        return f"TopicPartition({self.topic!r}, {self.partition}, {self.offset})"
+
+
+class NewTopic:
+    def __init__(self, topic: str, num_partitions: int = 1, replication_factor: int = 1):
+        self.topic = topic
+        self.num_partitions = num_partitions
+        self.replication_factor = replication_factor
+
+
+class Message:
+    def __init__(self, topic: str, offset: int, key, value, error: KafkaError = None):
+        self._topic = topic
+        self._offset = offset
+        self._key = key.encode() if isinstance(key, str) else key
+        self._value = value.encode() if isinstance(value, str) else value
+        self._error = error
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return 0
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def error(self):
+        return self._error
+
+
+class _Future:
+    def __init__(self, error_code):
+        self._error_code = error_code
+
+    def result(self, timeout=None):
+        if self._error_code is not None:
+            raise KafkaException(KafkaError(self._error_code))
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return value.decode()
+
+
+class AdminClient:
+    def __init__(self, conf: dict):
+        self.servers = conf["bootstrap.servers"]
+
+    def create_topics(self, new_topics: List[NewTopic], **kwargs):
+        results = _call(self.servers, "/create_topics", {"topics": [t.topic for t in new_topics]})["results"]
+        return {topic: _Future(code) for topic, code in results.items()}
+
+    def delete_topics(self, topics: List[str], **kwargs):
+        results = _call(self.servers, "/delete_topics", {"topics": list(topics)})["results"]
+        return {topic: _Future(code) for topic, code in results.items()}
+
+
+class Producer:
+    """Buffers messages until poll() or flush(), then ships each topic's batch in one call."""
+
+    def __init__(self, conf: dict):
+        self.servers = conf["bootstrap.servers"]
+        self.batch_size = int(conf.get("batch.num.messages", 10000))
+        self.pending: List[Tuple[str, str, str, object]] = []
+        self.lock = threading.Lock()
+
+    def produce(self, topic, value=None, key=None, callback=None, on_delivery=None, **kwargs):
+        with self.lock:
+            if len(self.pending) >= 100000:
+                raise BufferError("Local queue full")
+            self.pending.append((topic, _text(key), _text(value), callback or on_delivery))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def _send(self) -> int:
+        with self.lock:
+            pending, self.pending = self.pending, []
+        by_topic: Dict[str, list] = {}
+        for entry in pending:
+            by_topic.setdefault(entry[0], []).append(entry)
+        for topic, entries in by_topic.items():
+            for start in range(0, len(entries), self.batch_size):
+                chunk = entries[start:start + self.batch_size]
+                error, offsets = None, [OFFSET_INVALID] * len(chunk)
+                try:
+                    offsets = _call(self.servers, "/produce", {
+                        "topic": topic,
+                        "messages": [{"key": key, "value": value} for _, key, value, _ in chunk]
+                    })["offsets"]
+                except Exception as e:
+                    error = KafkaError(-1, str(e))
+                for (_, key, value, callback), offset in zip(chunk, offsets):
+                    if callback:
+                        callback(error, Message(topic, offset, key, value, error))
+        return len(pending)
+
+    def poll(self, timeout: float = 0) -> int:
+        served = self._send()
+        if not served and timeout and timeout > 0:
+            time.sleep(min(timeout, 0.05))
+        return served
+
+    def flush(self, timeout: float = None) -> int:
+        self._send()
+        return 0
+
+
+class Consumer:
+    """Single-partition consumer; without an explicit assign() it starts at the committed offset."""
+
+    def __init__(self, conf: dict):
+        self.servers = conf["bootstrap.servers"]
+        self.group = conf["group.id"]
+        self.reset = conf.get("auto.offset.reset", "latest")
+        self.auto_commit = str(conf.get("enable.auto.commit", True)).lower() == "true"
+        self.positions: Dict[str, int] = {}
+        self.paused = set()
+        self.closed = False
+
+    def _start_offset(self, topic: str, offset: int = OFFSET_INVALID) -> int:
+        if offset >= 0:
+            return offset
+        if offset == OFFSET_INVALID:
+            committed = _call(self.servers, "/committed", {"group": self.group, "topic": topic})["offset"]
+            if committed is not None:
+                return committed
+        if offset == OFFSET_BEGINNING or (offset == OFFSET_INVALID and self.reset == "earliest"):
+            return 0
+        return _call(self.servers, "/watermarks", {"topic": topic})["high"]
+
+    def subscribe(self, topics: List[str], **kwargs):
+        self.positions = {topic: self._start_offset(topic) for topic in topics}
+
+    def assign(self, partitions: List[TopicPartition]):
+        self.positions = {tp.topic: self._start_offset(tp.topic, tp.offset) for tp in partitions}
+
+    def pause(self, partitions: List[TopicPartition]):
+        self.paused.update(tp.topic for tp in partitions)
+
+    def resume(self, partitions: List[TopicPartition]):
+        self.paused.difference_update(tp.topic for tp in partitions)
+
+    def consume(self, num_messages: int = 1, timeout: float = -1) -> List[Message]:
+        active = [topic for topic in self.positions if topic not in self.paused]
+        if not active:
+            time.sleep(max(timeout, 0) if timeout >= 0 else 1.0)
+            return []
+        wait = (timeout if timeout >= 0 else 3600.0) / len(active)
+        messages = []
+        for topic in active:
+            try:
+                fetched = _call(self.servers, "/fetch", {
+                    "topic": topic,
+                    "offset": self.positions[topic],
+                    "max": num_messages - len(messages),
+                    "timeout": wait
+                }, timeout=wait + 30)["messages"]
+            except Exception as e:
+                return messages + [Message(topic, OFFSET_INVALID, None, None, KafkaError(-1, str(e)))]
+            for m in fetched:
+                messages.append(Message(topic, m["offset"], m["key"], m["value"]))
+            if fetched:
+                self.positions[topic] = fetched[-1]["offset"] + 1
+                if self.auto_commit:
+                    self._commit_offset(topic, self.positions[topic])
+            if len(messages) >= num_messages:
+                break
+        return messages
+
+    def poll(self, timeout: float = -1):
+        messages = self.consume(1, timeout)
+        return messages[0] if messages else None
+
+    def _commit_offset(self, topic: str, offset: int):
+        _call(self.servers, "/commit", {"group": self.group, "topic": topic, "offset": offset})
+
+    def commit(self, message: Message = None, offsets: List[TopicPartition] = None, asynchronous: bool = True):
+        if message is not None:
+            self._commit_offset(message.topic(), message.offset() + 1)
+        elif offsets is not None:
+            for tp in offsets:
+                self._commit_offset(tp.topic, tp.offset)
+        else:
+            for topic, position in self.positions.items():
+                self._commit_offset(topic, position)
+
+    def committed(self, partitions: List[TopicPartition], timeout: float = None) -> List[TopicPartition]:
+        result = []
+        for tp in partitions:
+            offset = _call(self.servers, "/committed", {"group": self.group, "topic": tp.topic})["offset"]
+            result.append(TopicPartition(tp.topic, tp.partition, OFFSET_INVALID if offset is None else offset))
+        return result
+
+    def get_watermark_offsets(self, partition: TopicPartition, timeout: float = None, cached: bool = False):
+        marks = _call(self.servers, "/watermarks", {"topic": partition.topic})
+        return marks["low"], marks["high"]
+
+    def close(self):
+        self.closed = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Kafka stand-in for the queue services")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9099)
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -0,0 +1,70 @@
+# queue_cluster.py
+"""
+Run several queuing.py instances against the local broker stand-in.
+
+    python queue_cluster.py --instances 3
+
+Instance i listens on base-port + i and owns its share of the topics. To
+rebalance, PUT the new peer list to every instance's /peers endpoint, e.g.
+
+    curl -X PUT localhost:8101/peers -H 'Content-Type: application/json' \
+         -d '{"peers": {"q1": "http://127.0.0.1:8101", "q2": "http://127.0.0.1:8102"}}'
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local multi-instance queue service")
+    parser.add_argument("--instances", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=8100)
+    parser.add_argument("--broker-port", type=int, default=9099)
+    parser.add_argument("--matches-api", default="http://127.0.0.1:8001/api/general/matches")
+    parser.add_argument("--snapshot-dir", default="snapshots")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    broker = f"127.0.0.1:{args.broker_port}"
+    peers = {
+        f"q{i}": f"http://127.0.0.1:{args.base_port + i}"
+        for i in range(1, args.instances + 1)
+    }
+    peer_spec = ",".join(f"{instance}={url}" for instance, url in peers.items())
+
+    processes = [subprocess.Popen([sys.executable, "local_broker.py", "--port", str(args.broker_port)])]
+    time.sleep(1)
+    for instance, url in peers.items():
+        env = dict(
+            os.environ,
+            LOCAL_BROKER=broker,
+            INSTANCE_ID=instance,
+            INSTANCE_URL=url,
+            QUEUE_PEERS=peer_spec,
+            BACKEND_MATCHES_API=args.matches_api,
+            SNAPSHOT_PATH=os.path.join(args.snapshot_dir, f"queue-{instance}.json"),
+        )
+        port = url.rsplit(":", 1)[1]
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "queuing:app", "--host", "127.0.0.1", "--port", port],
+            env=env,
+        ))
+        print(f"[Cluster] {instance} on {url}")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        print("[Cluster] Shutting down")
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import asyncio
+import bisect
+import hashlib
 import json
+import os
+import socket
 import threading
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Set
 
-import requests
 import httpx
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from confluent_kafka import Consumer, KafkaException, TopicPartition, Producer
-from confluent_kafka.admin import AdminClient, NewTopic
+from rate_limit import EdgeLimiter, client_ip
+from dashboard_events import DashboardEmitter
+if os.getenv("LOCAL_BROKER"):
+    # stand-in broker for running several instances on one machine, see local_broker.py
+    from local_broker import AdminClient, Consumer, KafkaError, KafkaException, NewTopic, Producer, TopicPartition
+else:
+    from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition, Producer
+    from confluent_kafka.admin import AdminClient, NewTopic
 from contextlib import asynccontextmanager
 import time
 
@@ -17,10 +26,41 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(mess
 
 
 # ─── CONFIG ─────────────────────────────────────────────────────────────────────
-KAFKA_BOOTSTRAP = "kafka:9092"
-BACKEND_MATCHES_API = "http://backend:8001/api/general/matches"
-MAX_QUEUE_SIZE = 1
+KAFKA_BOOTSTRAP = os.getenv("LOCAL_BROKER") or os.getenv("KAFKA_BOOTSTRAP", "kafka:9092")
+BACKEND_MATCHES_API = os.getenv("BACKEND_MATCHES_API", "http://backend:8001/api/general/matches")
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "5"))   # users in seat selection per topic at once
 GROUP_ID = "reservation-queue-service"
+DEFAULT_CATEGORIES = ["vip", "premium", "standard"]
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "30"))   # seconds between match list refreshes
+RETIRE_AFTER = int(os.getenv("RETIRE_AFTER", "3"))   # refreshes a match must be missing from before retiring it
+CONSUME_BATCH = int(os.getenv("CONSUME_BATCH", "500"))           # most join messages admitted per pass
+REGISTRATION_WAIT = float(os.getenv("REGISTRATION_WAIT", "30"))   # seconds a join waits for its WebSocket
+LEASE_TTL = float(os.getenv("LEASE_TTL", "60"))        # seconds an admission stays valid without a heartbeat
+LEASE_TICK = float(os.getenv("LEASE_TICK", "1"))       # timer wheel resolution in seconds
+LEASE_WHEEL_SLOTS = 512
+
+# Adaptive admission window (bounded by MIN_QUEUE_SIZE..MAX_QUEUE_SIZE)
+ADAPTIVE_ADMISSION = os.getenv("ADAPTIVE_ADMISSION", "1") == "1"
+MIN_QUEUE_SIZE = int(os.getenv("MIN_QUEUE_SIZE", "1"))
+ADMISSION_INTERVAL = float(os.getenv("ADMISSION_INTERVAL", "5"))   # seconds between window adjustments
+CONFLICT_RATE_HIGH = 0.2       # shrink the window above this seat-conflict rate
+CONFLICT_RATE_LOW = 0.05       # only grow the window below this seat-conflict rate
+BACKEND_LATENCY_TARGET = 0.5   # seconds per reservation round trip before we back off
+
+# Multi-instance mode: QUEUE_PEERS="q1=http://host1:8002,q2=http://host2:8002"
+# Leave it empty to run a single instance that owns every topic.
+INSTANCE_ID = os.getenv("INSTANCE_ID", socket.gethostname())
+INSTANCE_URL = os.getenv("INSTANCE_URL", "http://queue-service:8002")
+QUEUE_PEERS = os.getenv("QUEUE_PEERS", "")
+
+# Warm restart: queue state and the offsets it covers are snapshotted periodically
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", f"snapshots/queue-{INSTANCE_ID}.json")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "10"))   # seconds between snapshots
+HANDOFF_WAIT = float(os.getenv("HANDOFF_WAIT", "10"))   # seconds a moved-in topic waits for its previous owner's state
+
+# WebSocket opens per IP, registrations per user, and open connections (WS_USER_RATE, WS_MAX_INFLIGHT, ...)
+limiter = EdgeLimiter("WS", max_inflight=20000)   # queued users hold their socket for a while
+dashboard = DashboardEmitter()
 
 # ─── GLOBALS ─────────────────────────────────────────────────────────────────────
 app = FastAPI()
@@ -32,13 +72,242 @@ producer = Producer({'bootstrap.servers': KAFKA_BOOTSTRAP})
 connections: Dict[Tuple[str, str, str], WebSocket] = {}  # (user_name, match_id, category) -> WebSocket
 waiting_users: Dict[str, List[str]] = {}      # topic -> list of users in waiting state
 pending_users: Dict[str, List[str]] = {}      # topic -> list of users who are connected but not in waiting state
+registered_at: Dict[str, Dict[str, float]] = {}   # topic -> {user_name: when the user joined the queue}
 locks: Dict[str, asyncio.Lock] = {}           # topic -> Lock
 
 # Add paused state globally
 paused_consumers: Dict[str, bool] = {}
 consumer_objects: Dict[str, Consumer] = {}
+consumer_stops: Dict[str, threading.Event] = {}   # topic -> set when the topic is retired
+consumer_threads: Dict[str, threading.Thread] = {}
+consumed_offsets: Dict[str, int] = {}   # topic -> next offset to read, as far as the queue state goes
+restored_offsets: Dict[str, int] = {}   # topic -> offset to resume from, loaded from a snapshot
+unadmitted: Dict[str, List[str]] = {}   # topic -> users read by a stopped consumer but never admitted
+handoff_ready: Dict[str, threading.Event] = {}   # topic -> set once the previous owner handed it over
+
+known_topics: Set[str] = set()                # every topic of the backend's match list
+missing_topics: Dict[str, int] = {}           # topic -> consecutive refreshes it was missing from the list
+retired_topics: Set[str] = set()              # retired through /topics/retire; never rediscovered
+active_topics: Set[str] = set()               # topics owned here, with a running consumer
+topics_lock = asyncio.Lock()                  # serializes topic discovery
+
+users: Set[str] = set()                       # users with a registered WebSocket
+
+
+# ─── LEASES ──────────────────────────────────────────────────────────────────────
+
+class TimerWheel:
+    """Hashed timing wheel for admission leases.
+
+    Scheduling and renewal are O(1); each tick only touches the keys hashed into
+    the slots that elapsed. Renewals leave a stale entry behind in the old slot,
+    which is dropped lazily when that slot comes round.
+    """
+
+    def __init__(self, tick: float, slots: int):
+        self.tick = tick
+        self.slots: List[set] = [set() for _ in range(slots)]
+        self.deadlines: Dict[Tuple[str, str], float] = {}   # (topic, user_name) -> monotonic deadline
+        self.next_tick = int(time.monotonic() / tick)
+        # leases are granted from the consumer threads and expired from the event loop
+        self.lock = threading.Lock()
+
+    def _slot_of(self, deadline: float) -> int:
+        return max(int(deadline / self.tick), self.next_tick) % len(self.slots)
+
+    def schedule(self, key: Tuple[str, str], ttl: float):
+        deadline = time.monotonic() + ttl
+        with self.lock:
+            self.deadlines[key] = deadline
+            self.slots[self._slot_of(deadline)].add(key)
+
+    def renew(self, key: Tuple[str, str], ttl: float) -> bool:
+        deadline = time.monotonic() + ttl
+        with self.lock:
+            if key not in self.deadlines:
+                return False
+            self.deadlines[key] = deadline
+            self.slots[self._slot_of(deadline)].add(key)
+            return True
+
+    def cancel(self, key: Tuple[str, str]):
+        with self.lock:
+            self.deadlines.pop(key, None)
+
+    def remaining(self, key: Tuple[str, str]) -> float:
+        with self.lock:
+            deadline = self.deadlines.get(key)
+        return max(deadline - time.monotonic(), 0.0) if deadline is not None else 0.0
+
+    def advance(self) -> List[Tuple[str, str]]:
+        """Process every fully elapsed tick and return the keys whose lease ran out."""
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            due = int(now / self.tick)
+            # after a long stall one full turn of the wheel visits every slot
+            first = max(self.next_tick, due - len(self.slots))
+            for t in range(first, due):
+                index = t % len(self.slots)
+                slot = self.slots[index]
+                for key in list(slot):
+                    deadline = self.deadlines.get(key)
+                    if deadline is None:
+                        slot.discard(key)
+                    elif deadline <= now:
+                        slot.discard(key)
+                        del self.deadlines[key]
+                        expired.append(key)
+                    elif int(deadline / self.tick) % len(self.slots) != index:
+                        slot.discard(key)   # renewed into another slot
+            self.next_tick = max(self.next_tick, due)
+        return expired
+
+
+lease_wheel = TimerWheel(LEASE_TICK, LEASE_WHEEL_SLOTS)
+
+
+# ─── SHARDING ────────────────────────────────────────────────────────────────────
+
+class HashRing:
+    """Consistent hash ring assigning topics to queue instances.
+
+    Each instance is placed on the ring many times so topics spread evenly, and
+    adding or removing an instance only moves the topics next to its points.
+    """
+
+    REPLICAS = 64
+
+    def __init__(self, peers: Dict[str, str]):
+        self.peers = dict(peers)   # instance id -> base URL
+        points = sorted(
+            (self._hash(f"{instance}#{i}"), instance)
+            for instance in self.peers
+            for i in range(self.REPLICAS)
+        )
+        self.hashes = [h for h, _ in points]
+        self.instances = [instance for _, instance in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def owner(self, topic: str) -> str:
+        index = bisect.bisect(self.hashes, self._hash(topic)) % len(self.hashes)
+        return self.instances[index]
+
+    def ws_url(self, instance: str) -> str:
+        return self.peers[instance].replace("http", "ws", 1) + "/ws"
+
+
+def parse_peers(spec: str) -> Dict[str, str]:
+    peers = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        instance, url = entry.split("=", 1)
+        peers[instance] = url.rstrip("/")
+    peers.setdefault(INSTANCE_ID, INSTANCE_URL)
+    return peers
+
+
+ring = HashRing(parse_peers(QUEUE_PEERS))
+
+def owns(topic: str) -> bool:
+    return ring.owner(topic) == INSTANCE_ID
+
+async def redirect_if_not_owner(topic: str, websocket: WebSocket) -> bool:
+    """Point the client at the instance that owns the topic; True if it was redirected"""
+    owner = ring.owner(topic)
+    if owner == INSTANCE_ID:
+        return False
+    await websocket.send_json({
+        "type": "redirect",
+        "matchId": topic.split(".")[1],
+        "category": topic.split(".")[2],
+        "url": ring.ws_url(owner)
+    })
+    return True
+
+
+# ─── ADMISSION CONTROL ───────────────────────────────────────────────────────────
 
-users =[]
+class AdmissionController:
+    """Sizes one topic's admission window from what the selection stage reports.
+
+    Selection duration, seat conflicts and backend latency are smoothed with an
+    EWMA. The window grows by one while the stage is saturated and healthy, and
+    shrinks multiplicatively when users start colliding on seats or the backend
+    slows down. It never leaves the operator bounds.
+    """
+
+    ALPHA = 0.2
+
+    def __init__(self, window: int):
+        self.window = float(window)
+        self.selection_time = None     # seconds a user holds a slot
+        self.conflict_rate = 0.0       # share of reservation attempts that hit a taken seat
+        self.backend_latency = None    # seconds per reservation round trip
+        self.admitted_at: Dict[str, float] = {}
+        self.last_action = "hold"
+
+    def _ewma(self, current, sample):
+        return sample if current is None else current + self.ALPHA * (sample - current)
+
+    def observe_admission(self, user_name: str):
+        self.admitted_at[user_name] = time.monotonic()
+
+    def observe_release(self, user_name: str):
+        started = self.admitted_at.pop(user_name, None)
+        if started is not None:
+            self.selection_time = self._ewma(self.selection_time, time.monotonic() - started)
+
+    def observe_reservation(self, conflict: bool, latency: float):
+        self.conflict_rate = self._ewma(self.conflict_rate, 1.0 if conflict else 0.0)
+        self.backend_latency = self._ewma(self.backend_latency, latency)
+
+    def capacity(self):
+        """Concurrent selectors the backend can serve: reservations arrive once per
+        selection time each and are committed one backend round trip at a time."""
+        if not self.selection_time or not self.backend_latency:
+            return None
+        return self.selection_time / self.backend_latency
+
+    def adjust(self, min_size: int, max_size: int, saturated: bool):
+        capacity = self.capacity()
+        if self.conflict_rate > CONFLICT_RATE_HIGH or (
+                self.backend_latency is not None and self.backend_latency > BACKEND_LATENCY_TARGET):
+            self.window *= 0.75
+            self.last_action = "decrease"
+        elif capacity is not None and self.window > capacity:
+            self.window = max(capacity, self.window * 0.75)
+            self.last_action = "decrease"
+        elif saturated and self.conflict_rate < CONFLICT_RATE_LOW:
+            self.window += 1
+            self.last_action = "increase"
+        else:
+            self.last_action = "hold"
+        self.window = min(max(self.window, float(min_size)), float(max_size))
+
+    def limit(self) -> int:
+        return max(int(self.window), 1)
+
+    def state(self) -> dict:
+        return {
+            "window": self.limit(),
+            "raw_window": round(self.window, 3),
+            "selection_time": self.selection_time,
+            "conflict_rate": round(self.conflict_rate, 4),
+            "backend_latency": self.backend_latency,
+            "capacity": self.capacity(),
+            "last_action": self.last_action
+        }
+
+
+admission: Dict[str, AdmissionController] = {}   # topic -> controller
+
+def admission_limit(topic: str) -> int:
+    if ADAPTIVE_ADMISSION and topic in admission:
+        return admission[topic].limit()
+    return MAX_QUEUE_SIZE
 
 
 # ─── HELPERS ─────────────────────────────────────────────────────────────────────
@@ -47,140 +316,239 @@ def get_topic_name(match_id: str, category: str) -> str:
     return f"match.{match_id}.{category.lower()}"
 
 async def get_matches_from_backend():
-    response = requests.get(BACKEND_MATCHES_API)
+    async with httpx.AsyncClient() as client:
+        response = await client.get(BACKEND_MATCHES_API)
     response.raise_for_status()
     return response.json()
 
-def create_topics(matches_data):
-    topics = []
-    default_categories = ["vip", "premium", "standard"]
+def topics_for_matches(matches_data) -> Set[str]:
+    return {
+        get_topic_name(match["match_id"], cat)
+        for match in matches_data
+        for cat in DEFAULT_CATEGORIES
+    }
 
-    for match in matches_data:
-        match_id = match["match_id"]  # Still get match_id
-        for cat in default_categories:
-            topic = get_topic_name(match_id, cat)
-            topics.append(NewTopic(topic, num_partitions=1, replication_factor=1))
-            waiting_users[topic] = []
-            locks[topic] = asyncio.Lock()
+def init_topic_state(topic: str):
+    # a handoff may already have filled the state in
+    waiting_users.setdefault(topic, [])
+    pending_users.setdefault(topic, [])
+    locks.setdefault(topic, asyncio.Lock())
+    admission.setdefault(topic, AdmissionController(MIN_QUEUE_SIZE))
+    consumer_stops[topic] = threading.Event()
 
-        for attempt in range(5):  # try 5 times
-            futures = admin_client.create_topics(topics)
+def drop_topic_state(topic: str):
+    for table in (waiting_users, pending_users, registered_at, locks, admission, paused_consumers, consumer_stops,
+                  consumed_offsets, unadmitted):
+        table.pop(topic, None)
 
-            all_ok = True
-            for topic, future in futures.items():
-                try:
-                    future.result()
-                    logging.info(f"✅ Created topic: {topic}")
-                except Exception as e:
-                    logging.info(f"⚠️ Failed to create topic {topic}: {e}")
-                    all_ok = False
+def create_topics(topic_names: List[str]):
+    """Create the given topics in one admin request, retrying only the ones that failed"""
+    remaining = [NewTopic(topic, num_partitions=1, replication_factor=1) for topic in topic_names]
 
-            if all_ok:
-                break
-            else:
-                print("⏳ Waiting 3 seconds before retrying topic creation...")
-                time.sleep(1)
+    for attempt in range(5):  # try 5 times
+        futures = admin_client.create_topics(remaining)
+
+        failed = []
+        for new_topic in remaining:
+            try:
+                futures[new_topic.topic].result()
+                logging.info(f"✅ Created topic: {new_topic.topic}")
+            except KafkaException as e:
+                if e.args[0].code() == KafkaError.TOPIC_ALREADY_EXISTS:
+                    continue
+                logging.info(f"⚠️ Failed to create topic {new_topic.topic}: {e}")
+                failed.append(new_topic)
+            except Exception as e:
+                logging.info(f"⚠️ Failed to create topic {new_topic.topic}: {e}")
+                failed.append(new_topic)
+
+        if not failed:
+            break
+        remaining = failed
+        print("⏳ Waiting 1 second before retrying topic creation...")
+        time.sleep(1)
+
+def delete_topics(topic_names: List[str]):
+    futures = admin_client.delete_topics(topic_names)
+    for topic, future in futures.items():
+        try:
+            future.result()
+            logging.info(f"Deleted topic: {topic}")
+        except Exception as e:
+            logging.info(f"⚠️ Failed to delete topic {topic}: {e}")
 
 def start_consumer(topic_name: str):
     def run():
+        stop = consumer_stops[topic_name]
+        ready = handoff_ready.get(topic_name)
+        if ready is not None:
+            # read from the offset the previous owner committed on its way out, not an older one
+            deadline = time.monotonic() + HANDOFF_WAIT
+            while not ready.wait(0.1) and not stop.is_set():
+                if time.monotonic() > deadline:
+                    logging.info(f"No handoff for topic {topic_name} after {HANDOFF_WAIT}s; starting anyway.")
+                    break
+            handoff_ready.pop(topic_name, None)
         consumer = Consumer({
             'bootstrap.servers': KAFKA_BOOTSTRAP,
             'group.id': GROUP_ID + "_" + topic_name,
-            'auto.offset.reset': 'earliest'
+            'auto.offset.reset': 'earliest',
+            # offsets are committed per admitted batch, see below
+            'enable.auto.commit': False
         })
         tp = TopicPartition(topic_name, 0)
-        consumer.subscribe([topic_name])
+        offset = restored_offsets.pop(topic_name, None)
+        if offset is not None:
+            # warm restart: the snapshot already holds everything before this offset
+            consumer.assign([TopicPartition(topic_name, 0, offset)])
+            logging.info(f"Resuming topic {topic_name} from snapshot offset {offset}.")
+        else:
+            consumer.subscribe([topic_name])
         consumer_objects[topic_name] = consumer
         paused_consumers[topic_name] = False
+        carry: List[Tuple[str, int, float]] = []   # (user_name, offset, read at) read but not yet admitted
         logging.info(f"Starting consumer for topic {topic_name}.")
 
-        while True:
-            if len(waiting_users[topic_name]) >= MAX_QUEUE_SIZE:
-                logging.info(f"Queue for topic {topic_name} is full. Pausing consumer if not already paused.")
-                if not paused_consumers[topic_name]:
+        while not stop.is_set():
+            free = admission_limit(topic_name) - len(waiting_users.get(topic_name, ()))
+            if free <= 0:
+                if not paused_consumers.get(topic_name):
+                    logging.info(f"Queue for topic {topic_name} is full. Pausing consumer.")
                     consumer.pause([tp])
                     paused_consumers[topic_name] = True
+                stop.wait(0.1)
                 continue
 
-            if paused_consumers[topic_name]:
+            if paused_consumers.get(topic_name):
                 logging.info(f"Resuming consumer for topic {topic_name}.")
                 consumer.resume([tp])
                 paused_consumers[topic_name] = False
 
-            msg = consumer.poll(1.0)
-            if msg is None:
-                # logging.info(f"No message received for topic {topic_name}.")
-                continue
-            if msg.error():
-                logging.error(f"Error in consumer for topic {topic_name}: {msg.error()}")
-                continue
+            if not carry:
+                msgs = consumer.consume(num_messages=min(free, CONSUME_BATCH), timeout=1.0)
+                read_at = time.monotonic()
+                for msg in msgs:
+                    if msg.error():
+                        logging.error(f"Error in consumer for topic {topic_name}: {msg.error()}")
+                        continue
+                    data = json.loads(msg.value())
+                    carry.append((data["username"], msg.offset(), read_at))
+                if not carry:
+                    continue
+                logging.info(f"Received {len(carry)} joins for topic {topic_name}.")
 
-            logging.info(f"Received message for topic {topic_name}: {msg.value()}")
-            
+            # admit the registered users at the front; the first unregistered one waits for its WebSocket
+            registered = 0
+            while registered < len(carry) and carry[registered][0] in users:
+                registered += 1
+            handled = 0
+            if registered:
+                handled = asyncio.run(admit_users(topic_name, [user_name for user_name, _, _ in carry[:registered]]))
+            if handled == registered:
+                now = time.monotonic()
+                while handled < len(carry) and carry[handled][0] not in users \
+                        and now - carry[handled][2] > REGISTRATION_WAIT:
+                    logging.info(f"User {carry[handled][0]} did not register within {REGISTRATION_WAIT}s; "
+                                 f"dropping the join for topic {topic_name}.")
+                    handled += 1
+            if not handled:
+                stop.wait(0.2)
+                continue
 
-            data = json.loads(msg.value())
-            logging.info(f"Decoded message: {data}")
-            user_name = data["username"]
-            while user_name not in users:
-                logging.info(f"User {user_name} not registered. Waiting for registration.")
-                time.sleep(1)
+            next_offset = carry[handled][1] if handled < len(carry) else carry[-1][1] + 1
+            carry = carry[handled:]
+            # one commit per batch; users that did not fit are re-read after a crash
+            consumer.commit(offsets=[TopicPartition(topic_name, 0, next_offset)], asynchronous=True)
+            consumed_offsets[topic_name] = next_offset
 
-            asyncio.run(notify_user_if_possible(topic_name, user_name))
+        # joins read but not admitted stay uncommitted, so whoever owns the topic next re-reads them
+        next_offset = carry[0][1] if carry else consumed_offsets.get(topic_name)
+        if next_offset is not None:
+            try:
+                consumer.commit(offsets=[TopicPartition(topic_name, 0, next_offset)], asynchronous=False)
+            except Exception as e:
+                logging.error(f"Failed to commit offset {next_offset} for topic {topic_name}: {e}")
+        unadmitted[topic_name] = [user_name for user_name, _, _ in carry]
+        consumer.close()
+        consumer_objects.pop(topic_name, None)
+        # the topic may have been re-added while this thread was winding down
+        if consumer_stops.get(topic_name) is stop:
+            drop_topic_state(topic_name)
+        logging.info(f"Stopped consumer for topic {topic_name}.")
 
-    threading.Thread(target=run, daemon=True).start()
+    thread = threading.Thread(target=run, daemon=True)
+    consumer_threads[topic_name] = thread
+    thread.start()
 
 
 async def notify_dashboard(topic: str):
-    """Notify dashboard of queue changes"""
-    try:
-        match_id = topic.split(".")[1]
-        category = topic.split(".")[2]
-        # Calculate queue length as number of users in pending state
-        queue_length = len(pending_users.get(topic, []))
-        
-        async with httpx.AsyncClient() as client:
-            await client.post("http://dashboard:8003/events", json={
-                "type": "queue_update",
-                "data": {
-                    "match_id": match_id,
-                    "category": category,
-                    "queue_length": queue_length
-                }
-            })
-    except Exception as e:
-        logging.error(f"Failed to notify dashboard: {e}")
+    """Notify dashboard of queue changes; only the latest length per topic is sent"""
+    match_id = topic.split(".")[1]
+    category = topic.split(".")[2]
+    # Calculate queue length as number of users in pending state
+    queue_length = len(pending_users.get(topic, []))
+    dashboard.emit("queue_update", {
+        "match_id": match_id,
+        "category": category,
+        "queue_length": queue_length
+    }, key=topic)
+
+async def admit_users(topic: str, user_names: List[str]) -> int:
+    """Admit users in queue order while the window has room.
 
-async def notify_user_if_possible(topic: str, user_name: str):
-    logging.info(f"Checking if user {user_name} can be notified for topic {topic}.")
+    The whole batch shares one lock acquisition and one dashboard update.
+    Returns how many users from the front of the list were handled, so the
+    consumer can retry the rest first once slots free up.
+    """
+    logging.info(f"Admitting up to {len(user_names)} users for topic {topic}.")
+    to_notify: List[Tuple[str, int]] = []
+    waits: List[Tuple[str, float]] = []   # (user_name, seconds between registration and admission)
+    handled = 0
     async with locks[topic]:
-        if user_name not in waiting_users[topic]:
-            if len(waiting_users[topic]) < MAX_QUEUE_SIZE:
-                logging.info(f"Adding user {user_name} to waiting list for topic {topic}.")
+        for user_name in user_names:
+            if user_name in waiting_users[topic]:
+                logging.info(f"User {user_name} is already in the waiting list for topic {topic}.")
+            elif len(waiting_users[topic]) < admission_limit(topic):
                 waiting_users[topic].append(user_name)
+                lease_wheel.schedule((topic, user_name), LEASE_TTL)
+                admission[topic].observe_admission(user_name)
+                joined = registered_at.get(topic, {}).pop(user_name, None)
+                if joined is not None:
+                    waits.append((user_name, time.time() - joined))
                 # Remove from pending when added to waiting
                 if user_name in pending_users.get(topic, []):
                     pending_users[topic].remove(user_name)
-                await notify_dashboard(topic)
             else:
                 logging.info(f"Queue is full for topic {topic}.")
-                return
-        else:
-            logging.info(f"User {user_name} is already in the waiting list for topic {topic}.")
-        
-        match_id = topic.split(".")[1]
-        cat = topic.split(".")[2]
-
-        logging.info(f"Notifying user {user_name} for topic {topic}.")
-
+                break
+            to_notify.append((user_name, waiting_users[topic].index(user_name) + 1))
+            handled += 1
+        if to_notify:
+            await notify_dashboard(topic)
 
-        ws_key = (user_name.lower(), topic.split(".")[1], topic.split(".")[2].lower())  # (user_name, match_id, category)
+    match_id = topic.split(".")[1]
+    cat = topic.split(".")[2]
+    for user_name, seconds in waits:
+        # the queue wait as the user saw it; the dashboard keeps its percentiles
+        dashboard.emit("queue_wait", {
+            "match_id": match_id,
+            "category": cat,
+            "user_name": user_name,
+            "wait": seconds
+        })
+    for user_name, position in to_notify:
+        ws_key = (user_name.lower(), match_id, cat)  # (user_name, match_id, category)
         websocket = connections.get(ws_key)
-        logging.info(f"WebSocket connection for user with key {ws_key}: {websocket}")
         if websocket:
-            await websocket.send_json({"type":"start_selection",
-            "matchId":match_id,
-            "category":cat,
-            "position":len(waiting_users[topic])})
+            try:
+                await websocket.send_json({"type":"start_selection",
+                "matchId":match_id,
+                "category":cat,
+                "position":position,
+                "lease_ttl":LEASE_TTL})
+            except Exception as e:
+                logging.info(f"Could not notify {user_name}: {e}")
+    return handled
 
 async def handle_register(data: dict, websocket: WebSocket):
     logging.info(data)
@@ -193,22 +561,22 @@ async def handle_register(data: dict, websocket: WebSocket):
     connections[(user_name, match_id, category)] = websocket
     logging.info(f"new connection: user_name={user_name}, match_id={match_id}, category={category}")
     # send response 
-    users.append(user_name)
+    users.add(user_name)
     await websocket.send_json({
         "type": "registered",
         "matchId": match_id,
         "category": category
     })
 
-async def handle_finish(data: dict):
-    user_name = data["user_name"]
-    match_id = data["matchId"]
-    category = data["category"]
-    topic = get_topic_name(match_id, category)
-
+async def release_slot(topic: str, user_name: str):
+    """Free the admission slot held by a user and let the consumer admit the next one"""
+    lease_wheel.cancel((topic, user_name))
+    if topic not in locks:
+        return  # topic was retired
     async with locks[topic]:
         if user_name in waiting_users[topic]:
             waiting_users[topic].remove(user_name)
+            admission[topic].observe_release(user_name)
             await notify_dashboard(topic)  # Notify dashboard of queue change
 
         # resume Kafka consumer if it was paused
@@ -218,19 +586,387 @@ async def handle_finish(data: dict):
             consumer.resume([tp])
             paused_consumers[topic] = False
 
+async def handle_finish(data: dict):
+    user_name = data["user_name"]
+    match_id = data["matchId"]
+    category = data["category"]
+    topic = get_topic_name(match_id, category)
+
+    await release_slot(topic, user_name)
+
+async def handle_heartbeat(data: dict, websocket: WebSocket):
+    user_name = data["user_name"]
+    match_id = data["matchId"]
+    category = data["category"].lower()
+    topic = get_topic_name(match_id, category)
+
+    if lease_wheel.renew((topic, user_name), LEASE_TTL):
+        await websocket.send_json({
+            "type": "lease_renewed",
+            "matchId": match_id,
+            "category": category,
+            "expires_in": LEASE_TTL
+        })
+    else:
+        await websocket.send_json({
+            "type": "no_lease",
+            "matchId": match_id,
+            "category": category
+        })
+
+async def hand_off(topic: str, owner: str):
+    """Move a topic's queue state to the instance that now owns it.
+
+    The consumer is stopped first so nobody is admitted mid-transfer. It
+    commits the offset of the first join it did not admit, and the new owner's
+    consumer waits for this handoff before resuming from that offset, so joins
+    that were read here but not admitted are read again there. Clients still
+    connected here are redirected to the new owner.
+    """
+    stop = consumer_stops.pop(topic)    # keeps the exiting thread from dropping the state
+    stop.set()
+    handoff_ready.pop(topic, None)
+    active_topics.discard(topic)
+    thread = consumer_threads.pop(topic, None)
+    if thread:
+        await asyncio.to_thread(thread.join, 5)
+
+    async with locks[topic]:
+        state = {
+            "topic": topic,
+            "waiting": [[user, lease_wheel.remaining((topic, user))] for user in waiting_users[topic]],
+            "pending": list(pending_users.get(topic, [])),
+            # read but not admitted; registered here, so the new owner need not wait for them
+            "queued": [user for user in unadmitted.pop(topic, []) if user in users],
+            "window": admission[topic].window
+        }
+        for user in waiting_users[topic]:
+            lease_wheel.cancel((topic, user))
+    try:
+        async with httpx.AsyncClient() as client:
+            await client.post(ring.peers[owner] + "/handoff", json=state)
+        logging.info(f"Handed off topic {topic} to {owner}")
+    except Exception as e:
+        logging.error(f"Failed to hand off topic {topic} to {owner}: {e}")
+    drop_topic_state(topic)
+
+    match_id, category = topic.split(".")[1], topic.split(".")[2]
+    for (user_name, m, c), websocket in list(connections.items()):
+        if m == match_id and c == category:
+            try:
+                await websocket.send_json({
+                    "type": "redirect",
+                    "matchId": match_id,
+                    "category": category,
+                    "url": ring.ws_url(owner)
+                })
+            except Exception as e:
+                logging.info(f"Could not redirect {user_name}: {e}")
+            connections.pop((user_name, m, c), None)
+
+async def sync_topics(matches_data=None, retire: Set[str] = frozenset()):
+    """Bring the set of live topics in line with the match list and the ring.
+
+    Only the difference is touched: new matches owned here get their topics
+    created in one batch and a consumer each, matches that disappeared are
+    retired, topics that moved to another instance are handed off, and every
+    other queue keeps running untouched. Without matches_data only ownership
+    is re-evaluated.
+
+    A topic is only retired (and its Kafka topic deleted) when it is named in
+    retire, or after missing from RETIRE_AFTER match lists in a row, so one
+    empty or partial /matches response cannot wipe out the live queues.
+    """
+    global known_topics
+    async with topics_lock:
+        finished = set(retire) & known_topics
+        if matches_data is not None:
+            listed = topics_for_matches(matches_data)
+            if not listed and known_topics:
+                logging.error("Backend returned no matches; keeping every topic until it lists them again")
+                listed = set(known_topics)
+            all_topics = listed - retired_topics - finished
+            for topic in all_topics:
+                missing_topics.pop(topic, None)
+            for topic in known_topics - all_topics:
+                missing_topics[topic] = missing_topics.get(topic, 0) + 1
+                if missing_topics[topic] >= RETIRE_AFTER:
+                    finished.add(topic)
+                else:
+                    logging.info(f"Topic {topic} missing from the match list "
+                                 f"({missing_topics[topic]}/{RETIRE_AFTER}); not retiring yet")
+            known_topics = all_topics | (known_topics - finished)
+        else:
+            known_topics = known_topics - finished
+        retired_topics.update(retire)
+        for topic in finished:
+            missing_topics.pop(topic, None)
+        wanted = {topic for topic in known_topics if owns(topic)}
+        added = sorted(wanted - active_topics)
+        removed = sorted(active_topics & finished)
+        moved = sorted(active_topics - wanted - finished)
+
+        if added:
+            for topic in added:
+                init_topic_state(topic)
+            await asyncio.to_thread(create_topics, added)
+            for topic in added:
+                start_consumer(topic)
+                active_topics.add(topic)
+            logging.info(f"Discovered topics: {added}")
+
+        for topic in moved:
+            await hand_off(topic, ring.owner(topic))
+
+        if removed:
+            for topic in removed:
+                # the consumer thread drops the topic's state once it has stopped
+                consumer_stops[topic].set()
+                active_topics.discard(topic)
+            await asyncio.to_thread(delete_topics, removed)
+            logging.info(f"Retired topics: {removed}")
+
+        return added, removed
+
+async def refresh_topics():
+    """Periodically pick up matches added to or removed from the backend"""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            await sync_topics(await get_matches_from_backend())
+        except Exception as e:
+            logging.error(f"Failed to refresh topics: {e}")
+
+async def tune_admission_windows():
+    """Periodically resize every topic's admission window"""
+    while True:
+        await asyncio.sleep(ADMISSION_INTERVAL)
+        for topic, controller in admission.items():
+            # saturated: every slot is taken and users are still waiting behind them
+            saturated = (len(waiting_users.get(topic, [])) >= controller.limit()
+                         and (paused_consumers.get(topic) or bool(pending_users.get(topic))))
+            before = controller.limit()
+            controller.adjust(MIN_QUEUE_SIZE, MAX_QUEUE_SIZE, saturated)
+            if controller.limit() != before:
+                logging.info(f"Admission window for topic {topic}: {before} -> {controller.limit()}")
+
+async def expire_leases():
+    """Release the slots of admitted users who stopped sending heartbeats"""
+    while True:
+        await asyncio.sleep(LEASE_TICK)
+        for topic, user_name in lease_wheel.advance():
+            logging.info(f"Lease expired for user {user_name} on topic {topic}. Releasing slot.")
+            await release_slot(topic, user_name)
+
+            ws_key = (user_name.lower(), topic.split(".")[1], topic.split(".")[2])
+            websocket = connections.get(ws_key)
+            if websocket:
+                try:
+                    await websocket.send_json({
+                        "type": "lease_expired",
+                        "matchId": topic.split(".")[1],
+                        "category": topic.split(".")[2]
+                    })
+                except Exception as e:
+                    logging.info(f"Could not notify {user_name} of lease expiry: {e}")
+
+# ─── SNAPSHOTS ───────────────────────────────────────────────────────────────────
+
+def take_snapshot() -> dict:
+    """Compact copy of every owned topic's queue state and the offset it covers.
+
+    The offset is read before the state, so the state may already include users
+    from a few later messages; replaying those on restart is harmless because
+    admitting a user who is already in selection is a no-op.
+    """
+    topics = {}
+    for topic in list(active_topics):
+        offset = consumed_offsets.get(topic)
+        if offset is None or topic not in admission:
+            continue
+        topics[topic] = {
+            "offset": offset,
+            "waiting": [[user, lease_wheel.remaining((topic, user))] for user in list(waiting_users.get(topic, []))],
+            "pending": list(pending_users.get(topic, [])),
+            "window": admission[topic].window
+        }
+    return {"instance": INSTANCE_ID, "taken_at": time.time(), "topics": topics}
+
+def write_snapshot(snapshot: dict):
+    directory = os.path.dirname(SNAPSHOT_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = SNAPSHOT_PATH + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(snapshot, file, separators=(",", ":"))
+    os.replace(tmp_path, SNAPSHOT_PATH)   # readers never see a half-written snapshot
+
+def load_snapshot():
+    """Restore queue state from the last snapshot; consumers then only read the tail"""
+    if not os.path.exists(SNAPSHOT_PATH):
+        return
+    try:
+        with open(SNAPSHOT_PATH) as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError) as e:
+        logging.error(f"Ignoring unreadable snapshot {SNAPSHOT_PATH}: {e}")
+        return
+
+    downtime = max(time.time() - snapshot["taken_at"], 0.0)
+    for topic, state in snapshot["topics"].items():
+        if not owns(topic):
+            continue
+        waiting_users[topic] = [user for user, _ in state["waiting"]]
+        pending_users[topic] = list(state["pending"])
+        admission[topic] = AdmissionController(MIN_QUEUE_SIZE)
+        admission[topic].window = state["window"]
+        for user_name, remaining in state["waiting"]:
+            # give clients a moment to reconnect before their lease runs out
+            lease_wheel.schedule((topic, user_name), max(remaining - downtime, LEASE_TICK * 5))
+            admission[topic].observe_admission(user_name)
+        users.update(state["pending"])
+        consumed_offsets[topic] = state["offset"]
+        restored_offsets[topic] = state["offset"]
+    logging.info(f"Restored {len(restored_offsets)} topics from snapshot taken {downtime:.1f}s ago")
+
+async def snapshot_queues():
+    """Periodically persist queue state so a restart only replays one interval"""
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            await asyncio.to_thread(write_snapshot, take_snapshot())
+        except Exception as e:
+            logging.error(f"Failed to write snapshot: {e}")
+
 # ─── FASTAPI ENDPOINTS ───────────────────────────────────────────────────────────
 
 @app.put("/editSize")
-async def edit_size(size: int):
-    global MAX_QUEUE_SIZE
+async def edit_size(size: int, min_size: int = None):
+    """Set the operator bounds; the adaptive controller stays within them"""
+    global MAX_QUEUE_SIZE, MIN_QUEUE_SIZE
+    if min_size is not None:
+        if min_size < 1 or min_size > size:
+            return {"status": "error", "message": "min_size must be between 1 and size"}
+        MIN_QUEUE_SIZE = min_size
     MAX_QUEUE_SIZE = size
+    MIN_QUEUE_SIZE = min(MIN_QUEUE_SIZE, MAX_QUEUE_SIZE)
+    for controller in admission.values():
+        controller.window = min(max(controller.window, float(MIN_QUEUE_SIZE)), float(MAX_QUEUE_SIZE))
     return {"status": "success", "message": f"Max queue size updated to {size}"}
 
+@app.post("/topics/refresh")
+async def push_refresh():
+    """Let the backend push a match list change instead of waiting for the next refresh"""
+    added, removed = await sync_topics(await get_matches_from_backend())
+    return {"status": "success", "added": added, "removed": removed}
+
+@app.post("/topics/retire")
+async def retire_topics(data: dict):
+    """Retire the queues of finished matches right away: {"match_ids": [...]}"""
+    topics = {get_topic_name(str(match_id), category)
+              for match_id in data["match_ids"] for category in DEFAULT_CATEGORIES}
+    _, removed = await sync_topics(retire=topics)
+    return {"status": "success", "removed": removed}
+
+@app.get("/topics")
+async def get_topics():
+    return sorted(active_topics)
+
+@app.get("/peers")
+async def get_peers():
+    return {"instance": INSTANCE_ID, "peers": ring.peers}
+
+@app.put("/peers")
+async def set_peers(data: dict):
+    """Replace the instance list; topics that change owner are handed off.
+
+    A list without this instance drains it: every topic it owns is handed off.
+    """
+    global ring
+    peers = {instance: url.rstrip("/") for instance, url in data["peers"].items()}
+    if not peers:
+        return {"status": "error", "message": "Peer list must not be empty"}
+    previous, ring = ring, HashRing(peers)
+    for topic in known_topics:
+        if owns(topic) and previous.owner(topic) != INSTANCE_ID:
+            # the handoff may already have arrived and set it
+            handoff_ready.setdefault(topic, threading.Event())
+    added, _ = await sync_topics()
+    return {"status": "success", "owned": sorted(active_topics), "added": added}
+
+@app.post("/handoff")
+async def receive_handoff(data: dict):
+    """Take over a topic's queue state from its previous owner"""
+    topic = data["topic"]
+    waiting_users.setdefault(topic, [])
+    pending_users.setdefault(topic, [])
+    locks.setdefault(topic, asyncio.Lock())
+    admission.setdefault(topic, AdmissionController(MIN_QUEUE_SIZE))
+    async with locks[topic]:
+        for user_name, remaining in data["waiting"]:
+            if user_name not in waiting_users[topic]:
+                waiting_users[topic].append(user_name)
+                # give the client a moment to reconnect before its lease runs out
+                lease_wheel.schedule((topic, user_name), max(remaining, LEASE_TICK * 5))
+                admission[topic].observe_admission(user_name)
+        for user_name in data["pending"] + data.get("queued", []):
+            if user_name not in pending_users[topic] and user_name not in waiting_users[topic]:
+                pending_users[topic].append(user_name)
+            users.add(user_name)
+        admission[topic].window = data["window"]
+    handoff_ready.setdefault(topic, threading.Event()).set()
+    logging.info(f"Took over topic {topic} with {len(data['waiting'])} users in selection")
+    return {"status": "success"}
+
+@app.get("/admission")
+async def get_admission():
+    """Current admission window and controller state per topic"""
+    return {
+        "adaptive": ADAPTIVE_ADMISSION,
+        "min_size": MIN_QUEUE_SIZE,
+        "max_size": MAX_QUEUE_SIZE,
+        "topics": {
+            topic: {**controller.state(), "in_selection": len(waiting_users.get(topic, []))}
+            for topic, controller in admission.items()
+        }
+    }
+
+@app.post("/reservation_feedback")
+async def reservation_feedback(data: dict):
+    """Outcome of a reservation attempt, reported by the reservation service"""
+    topic = get_topic_name(str(data["match_id"]), str(data["category"]))
+    controller = admission.get(topic)
+    if controller is None:
+        return {"status": "error", "message": f"Unknown topic {topic}"}
+    controller.observe_reservation(bool(data["conflict"]), float(data["latency"]))
+    return {"status": "success"}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Rate limiting, load shedding and dashboard delivery counters"""
+    return {**limiter.metrics(), "dashboard_events": dashboard.metrics()}
+
+async def send_refusal(websocket: WebSocket, refusal):
+    status_code, retry_after, reason = refusal
+    await websocket.send_json({
+        "type": "rate_limited" if status_code == 429 else "overloaded",
+        "retry_after": retry_after,
+        "message": reason
+    })
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     logging.info("Client connected")
 
+    refusal = limiter.enter() or limiter.check(None, client_ip(websocket.headers, websocket.client))
+    if refusal:
+        if refusal[0] == 429:
+            limiter.leave()   # the address was limited after a slot was taken
+        await send_refusal(websocket, refusal)
+        await websocket.close(code=1013)   # try again later
+        return
+
     try:
         while True:
             data = await websocket.receive_json()
@@ -241,18 +977,25 @@ async def websocket_endpoint(websocket: WebSocket):
                 match_id = data["matchId"]
                 category = data["category"].lower()
                 topic = get_topic_name(match_id, category)
+                if await redirect_if_not_owner(topic, websocket):
+                    continue
+                refusal = limiter.check(user_name.lower(), None)
+                if refusal:
+                    await send_refusal(websocket, refusal)
+                    continue
 
                 # Store connection with original structure
                 ws_key = (user_name.lower(), match_id, category)
                 connections[ws_key] = websocket
                 
-                # Add to pending users
+                # Add to pending users (unless a handoff already has them in selection)
                 if topic not in pending_users:
                     pending_users[topic] = []
-                if user_name not in pending_users[topic]:
+                if user_name not in pending_users[topic] and user_name not in waiting_users.get(topic, []):
                     pending_users[topic].append(user_name)
+                    registered_at.setdefault(topic, {}).setdefault(user_name, time.time())
                 
-                users.append(user_name)
+                users.add(user_name)
                 await notify_dashboard(topic)
                 
                 await websocket.send_json({
@@ -262,29 +1005,39 @@ async def websocket_endpoint(websocket: WebSocket):
                 })
             
             elif data["action"].lower() == "finish":
-                await handle_finish(data)
+                if not await redirect_if_not_owner(get_topic_name(data["matchId"], data["category"]), websocket):
+                    await handle_finish(data)
+
+            elif data["action"].lower() == "heartbeat":
+                if not await redirect_if_not_owner(get_topic_name(data["matchId"], data["category"]), websocket):
+                    await handle_heartbeat(data, websocket)
 
     except WebSocketDisconnect:
         logging.info(f"WebSocket disconnected: {websocket.client}")
+    finally:
+        limiter.leave()
 
 # ─── LIFESPAN: INIT ──────────────────────────────────────────────────────────────
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    dashboard.start()   # on this loop; consumer threads emit from their own
+    load_snapshot()
     matches_data = await get_matches_from_backend()
     print(matches_data)
-    await asyncio.to_thread(create_topics, matches_data)
+    # Create topics and start a consumer thread for each one
+    await sync_topics(matches_data)
 
-    # Start a consumer thread for each topic
-    default_categories = ["vip", "premium", "standard"]
-    for match in matches_data:
-        match_id = match["match_id"]
-        for category in default_categories:
-            topic = get_topic_name(match_id, category)
-            start_consumer(topic)
+    asyncio.create_task(refresh_topics())
+    asyncio.create_task(expire_leases())
+    asyncio.create_task(tune_admission_windows())
+    asyncio.create_task(snapshot_queues())
 
     yield
 
+    write_snapshot(take_snapshot())
+    await dashboard.close()
+
 app.router.lifespan_context = lifespan
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+# rate_limit.py
+"""
+Edge rate limiting and load shedding shared by kafka_api.py and queuing.py.
+
+Token buckets are kept per user and per client IP in bounded LRU tables, so a
+flood of distinct keys evicts the least recently seen buckets instead of
+growing memory. A concurrency gate sheds work once too many requests are in
+flight. Callers turn a refusal into 429/503 with a Retry-After hint.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class TokenBucketLimiter:
+    """One token bucket per key; a bucket is just (tokens, last refill time)."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: OrderedDict = OrderedDict()   # key -> (tokens, monotonic timestamp)
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """Take tokens for key; returns 0 if allowed, else seconds until it would be"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+                self.evicted += 1
+        return wait
+
+
+class ConcurrencyGate:
+    """Admits at most max_inflight concurrent units of work."""
+
+    def __init__(self, max_inflight: int):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.lock = threading.Lock()
+
+    def try_enter(self) -> bool:
+        with self.lock:
+            if self.inflight >= self.max_inflight:
+                return False
+            self.inflight += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.inflight -= 1
+
+
+class EdgeLimiter:
+    """Per-user and per-IP token buckets plus global load shedding, with counters."""
+
+    def __init__(self, prefix: str, max_inflight: int = 2000):
+        def setting(name, default):
+            return float(os.getenv(f"{prefix}_{name}", default))
+
+        self.users = TokenBucketLimiter(setting("USER_RATE", "1"), setting("USER_BURST", "5"),
+                                        int(setting("MAX_KEYS", "100000")))
+        self.ips = TokenBucketLimiter(setting("IP_RATE", "20"), setting("IP_BURST", "100"),
+                                      int(setting("MAX_KEYS", "100000")))
+        self.gate = ConcurrencyGate(int(setting("MAX_INFLIGHT", str(max_inflight))))
+        self.shed_retry_after = setting("SHED_RETRY_AFTER", "2")
+        self.counters = {"allowed": 0, "limited_user": 0, "limited_ip": 0, "shed": 0}
+
+    def check(self, user: Optional[str], ip: Optional[str], cost: float = 1.0) -> Optional[Tuple[int, int, str]]:
+        """None if the request may go ahead, else (status code, retry-after seconds, reason)"""
+        if ip:
+            wait = self.ips.acquire(ip, cost)
+            if wait:
+                self.counters["limited_ip"] += 1
+                return 429, math.ceil(wait), "Too many requests from this address."
+        if user:
+            wait = self.users.acquire(user, cost)
+            if wait:
+                self.counters["limited_user"] += 1
+                return 429, math.ceil(wait), "Too many requests for this user."
+        self.counters["allowed"] += 1
+        return None
+
+    def enter(self) -> Optional[Tuple[int, int, str]]:
+        """Claim an in-flight slot; pair every successful enter() with leave()"""
+        if not self.gate.try_enter():
+            self.counters["shed"] += 1
+            return 503, math.ceil(self.shed_retry_after), "Service is overloaded, please retry."
+        return None
+
+    def leave(self):
+        self.gate.leave()
+
+    def metrics(self) -> dict:
+        return {
+            **self.counters,
+            "inflight": self.gate.inflight,
+            "max_inflight": self.gate.max_inflight,
+            "tracked_users": len(self.users.buckets),
+            "tracked_ips": len(self.ips.buckets),
+            "evicted_buckets": self.users.evicted + self.ips.evicted,
+        }
+
+
+def client_ip(headers, client) -> Optional[str]:
+    """Client address, trusting X-Forwarded-For only behind a known proxy"""
+    if os.getenv("TRUST_PROXY_HEADERS") == "1":
+        forwarded = headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return client.host if client else None
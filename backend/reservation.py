@@ -1,6 +1,7 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 import asyncio
 import httpx
+import json
 import time
 import logging
 from typing import Dict, List
@@ -13,6 +14,57 @@ backend_lock = asyncio.Lock()
 seats_ep = "http://backend:8001/api/general/seats"  # Example backend endpoint
 check_seats_ep = "http://backend:8001/api/general/check_seat"  # Example backend endpoint
 reserve_seats_ep = "http://backend:8001/api/general/reserve_seat"  # Example backend endpoint
+queue_feedback_ep = "http://queue-service:8002/reservation_feedback"  # Feeds the adaptive admission window
+selection_service = ("selection-service", 6000)  # Routes seat choices to the reserving.py workers (selection_server.py)
+SELECTION_RETRY = 5.0  # seconds before reconnecting to an unreachable selection service
+SELECTION_TIMEOUT = 2.0  # seconds a connect or send may take before the selection service counts as unreachable
+
+
+async def report_outcome(match_id, category, conflict: bool, latency: float):
+    """Tell the queue service how a reservation attempt went"""
+    try:
+        async with httpx.AsyncClient() as client:
+            await client.post(queue_feedback_ep, json={
+                "match_id": str(match_id),
+                "category": str(category),
+                "conflict": conflict,
+                "latency": latency
+            })
+    except Exception as e:
+        logging.info(f"Failed to report reservation outcome: {e}")
+
+
+class SelectionPublisher:
+    """One long-lived connection to the selection service; choices are sent as JSON lines"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.writer = None
+        self.lock = asyncio.Lock()
+        self.retry_at = 0.0
+
+    async def publish(self, match_id, category, user_name, seat_id):
+        line = json.dumps({"cmd": "PUBLISH", "match_id": str(match_id), "category": str(category),
+                           "user": str(user_name), "seat_id": str(seat_id)}).encode() + b"\n"
+        async with self.lock:
+            try:
+                if self.writer is None or self.writer.is_closing():
+                    if time.monotonic() < self.retry_at:
+                        return
+                    _, self.writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port), SELECTION_TIMEOUT)
+                self.writer.write(line)
+                await asyncio.wait_for(self.writer.drain(), SELECTION_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                logging.info(f"Failed to publish seat choice to selection service: {e!r}")
+                if self.writer is not None:
+                    self.writer.close()
+                self.writer = None
+                self.retry_at = time.monotonic() + SELECTION_RETRY
+
+
+selection_publisher = SelectionPublisher(*selection_service)
 
 
 
@@ -30,6 +82,7 @@ async def handle_reservation(websocket: WebSocket, data: dict):
     async with backend_lock:
         async with httpx.AsyncClient() as client:
             # Check availability
+            started = time.monotonic()
             response = await client.get(check_seats_ep+"/"+str(match_id)+"/"+str(category)+"/"+str(seat_id)) 
             logging.info(f"Check seat availability response: {response.json()}")
             if response.status_code == 200 and response.json().get("available"):
@@ -37,10 +90,12 @@ async def handle_reservation(websocket: WebSocket, data: dict):
                 body = {"match_id": str(match_id), "user_name": str(user_name), "latest_status": "reserved", "timestamp": str(timestamp), "catagory": str(category), "seat_id": str(seat_id)}
                 logging.info(f"Reserving seat with body: {body}")
                 response = await client.post(reserve_seats_ep, json=body)
+                asyncio.create_task(report_outcome(match_id, category, False, time.monotonic() - started))
                 # response = await client.post(reserve_seats_ep, json={"match_id": match_id, "category": category, "user_name": user_name, "seat_id": seat_id})
                 if response.status_code == 200:
                     logging.info(f"Reserved {seat_id} seat for match: {match_id}, category: {category}, user: {user_name}")
                     await websocket.send_json({"stage": "2", "status": "success", "message": f"Reserved {seat_id} seat.", "seat_id": seat_id})
+                    asyncio.create_task(selection_publisher.publish(match_id, category, user_name, seat_id))
                     connections[key].remove(websocket)
                     response = await client.get(seats_ep+"/"+str(match_id)+"/"+str(category))
                     if response.status_code == 200:
@@ -53,6 +108,7 @@ async def handle_reservation(websocket: WebSocket, data: dict):
                     # await websocket.send_json({"status": "error", "message": "Failed to reserve seats.", "error": response.json()})
             else:
                 logging.info(f"Seat: {seat_id} is not available for match: {match_id}, category: {category}, user: {user_name}")
+                asyncio.create_task(report_outcome(match_id, category, True, time.monotonic() - started))
                 # get seats status
                 response = await client.get(seats_ep+"/"+str(match_id)+"/"+str(category))
                 if response.status_code == 200:
@@ -1,103 +1,296 @@
 # reservation_mpi.py
+#
+# Run under MPI:           mpirun -n 5 python reserving.py
+# Or on one machine:       python reserving.py --workers 4
 
-from mpi4py import MPI
-import socket, json, uuid, select
+import argparse
+import multiprocessing
+import queue
+import socket, json, uuid, select, heapq, os, time
+from collections import deque
+from framing import FrameReader, send_frame
 
 SELECTION_TIMEOUT = 10  # seconds
+POLL_INTERVAL = 0.05    # seconds the coordinator waits for server replies per loop
+USERS_PER_WORKER = int(os.getenv("USERS_PER_WORKER", "32"))   # selections each rank runs at once
+WORKER_CHECK_INTERVAL = 1.0   # seconds between checks for local worker processes that died
 
 class Tags:
     WORK   = 0
     RESULT = 1
 
-def wait_for_selection(sel_sock, match_id, category, user_id, timeout):
-    sel_sock.sendall(json.dumps({
-        "cmd":      "SUBSCRIBE",
-        "match_id": match_id,
-        "category": category,
-        "user":     user_id
-    }).encode() + b"\n")
-
-    ready, _, _ = select.select([sel_sock], [], [], timeout)
-    if ready:
-        msg = sel_sock.recv(1024).decode().strip()
-        if not msg:
+
+# ─── TRANSPORTS ─────────────────────────────────────────────────────────────────
+# coordinator() and worker() only use rank, size, send(), try_recv(), recv() and
+# failed_ranks(), so the same code runs over MPI or over local processes.
+
+class MPITransport:
+    def __init__(self):
+        from mpi4py import MPI   # only needed when actually running under MPI
+        self.MPI = MPI
+        self.comm = MPI.COMM_WORLD
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+        self.status = MPI.Status()
+
+    def send(self, obj, dest, tag):
+        self.comm.send(obj, dest=dest, tag=tag)
+
+    def try_recv(self, tag):
+        """(source, message) if one with this tag is waiting, else None"""
+        if not self.comm.Iprobe(source=self.MPI.ANY_SOURCE, tag=tag, status=self.status):
             return None
-        data = json.loads(msg)
-        return data.get("seat_id")
-    return None
+        source = self.status.Get_source()
+        return source, self.comm.recv(source=source, tag=tag)
+
+    def recv(self, tag, timeout):
+        """Like try_recv, but waits up to timeout seconds for a message"""
+        deadline = time.monotonic() + timeout
+        while (message := self.try_recv(tag)) is None and time.monotonic() < deadline:
+            time.sleep(0.001)   # MPI has no timed receive; this keeps the wait off the CPU
+        return message
+
+    def failed_ranks(self):
+        return set()   # a failed rank takes the whole MPI job down
+
+
+class LocalTransport:
+    """
+    Ranks as processes on one machine: rank 0 is the parent, every rank has an
+    inbox queue and messages carry (source, tag, payload) like MPI's envelope.
+    """
+
+    def __init__(self, rank, inboxes, processes=None):
+        self.rank = rank
+        self.size = len(inboxes)
+        self.inboxes = inboxes
+        self.processes = processes or {}   # rank -> Process, known to the parent only
+        self.stash = {}   # tag -> deque of (source, message) read while looking for another tag
+
+    def send(self, obj, dest, tag):
+        self.inboxes[dest].put((self.rank, tag, obj))
+
+    def try_recv(self, tag):
+        if self.stash.get(tag):
+            return self.stash[tag].popleft()
+        while True:
+            try:
+                source, msg_tag, obj = self.inboxes[self.rank].get_nowait()
+            except queue.Empty:
+                return None
+            if msg_tag == tag:
+                return source, obj
+            self.stash.setdefault(msg_tag, deque()).append((source, obj))
+
+    def recv(self, tag, timeout):
+        """Like try_recv, but waits up to timeout seconds for a message"""
+        deadline = time.monotonic() + timeout
+        while (message := self.try_recv(tag)) is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                source, msg_tag, obj = self.inboxes[self.rank].get(timeout=remaining)
+            except queue.Empty:
+                return None
+            self.stash.setdefault(msg_tag, deque()).append((source, obj))
+        return message
+
+    def failed_ranks(self):
+        return {rank for rank, process in self.processes.items() if not process.is_alive()}
+
+
+class SelectionClient:
+    """
+    One connection to the selection service carrying many subscriptions.
+
+    Seat choices come back as JSON lines naming the user they belong to, so a
+    worker can wait for all of its users at once. Lines are reassembled from
+    whatever recv() returns.
+    """
+
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.buffer = b""
+
+    def send(self, cmd, match_id, category, user_id):
+        self.sock.sendall(json.dumps({
+            "cmd":      cmd,
+            "match_id": match_id,
+            "category": category,
+            "user":     user_id
+        }).encode() + b"\n")
+
+    def subscribe(self, match_id, category, user_id):
+        self.send("SUBSCRIBE", match_id, category, user_id)
+
+    def unsubscribe(self, match_id, category, user_id):
+        self.send("UNSUBSCRIBE", match_id, category, user_id)
+
+    def poll(self, timeout):
+        """Seat choices that arrived within timeout, as parsed JSON objects"""
+        ready, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        if not ready:
+            return []
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("selection service closed the connection")
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b"\n")
+        return [json.loads(line) for line in lines if line.strip()]
 
 def handle_reservation(user_request):
     return uuid.uuid4().int % 2 == 0
 
-def coordinator(req_host, req_port):
-    comm = MPI.COMM_WORLD
-    size = comm.Get_size()
-
-    # connect to request server
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((req_host, req_port))
-
-    # --- 1) Initial seeding: no in‑flight jobs yet, so explicitly ask NEXT ---
-    for worker_rank in range(1, size):
-        sock.sendall(json.dumps({"cmd": "NEXT"}).encode() + b"\n")
-        line = sock.recv(4096).decode().strip()
-        req = json.loads(line)
-        comm.send(
-            (req["match_id"], req["category"], req["user"]),
-            dest=worker_rank,
-            tag=Tags.WORK
-        )
-
-    status = MPI.Status()
-    # --- 2) Main loop: for each DONE from a worker, echo it, then read the *server‑pushed* next ---
+def coordinator(transport, req_host, req_port):
+    size = transport.size
+
+    # connect to request server; framed protocol so one exchange serves every rank
+    sock = socket.create_connection((req_host, req_port))
+    frames = FrameReader(sock)
+
+    # one entry per free selection slot; ranks interleaved so work spreads evenly
+    idle = deque(rank for _ in range(USERS_PER_WORKER) for rank in range(1, size))
+    requested = deque()           # sizes of NEXT batches not answered yet, in order
+    in_flight = {rank: set() for rank in range(1, size)}   # users each rank is serving
+    orphans = deque()             # users whose worker died, for the next free slots
+    checked_at = time.monotonic()
+
+    def assign(user):
+        rank = idle.popleft()
+        in_flight[rank].add(user)
+        transport.send(user, dest=rank, tag=Tags.WORK)
+
     while True:
-        match_id, category, user_done = comm.recv(
-            source=MPI.ANY_SOURCE, tag=Tags.RESULT, status=status
-        )
-        worker_rank = status.Get_source()
-
-        # notify server that this user is done
-        done_msg = {"cmd":"DONE","match_id": match_id, "category": category, "user": user_done}
-        sock.sendall(json.dumps(done_msg).encode() + b"\n")
-
-        # now the server *pushes* the next request immediately—just read it
-        line = sock.recv(4096).decode().strip()
-        req = json.loads(line)
-        comm.send(
-            (req["match_id"], req["category"], req["user"]),
-            dest=worker_rank,
-            tag=Tags.WORK
-        )
-
-def worker(sel_host, sel_port):
-    comm = MPI.COMM_WORLD
-    rank = comm.Get_rank()
-
-    sel_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sel_sock.connect((sel_host, sel_port))
+        # --- 1) Collect finished users from the workers ---
+        # with every slot busy and nothing asked of the server, block here instead of spinning
+        done = []
+        result = transport.recv(Tags.RESULT, POLL_INTERVAL if not requested and not idle else 0)
+        while result is not None:
+            worker_rank, user = result
+            if worker_rank in in_flight:   # else the user was already re-issued to another rank
+                match_id, category, user_done = user
+                done.append({"match_id": match_id, "category": category, "user_name": user_done})
+                in_flight[worker_rank].discard(tuple(user))
+                idle.append(worker_rank)
+            result = transport.try_recv(Tags.RESULT)
 
+        # after collecting results, so whatever a dead worker finished still counts
+        if time.monotonic() - checked_at >= WORKER_CHECK_INTERVAL:
+            checked_at = time.monotonic()
+            for rank in transport.failed_ranks() & in_flight.keys():
+                users = in_flight.pop(rank)
+                print(f"[Coordinator] Worker {rank} exited; re-issuing its {len(users)} users")
+                orphans.extend(users)
+                idle = deque(r for r in idle if r != rank)
+            if not in_flight:
+                raise RuntimeError("every worker has exited")
+        while orphans and idle:
+            assign(orphans.popleft())
+
+        # --- 2) One frame reports them all and asks for work for every free slot ---
+        wanted = len(idle) - sum(requested)
+        if done or wanted > 0:
+            if done:
+                send_frame(sock, {"cmd": "DONE", "users": done, "next": max(wanted, 0)})
+            else:
+                send_frame(sock, {"cmd": "NEXT", "n": wanted})
+            if wanted > 0:
+                requested.append(wanted)
+
+        # --- 3) Hand out whatever the server has sent back ---
+        timeout = POLL_INTERVAL if requested and not done else 0
+        while frames.ready(timeout):
+            timeout = 0
+            reply = frames.read_frame()
+            requested.popleft()   # a short batch is topped up by the next NEXT
+            if "error" in reply:
+                print(f"[Coordinator] Server error: {reply['error']}")
+                continue
+            for req in reply["users"]:
+                user = (req["match_id"], req["category"], req["user_name"])
+                if idle:
+                    assign(user)
+                else:
+                    orphans.append(user)   # its slot went with a worker that died
+
+def worker(transport, sel_host, sel_port):
+    rank = transport.rank
+    selection = SelectionClient(sel_host, sel_port)
+
+    # Many users in selection at once: deadline per user, earliest first in a heap.
+    # Heap entries whose user already chose a seat are skipped when they surface.
+    deadlines = {}   # (match_id, category, user) -> deadline
+    heap = []
     while True:
-        m, c, u = comm.recv(source=0, tag=Tags.WORK)
-        print(f"[Worker {rank}] Serving {m}-{c}:{u}")
+        # --- 1) Subscribe every user the coordinator handed us ---
+        while (work := transport.try_recv(Tags.WORK)) is not None:
+            _, (m, c, u) = work
+            print(f"[Worker {rank}] Serving {m}-{c}:{u}")
+            deadline = time.monotonic() + SELECTION_TIMEOUT
+            deadlines[(m, c, u)] = deadline
+            heapq.heappush(heap, (deadline, (m, c, u)))
+            selection.subscribe(m, c, u)
 
-        seat = wait_for_selection(sel_sock, m, c, u, SELECTION_TIMEOUT)
-        if seat:
-            print(f"[Worker {rank}] {u} got seat={seat}")
-            success = True
-        else:
-            print(f"[Worker {rank}] {u} timed out")
-            success = False
+        # --- 2) Wait for seat choices, but no longer than the nearest deadline ---
+        timeout = POLL_INTERVAL
+        if heap:
+            timeout = min(timeout, heap[0][0] - time.monotonic())
+        for choice in selection.poll(timeout):
+            key = (choice.get("match_id"), choice.get("category"), choice.get("user"))
+            if deadlines.pop(key, None) is None:
+                continue   # already timed out
+            if choice.get("seat_id"):
+                print(f"[Worker {rank}] {key[2]} got seat={choice['seat_id']}")
+            else:
+                print(f"[Worker {rank}] {key[2]} left without a seat")
+            # echo back the *same* triple
+            transport.send(key, dest=0, tag=Tags.RESULT)
 
-        # echo back the *same* triple
-        comm.send((m, c, u), dest=0, tag=Tags.RESULT)
+        # --- 3) Expire users whose selection window closed ---
+        now = time.monotonic()
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            if deadlines.get(key) != deadline:
+                continue
+            del deadlines[key]
+            print(f"[Worker {rank}] {key[2]} timed out")
+            selection.unsubscribe(*key)
+            transport.send(key, dest=0, tag=Tags.RESULT)
+
+def address(value):
+    host, port = value.rsplit(":", 1)
+    return host, int(port)
+
+def run_local_worker(rank, inboxes, selection):
+    worker(LocalTransport(rank, inboxes), *selection)
 
 def main():
-    comm = MPI.COMM_WORLD
-    rank = comm.Get_rank()
-    if rank == 0:
-        coordinator(req_host="127.0.0.1", req_port=5000)
+    parser = argparse.ArgumentParser(description="Reservation coordinator and workers")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run N local worker processes instead of using MPI ranks")
+    parser.add_argument("--server", type=address, default=("127.0.0.1", 5000),
+                        help="request server (waiting.py) host:port")
+    parser.add_argument("--selection", type=address, default=("127.0.0.1", 6000),
+                        help="selection service host:port")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        inboxes = [multiprocessing.Queue() for _ in range(args.workers + 1)]
+        processes = {
+            rank: multiprocessing.Process(target=run_local_worker, args=(rank, inboxes, args.selection), daemon=True)
+            for rank in range(1, args.workers + 1)
+        }
+        for process in processes.values():
+            process.start()
+        coordinator(LocalTransport(0, inboxes, processes), *args.server)
+        return
+
+    transport = MPITransport()
+    if transport.rank == 0:
+        coordinator(transport, *args.server)
     else:
-        worker(sel_host="127.0.0.1", sel_port=6000)
+        worker(transport, *args.selection)
 
 if __name__ == "__main__":
     main()
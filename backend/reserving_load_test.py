@@ -0,0 +1,112 @@
+# reserving_load_test.py
+"""
+Load test for the NEXT/DONE protocol served by reserving_server.py.
+
+By default it starts a ReservingServer in-process with pre-filled queues, then
+opens several coordinator connections that each keep a window of requests in
+flight: every reply is answered with a DONE for that user, which fetches the
+next one. Prints completed NEXT/DONE cycles per second.
+
+    python reserving_load_test.py --clients 8 --pipeline 32 --seconds 10
+    python reserving_load_test.py --framed    # NEXT n / multi-DONE batches
+    python reserving_load_test.py --connect 127.0.0.1:5000    # a running waiting.py
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+from framing import encode_frame, read_frame
+from reserving_server import POLICIES, ReservingServer
+
+
+async def coordinator(host, port, pipeline, deadline, counts):
+    reader, writer = await asyncio.open_connection(host, port)
+    for _ in range(pipeline):
+        writer.write(b'{"cmd": "NEXT"}\n')
+    await writer.drain()
+    while time.monotonic() < deadline:
+        line = await reader.readline()
+        if not line:
+            break
+        reply = json.loads(line)
+        if "error" in reply:
+            print(f"Server error: {reply['error']}")
+            break
+        counts[0] += 1
+        writer.write((json.dumps({
+            "cmd": "DONE",
+            "match_id": reply["match_id"],
+            "category": reply["category"],
+            "user_name": reply["user_name"]
+        }) + "\n").encode())
+        await writer.drain()
+    writer.close()
+
+
+async def framed_coordinator(host, port, pipeline, deadline, counts):
+    """Batched protocol: one DONE per reply, carrying the whole batch and asking for as many again"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_frame({"cmd": "NEXT", "n": pipeline}))
+    await writer.drain()
+    while time.monotonic() < deadline:
+        reply = await read_frame(reader)
+        if "error" in reply:
+            print(f"Server error: {reply['error']}")
+            break
+        users = reply["users"]
+        counts[0] += len(users)
+        writer.write(encode_frame({"cmd": "DONE", "users": users, "next": len(users)}))
+        await writer.drain()
+    writer.close()
+
+
+async def run(args):
+    server = None
+    host, port = "127.0.0.1", args.port
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        port = int(port)
+    else:
+        queues = {
+            (str(match), category): deque(f"user_{match}_{category}_{i}" for i in range(args.users))
+            for match in range(1, args.matches + 1)
+            for category in ("vip", "premium", "standard")
+        }
+        server = ReservingServer(queues, threading.Lock(), policy=args.policy)
+        asyncio.create_task(server.serve(host, port))
+        await asyncio.sleep(0.2)
+
+    counts = [0]
+    started = time.monotonic()
+    deadline = started + args.seconds
+    client = framed_coordinator if args.framed else coordinator
+    await asyncio.gather(*(
+        client(host, port, args.pipeline, deadline, counts) for _ in range(args.clients)
+    ))
+    elapsed = time.monotonic() - started
+    print(f"{args.clients} {'framed ' if args.framed else ''}coordinators x {args.pipeline} in flight: "
+          f"{counts[0]} NEXT/DONE cycles in {elapsed:.1f}s = {counts[0] / elapsed:.0f} cycles/s")
+    if server:
+        print(f"Server stats: {server.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NEXT/DONE protocol load test")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--pipeline", type=int, default=32, help="requests in flight per coordinator")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--matches", type=int, default=10)
+    parser.add_argument("--users", type=int, default=20000, help="queued users per match and category")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--framed", action="store_true", help="use the batched, length-prefixed protocol")
+    parser.add_argument("--policy", default="round_robin", choices=sorted(POLICIES))
+    parser.add_argument("--connect", help="host:port of a running server instead of an in-process one")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
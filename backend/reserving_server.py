@@ -0,0 +1,369 @@
+# reserving_server.py
+"""
+NEXT/DONE protocol server between waiting.py's queues and the reservation coordinators.
+
+Two wire formats, told apart by the first byte a client sends. The original
+one is a JSON object per line in each direction:
+
+    {"cmd": "NEXT"}
+        -> {"match_id": ..., "category": ..., "user_name": ..., "user": ...}
+    {"cmd": "DONE", "match_id": ..., "category": ..., "user_name": ...}
+        -> the next user (send "next": false to only report the user as done; no reply)
+
+The framed format (see framing.py) uses length-prefixed JSON and batches:
+"NEXT n" and multi-user DONE, described in ReservingServer.handle_frame.
+
+Any number of coordinators can be connected. A connection may pipeline
+requests; replies come back in request order. When nobody is waiting a NEXT
+is parked until a user arrives, and parked requests are served first come,
+first served.
+
+Which queue the next user comes from is decided by a scheduler over the set of
+non-empty (match_id, category) keys, so a dispatch is O(1) and one busy match
+cannot starve the others. The policy is pluggable (see POLICIES).
+
+Once MAX_PIPELINE requests are unanswered on a connection the server stops
+reading from it, so a client that floods requests (or stops reading replies)
+is held back by TCP instead of growing server memory.
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from framing import MAX_FRAME, FrameError, encode_frame, read_frame
+
+MAX_PIPELINE = 1024   # unanswered requests per connection before reads pause
+MAX_BATCH = 1024      # users per framed NEXT reply; keeps replies well under MAX_FRAME
+
+Key = Tuple[str, str]   # (match_id, category)
+
+CATEGORY_WEIGHTS = {"vip": 3, "premium": 2, "standard": 1}
+SEATS_PER_TURN = 50      # deficit_seats: one extra user per turn for every this many remaining seats
+
+
+class DeficitRoundRobin:
+    """
+    Deficit round robin over the keys that have users waiting.
+
+    Keys take turns in a ready deque; on reaching the head a key earns
+    quantum(key) credits and serves one user per credit before moving to the
+    back. With quantum 1 this is plain round robin. Every operation is O(1);
+    the caller holds the queue lock.
+    """
+
+    def __init__(self, quantum: Callable[[Key], float] = None):
+        self.quantum = quantum or (lambda key: 1)
+        self.ready: Deque[Key] = deque()
+        self.members: Set[Key] = set()
+        self.deficit: Dict[Key, float] = {}
+
+    def mark_ready(self, key: Key):
+        if key not in self.members:
+            self.members.add(key)
+            self.ready.append(key)
+
+    def next_key(self) -> Optional[Key]:
+        if not self.ready:
+            return None
+        key = self.ready[0]
+        if self.deficit.get(key, 0) < 1:
+            self.deficit[key] = self.deficit.get(key, 0) + max(1, self.quantum(key))
+        return key
+
+    def took(self, key: Key, left: int):
+        """One user was taken from key, which now has `left` users waiting"""
+        self.deficit[key] -= 1
+        if not left:
+            self.ready.popleft()
+            self.members.discard(key)
+            self.deficit.pop(key, None)   # an idle key does not bank credit
+        elif self.deficit[key] < 1:
+            self.ready.rotate(-1)
+
+
+def round_robin(remaining_seats=None) -> DeficitRoundRobin:
+    return DeficitRoundRobin()
+
+def weighted_by_category(remaining_seats=None) -> DeficitRoundRobin:
+    return DeficitRoundRobin(lambda key: CATEGORY_WEIGHTS.get(str(key[1]).lower(), 1))
+
+def deficit_by_seats(remaining_seats: Callable[[Key], int] = None) -> DeficitRoundRobin:
+    """Matches and categories with more seats left get proportionally more turns"""
+    if remaining_seats is None:
+        return DeficitRoundRobin()
+    return DeficitRoundRobin(lambda key: remaining_seats(key) / SEATS_PER_TURN)
+
+POLICIES = {
+    "round_robin": round_robin,
+    "weighted": weighted_by_category,
+    "deficit_seats": deficit_by_seats,
+}
+
+
+class ReservingServer:
+    def __init__(self, waiting_queues: Dict[Key, Deque[str]], lock: threading.Lock,
+                 on_selecting: Callable[[str, str, str], None] = None,
+                 on_done: Callable[[str, str, str], None] = None,
+                 max_pipeline: int = MAX_PIPELINE,
+                 policy: str = "round_robin",
+                 remaining_seats: Callable[[Key], int] = None):
+        self.waiting_queues = waiting_queues   # filled through enqueue(), possibly from other threads
+        self.lock = lock
+        self.scheduler = POLICIES[policy](remaining_seats)
+        with lock:
+            for key, users in waiting_queues.items():
+                if users:
+                    self.scheduler.mark_ready(key)
+        self.on_selecting = on_selecting
+        self.on_done = on_done
+        self.max_pipeline = max_pipeline
+        self.parked: Deque[Tuple[asyncio.Future, Optional[int]]] = deque()   # (reply, batch size)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"connections": 0, "next": 0, "done": 0, "assigned": 0, "requeued": 0}
+
+    # ── queue side ──
+
+    def enqueue(self, match_id: str, category: str, user: str):
+        """Add a user to its waiting queue and wake parked NEXT requests; safe from any thread"""
+        key = (match_id, category)
+        with self.lock:
+            self.waiting_queues.setdefault(key, deque()).append(user)
+            self.scheduler.mark_ready(key)
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.dispatch)
+            except RuntimeError:
+                pass   # the loop closed; the user stays queued for the next serve()
+
+    def take_users(self, limit: int) -> List[Tuple[Key, str]]:
+        """Up to limit users in scheduler order, under one lock acquisition"""
+        taken = []
+        with self.lock:
+            while len(taken) < limit:
+                key = self.scheduler.next_key()
+                if key is None:
+                    break
+                users = self.waiting_queues[key]
+                taken.append((key, users.popleft()))
+                self.scheduler.took(key, len(users))
+        return taken
+
+    def requeue(self, reply: dict):
+        """Put back users whose assignment never reached a coordinator"""
+        users = reply["users"] if "users" in reply else [reply]
+        with self.lock:
+            for user in reversed(users):   # appendleft, so keep their original order
+                key = (user["match_id"], user["category"])
+                self.waiting_queues.setdefault(key, deque()).appendleft(user["user_name"])
+                self.scheduler.mark_ready(key)
+        self.stats["requeued"] += len(users)
+        self.dispatch()
+
+    # ── assignment ──
+
+    def assign(self, future: asyncio.Future, batch: Optional[int]) -> bool:
+        """Resolve future with one user, or with up to batch users if batch is set"""
+        taken = self.take_users(batch or 1)
+        if not taken:
+            return False
+        users = [
+            {"match_id": match_id, "category": category, "user_name": user, "user": user}
+            for (match_id, category), user in taken
+        ]
+        future.set_result({"users": users} if batch else users[0])
+        self.stats["assigned"] += len(users)
+        if self.on_selecting:
+            for user in users:
+                self.on_selecting(user["match_id"], user["category"], user["user_name"])
+        return True
+
+    def request_next(self, batch: Optional[int] = None) -> asyncio.Future:
+        future = self.loop.create_future()
+        # earlier parked requests go first, so only assign directly when none are waiting
+        if self.parked or not self.assign(future, batch):
+            self.parked.append((future, batch))
+        return future
+
+    def dispatch(self):
+        while self.parked:
+            future, batch = self.parked[0]
+            if future.done():   # its connection went away
+                self.parked.popleft()
+                continue
+            if not self.assign(future, batch):
+                break
+            self.parked.popleft()
+
+    # ── protocol ──
+
+    def reply_now(self, payload: dict) -> asyncio.Future:
+        future = self.loop.create_future()
+        future.set_result(payload)
+        return future
+
+    def record_done(self, match_id, category, user):
+        self.stats["done"] += 1
+        if self.on_done:
+            self.on_done(match_id, category, user)
+
+    def handle_line(self, line: bytes) -> Optional[asyncio.Future]:
+        """Line protocol: one user per NEXT, DONE replies with the next user unless "next" is false"""
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            return self.reply_now({"error": "invalid JSON"})
+        cmd = msg.get("cmd") if isinstance(msg, dict) else None
+
+        if cmd == "NEXT":
+            self.stats["next"] += 1
+            return self.request_next()
+
+        if cmd == "DONE":
+            user = msg.get("user_name", msg.get("user"))
+            if "match_id" not in msg or "category" not in msg or user is None:
+                return self.reply_now({"error": "DONE needs match_id, category and user_name"})
+            self.record_done(msg["match_id"], msg["category"], user)
+            if msg.get("next", True):
+                return self.request_next()
+            return None
+
+        return self.reply_now({"error": f"unknown cmd {cmd!r}"})
+
+    @staticmethod
+    def batch_count(msg: dict, field: str, default: int) -> Optional[int]:
+        """msg[field] as a user count clamped to 0..MAX_BATCH, or None if it is not an integer"""
+        value = msg.get(field, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            return None
+        try:
+            return min(max(int(value), 0), MAX_BATCH)
+        except ValueError:
+            return None
+
+    def handle_frame(self, msg) -> Optional[asyncio.Future]:
+        """
+        Framed protocol, batched:
+            {"cmd": "NEXT", "n": 4}  -> {"users": [...]} with 1 to n users
+            {"cmd": "DONE", "users": [{"match_id", "category", "user_name"}, ...], "next": 4}
+                -> like NEXT n=next; no reply when next is 0 (the default)
+        A NEXT is parked until at least one user is waiting, then gets as many
+        as are available up to n, so a coordinator can prefetch for all its ranks.
+        n and next are capped at MAX_BATCH.
+        """
+        cmd = msg.get("cmd") if isinstance(msg, dict) else None
+
+        if cmd == "NEXT":
+            n = self.batch_count(msg, "n", 1)
+            if n is None:
+                return self.reply_now({"error": "n must be an integer"})
+            self.stats["next"] += 1
+            return self.request_next(max(1, n))
+
+        if cmd == "DONE":
+            users = msg.get("users", [])
+            wanted = self.batch_count(msg, "next", 0)
+            if wanted is None:
+                return self.reply_now({"error": "next must be an integer"})
+            if not isinstance(users, list) or not all(
+                    isinstance(u, dict) and "match_id" in u and "category" in u and "user_name" in u
+                    for u in users):
+                return self.reply_now({"error": "DONE users need match_id, category and user_name"})
+            for user in users:
+                self.record_done(user["match_id"], user["category"], user["user_name"])
+            return self.request_next(wanted) if wanted > 0 else None
+
+        return self.reply_now({"error": f"unknown cmd {cmd!r}"})
+
+    def fit_frame(self, reply: dict) -> bytes:
+        """Encode a framed reply; users that would push it past MAX_FRAME go back to their queues"""
+        try:
+            return encode_frame(reply)
+        except FrameError as e:
+            error = str(e)
+        fits, rest, size = [], [], 64   # 64: room for the envelope
+        for user in reply.get("users", []):
+            entry = len(json.dumps(user)) + 2
+            if entry + 64 > MAX_FRAME:
+                print(f"[ReserveMgr] Dropping user entry of {entry} bytes, larger than a frame")
+            elif size + entry <= MAX_FRAME and not rest:
+                fits.append(user)
+                size += entry
+            else:
+                rest.append(user)
+        if rest:
+            self.requeue({"users": rest})
+        return encode_frame({"users": fits} if fits else {"error": error})
+
+    async def send_replies(self, replies: asyncio.Queue, writer: asyncio.StreamWriter, sending: list, framed: bool):
+        while True:
+            future = await replies.get()
+            sending[:] = [future]
+            reply = await future
+            if framed:
+                data = self.fit_frame(reply)
+            else:
+                data = (json.dumps(reply) + "\n").encode()
+            writer.write(data)
+            await writer.drain()
+            sending.clear()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        self.stats["connections"] += 1
+        print(f"[ReserveMgr] Connection from {peer}")
+
+        replies: asyncio.Queue = asyncio.Queue(self.max_pipeline)
+        sending: list = []   # the reply being written, if any
+        sender = None
+        try:
+            # JSON lines start with "{"; frames start with a length header
+            first = await reader.readexactly(1)
+            framed = first not in b"{ \t\r\n"
+            sender = asyncio.create_task(self.send_replies(replies, writer, sending, framed))
+            while not sender.done():
+                if framed:
+                    reply = self.handle_frame(await read_frame(reader, first))
+                else:
+                    line = (first + await reader.readline()).strip()
+                    if not line:
+                        if reader.at_eof():
+                            break
+                        first = b""
+                        continue
+                    reply = self.handle_line(line)
+                first = b""
+                if reply is not None:
+                    await replies.put(reply)   # blocks at MAX_PIPELINE unanswered requests
+        except asyncio.IncompleteReadError:
+            pass   # closed, possibly mid-frame
+        except (ConnectionError, ValueError) as e:
+            print(f"[ReserveMgr] Connection error from {peer}: {e}")
+        finally:
+            if sender:
+                sender.cancel()
+            unsent = sending + [replies.get_nowait() for _ in range(replies.qsize())]
+            for future in unsent:
+                if future.done() and not future.cancelled() and "error" not in future.result():
+                    self.requeue(future.result())
+                else:
+                    future.cancel()   # parked; dispatch() skips it
+            writer.close()
+            self.stats["connections"] -= 1
+            print(f"[ReserveMgr] Disconnected {peer}")
+
+    async def serve(self, host: str, port: int):
+        # only a loop that is actually serving takes over dispatch; a failed bind leaves it alone
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        loop = self.loop = asyncio.get_running_loop()
+        print(f"[ReserveMgr] Listening on {host}:{port}…")
+        self.dispatch()   # users may have queued before the loop existed
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.loop is loop:
+                self.loop = None
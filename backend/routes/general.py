@@ -1,24 +1,61 @@
+import asyncio
 import datetime
 import uuid
-from fastapi import APIRouter
-import httpx
+from fastapi import APIRouter, BackgroundTasks
+from dashboard_events import DashboardEmitter
 from Models.models import RequestCreate, RequestStatus
 from db.csv_api import *
 from db.schema import *
+from db.gate_index import GateIndex
 
 
 router = APIRouter()
 
+dashboard = DashboardEmitter()
+
 async def notify_dashboard(event_type: str, data: dict):
-    """Notify dashboard service of status changes"""
+    """Notify dashboard service of status changes (buffered, sent in batches)"""
+    dashboard.emit(event_type, data)
+
+# Turnstile lookups and check-in state; latest_status is written back in batches
+gate_index = GateIndex()
+GATE_FLUSH_DELAY = 1.0
+gate_flush_task = None
+
+def schedule_gate_flush():
+    global gate_flush_task
+    if gate_flush_task is None or gate_flush_task.done():
+        gate_flush_task = asyncio.get_running_loop().create_task(flush_gate_statuses())
+
+async def flush_gate_statuses():
+    await asyncio.sleep(GATE_FLUSH_DELAY)
+    while gate_index.pending_status:
+        await asyncio.to_thread(gate_index.flush)
+
+MAX_GATE_BATCH = 1000   # scans per /check_batch call
+
+def scan_epoch(timestamp):
+    """Epoch seconds of a scan timestamp such as 2024-04-30T10:00:00Z (naive means UTC), None if unreadable"""
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post("http://dashboard:8003/events", json={
-                "type": event_type,
-                "data": data
-            })
-    except Exception as e:
-        print(f"Failed to notify dashboard: {e}")
+        parsed = datetime.datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+@router.on_event("startup")
+async def load_gate_index():
+    await asyncio.to_thread(gate_index.load)
+
+@router.on_event("startup")
+async def start_dashboard_events():
+    dashboard.start()
+
+@router.on_event("shutdown")
+async def flush_pending_writes():
+    gate_index.flush()
+    await dashboard.close()
 
 @router.get("/matches")
 def get_matches():
@@ -61,8 +98,24 @@ def get_seats(match_id: str, catagory: str):
     
     return seats
 
+@router.get("/availability")
+def get_availability():
+    """
+    Count available seats per match and catagory in one pass over the seats
+    Output:
+    {
+        "1": {"VIP": 39, "Premium": 40, "Standard": 80}
+    }
+    """
+    availability = {}
+    for seat in read_all(seats_db):
+        counts = availability.setdefault(seat["match_id"], {catagory: 0 for catagory in CATAGORY})
+        if seat["status"] == "available":
+            counts[seat["catagory"]] = counts.get(seat["catagory"], 0) + 1
+    return availability
+
 @router.post("/requests")
-def create_request(requestCreate: RequestCreate):
+def create_request(requestCreate: RequestCreate, background_tasks: BackgroundTasks):
 
     """
     Create a new request
@@ -88,14 +141,23 @@ def create_request(requestCreate: RequestCreate):
         "timestamp": requestCreate.timestamp if requestCreate.timestamp else str(datetime.datetime.now())
     }
     
-    add_record(request_db, request_fields, request)
+    gate_index.add_request(request)
     add_record(requests_status_db, requests_status_fields, request_status)
+
+    # sent after the response, so the dashboard can keep its aggregates current
+    background_tasks.add_task(notify_dashboard, "request_status", {
+        "request_id": request_id,
+        "match_id": requestCreate.match_id,
+        "catagory": requestCreate.catagory,
+        "status": request_status["status"],
+        "timestamp": request_status["timestamp"]
+    })
     
     return {"request_id": request_id}
 
 
 @router.post("/request_status")
-def create_request_status(requestStatus: RequestStatus):
+def create_request_status(requestStatus: RequestStatus, background_tasks: BackgroundTasks):
     """
     Add a new status for a request
     Input:
@@ -113,6 +175,11 @@ def create_request_status(requestStatus: RequestStatus):
     }
     
     add_record(requests_status_db, requests_status_fields, request_status)
+    background_tasks.add_task(notify_dashboard, "request_status", {
+        "request_id": requestStatus.request_id,
+        "status": requestStatus.status,
+        "timestamp": requestStatus.timestamp
+    })
     return request_status
 @router.get("/check_seat/{match_id}/{catagory}/{seat_id}")
 def check_seat(match_id: str, catagory: str, seat_id: int):
@@ -188,7 +255,7 @@ def reserve_seat(requestCreate: RequestCreate):
             "seat_id": requestCreate.seat_id,
             "user_name": requestCreate.user_name
         }
-        add_record(reservations_db, reservations_fields, reservation)
+        gate_index.add_reservation(reservation)
         return {"status": "success", "message": f"Reserved seat {requestCreate.seat_id} for match {requestCreate.match_id}"}
     else:
         return {"status": "error", "message": f"Seat {requestCreate.seat_id} is not available for match {requestCreate.match_id}"}
@@ -209,40 +276,14 @@ async def check_in(request: dict):
     {
         "reservation_id": "uuid",
         "status": "checked_in",
-        "timestamp": "2024-04-30T10:00:00Z"
+        "timestamp": "2024-04-30T10:00:00Z",
+        "gate_id": "north-3"            (optional)
     }
     """
-    print(request)
-    # Get the reservation
-    reservation = search_records(reservations_db, {"reservation_id": request["reservation_id"]})
+    # Resolve the scanned reservation and the request it belongs to
+    reservation, matching_request = gate_index.resolve(request["reservation_id"])
     if not reservation:
         return {"status": "error", "message": "Reservation not found"}
-    
-    # Get all requests by this user for this match
-    request_records = search_records(
-        request_db, 
-        {
-            "user_name": reservation[0]["user_name"],
-            "match_id": reservation[0]["match_id"]
-        }
-    )
-
-    if not request_records:
-        return {"status": "error", "message": "No requests found for this reservation"}
-
-    # Find the specific request that matches this seat_id
-    matching_request = None
-    for req in request_records:
-        # Get the reservation for this request to check the seat
-        req_reservation = search_records(reservations_db, {
-            "user_name": req["user_name"],
-            "match_id": req["match_id"],
-            "seat_id": reservation[0]["seat_id"]  # Match the specific seat
-        })
-        if req_reservation:
-            matching_request = req
-            break
-    print("matching_request", matching_request)
     if not matching_request:
         return {"status": "error", "message": "No request found for this reservation"}
 
@@ -258,21 +299,17 @@ async def check_in(request: dict):
         "timestamp": request["timestamp"]
     }
     # Update request's latest_status
-    update_record(
-        request_db,
-        request_fields,
-        matching_request["request_id"],
-        {"latest_status": "checked_in"},
-        "request_id"
-    )
+    gate_index.set_status(matching_request["request_id"], "checked_in", scan_epoch(request["timestamp"]))
+    schedule_gate_flush()
     
     add_record(requests_status_db, requests_status_fields, status_record)
     
     # Notify dashboard
     await notify_dashboard("check_in", {
-        "match_id": reservation[0]["match_id"],
+        "match_id": reservation["match_id"],
         "request_id": matching_request["request_id"],
-        "timestamp": request["timestamp"]
+        "timestamp": request["timestamp"],
+        "gate_id": request.get("gate_id")
     })
     
     return {"status": "success", "message": "Check-in recorded successfully"}
@@ -285,39 +322,14 @@ async def check_out(request: dict):
     {
         "reservation_id": "uuid",
         "status": "checked_out",
-        "timestamp": "2024-04-30T10:00:00Z"
+        "timestamp": "2024-04-30T10:00:00Z",
+        "gate_id": "north-3"            (optional)
     }
     """
-    # Get the reservation
-    reservation = search_records(reservations_db, {"reservation_id": request["reservation_id"]})
+    # Resolve the scanned reservation and the request it belongs to
+    reservation, matching_request = gate_index.resolve(request["reservation_id"])
     if not reservation:
         return {"status": "error", "message": "Reservation not found"}
-    
-    # Get all requests by this user for this match
-    request_records = search_records(
-        request_db, 
-        {
-            "user_name": reservation[0]["user_name"],
-            "match_id": reservation[0]["match_id"]
-        }
-    )
-
-    if not request_records:
-        return {"status": "error", "message": "No requests found for this reservation"}
-
-    # Find the specific request that matches this seat_id
-    matching_request = None
-    for req in request_records:
-        # Get the reservation for this request to check the seat
-        req_reservation = search_records(reservations_db, {
-            "user_name": req["user_name"],
-            "match_id": req["match_id"],
-            "seat_id": reservation[0]["seat_id"]  # Match the specific seat
-        })
-        if req_reservation:
-            matching_request = req
-            break
-
     if not matching_request:
         return {"status": "error", "message": "No request found for this reservation"}
 
@@ -336,25 +348,131 @@ async def check_out(request: dict):
     }
     
     # Update request's latest_status
-    update_record(
-        request_db,
-        request_fields,
-        matching_request["request_id"],
-        {"latest_status": "checked_out"},
-        "request_id"
-    )
+    gate_index.set_status(matching_request["request_id"], "checked_out", scan_epoch(request["timestamp"]))
+    schedule_gate_flush()
     
     add_record(requests_status_db, requests_status_fields, status_record)
     
     # Notify dashboard
     await notify_dashboard("check_out", {
-        "match_id": reservation[0]["match_id"],
+        "match_id": reservation["match_id"],
         "request_id": matching_request["request_id"],
-        "timestamp": request["timestamp"]
+        "timestamp": request["timestamp"],
+        "gate_id": request.get("gate_id")
     })
     
     return {"status": "success", "message": "Check-out recorded successfully"}
 
 
-
-
+def apply_scan(scan: dict, offline: bool):
+    """
+    Validate one gate scan against the index and update the ticket's state.
+    Returns (result, message, request); the caller writes the status row.
+
+    Online scans follow the same rules as /check_in and /check_out. Offline
+    scans were collected while the gate had no network and are replayed later:
+    - a scan that repeats the ticket's current state is a "duplicate", so a
+      device can safely resend a batch whose response it never received
+    - a scan older than the ticket's last recorded transition is "stale" (e.g.
+      an entry synced after the exit from another gate) and is ignored
+    - a check-out of a ticket that was never checked in is accepted, since the
+      entry scan may still be sitting on another device
+    """
+    status = scan.get("status")
+    if status not in ("checked_in", "checked_out"):
+        return "rejected", "status must be checked_in or checked_out", None
+    scanned_at = scan_epoch(scan.get("timestamp"))
+    if scanned_at is None:
+        return "rejected", "Invalid timestamp", None
+
+    if not isinstance(scan.get("reservation_id"), str):
+        return "rejected", "reservation_id is required", None
+    reservation, matching_request = gate_index.resolve(scan.get("reservation_id"))
+    if not reservation:
+        return "rejected", "Reservation not found", None
+    if not matching_request:
+        return "rejected", "No request found for this reservation", None
+
+    current = matching_request["latest_status"]
+    if offline:
+        if current == status:
+            return "duplicate", f"Already {status}", None
+        last_scan = gate_index.last_scan.get(matching_request["request_id"])
+        if last_scan is not None and scanned_at < last_scan:
+            return "stale", "Older than the last recorded scan for this ticket", None
+        if status == "checked_in" and current == "checked_out":
+            return "rejected", "This reservation is already checked out", None
+    elif status == "checked_in" and current in ("checked_in", "checked_out"):
+        return "rejected", "This reservation is already checked in", None
+    elif status == "checked_out" and current == "checked_out":
+        return "rejected", "This reservation is already checked out", None
+    elif status == "checked_out" and current != "checked_in":
+        return "rejected", "This reservation must be checked in before it can be checked out", None
+
+    gate_index.set_status(matching_request["request_id"], status, scanned_at)
+    return "accepted", None, {**matching_request, "match_id": reservation["match_id"]}
+
+@router.post("/check_batch")
+async def check_batch(batch: dict):
+    """
+    Check in / check out many scans at once, e.g. a gate device syncing its queue
+    Input:
+    {
+        "gate_id": "north-3",           (optional, a scan's own gate_id wins)
+        "offline": true,
+        "scans": [
+            {"reservation_id": "uuid", "status": "checked_in", "timestamp": "2024-04-30T10:00:00Z"},
+            {"reservation_id": "uuid", "status": "checked_out", "timestamp": "2024-04-30T12:10:00Z"}
+        ]
+    }
+    Offline batches are applied in timestamp order with the conflict policy
+    described in apply_scan; otherwise scans are applied in the order given.
+    Output, one result per scan in input order:
+    {
+        "status": "success",
+        "results": [{"reservation_id": "uuid", "result": "accepted", "message": null}, ...]
+    }
+    result: accepted, duplicate, stale or rejected
+    """
+    scans = batch.get("scans") or []
+    if not isinstance(scans, list):
+        return {"status": "error", "message": "scans must be a list"}
+    if len(scans) > MAX_GATE_BATCH:
+        return {"status": "error", "message": f"At most {MAX_GATE_BATCH} scans per batch"}
+    # a malformed entry is rejected on its own instead of failing the whole batch
+    scans = [scan if isinstance(scan, dict) else {} for scan in scans]
+    offline = bool(batch.get("offline", False))
+
+    order = range(len(scans))
+    if offline:
+        order = sorted(order, key=lambda i: scan_epoch(scans[i].get("timestamp")) or 0.0)
+
+    results = [None] * len(scans)
+    status_rows, events = [], []
+    for i in order:
+        scan = scans[i]
+        result, message, matched = apply_scan(scan, offline)
+        results[i] = {"reservation_id": scan.get("reservation_id"), "result": result, "message": message}
+        if matched is None:   # only accepted scans come with their request
+            continue
+        status_rows.append({
+            "requests_status_id": str(uuid.uuid1()),
+            "request_id": matched["request_id"],
+            "status": scan["status"],
+            "timestamp": scan["timestamp"]
+        })
+        events.append((scan["status"], {
+            "match_id": matched["match_id"],
+            "request_id": matched["request_id"],
+            "timestamp": scan["timestamp"],
+            "gate_id": scan.get("gate_id", batch.get("gate_id"))
+        }))
+
+    # One append for all status rows; latest_status goes out with the next gate flush
+    if status_rows:
+        await asyncio.to_thread(add_records, requests_status_db, requests_status_fields, status_rows)
+        schedule_gate_flush()
+    for event_type, data in events:
+        await notify_dashboard(event_type, data)
+
+    return {"status": "success", "results": results}
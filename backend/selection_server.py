@@ -0,0 +1,216 @@
+# selection_server.py
+"""
+Seat-selection pub/sub service between the reservation WebSocket flow and the
+reserving.py workers (the selection service reserving.py expects on port 6000).
+
+JSON lines in both directions. Workers subscribe for the users they serve:
+
+    {"cmd": "SUBSCRIBE",   "match_id": ..., "category": ..., "user": ...}
+    {"cmd": "UNSUBSCRIBE", "match_id": ..., "category": ..., "user": ...}
+
+and receive one line per user once that user picks a seat:
+
+    {"match_id": ..., "category": ..., "user": ..., "seat_id": ...}
+
+echoing the worker's own match_id/category/user values. reservation.py
+publishes each completed choice (no reply):
+
+    {"cmd": "PUBLISH", "match_id": ..., "category": ..., "user": ..., "seat_id": ...}
+
+Subscriptions live in a dict keyed by (match, category, user), compared
+case-insensitively, so routing a choice is O(1). A choice that arrives before
+its subscription is held for CHOICE_TTL seconds and delivered on SUBSCRIBE.
+Subscriptions and held choices expire through a deadline heap, and a worker's
+subscriptions are dropped when its connection closes. Replies go out through a
+bounded outbox per connection; a worker that falls MAX_OUTBOX lines behind is
+disconnected rather than buffered without limit.
+
+    python selection_server.py --port 6000
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+SUBSCRIPTION_TTL = 60.0   # seconds; longer than reserving.py's SELECTION_TIMEOUT
+CHOICE_TTL = 30.0         # seconds a choice waits for its subscriber
+SWEEP_INTERVAL = 1.0
+MAX_OUTBOX = 10000        # unsent lines per connection before it is dropped as too slow
+
+Key = Tuple[str, str, str]
+
+
+def selection_key(msg: dict) -> Key:
+    return (str(msg["match_id"]), str(msg["category"]).lower(), str(msg["user"]).lower())
+
+
+class Subscription:
+    __slots__ = ("writer", "match_id", "category", "user", "deadline")
+
+    def __init__(self, writer: asyncio.StreamWriter, msg: dict, deadline: float):
+        self.writer = writer
+        self.match_id = msg["match_id"]
+        self.category = msg["category"]
+        self.user = msg["user"]
+        self.deadline = deadline
+
+
+class SelectionServer:
+    def __init__(self, subscription_ttl: float = SUBSCRIPTION_TTL, choice_ttl: float = CHOICE_TTL):
+        self.subscription_ttl = subscription_ttl
+        self.choice_ttl = choice_ttl
+        self.subscriptions: Dict[Key, Subscription] = {}
+        self.choices: Dict[Key, Tuple[object, float]] = {}        # key -> (seat_id, deadline)
+        self.by_connection: Dict[asyncio.StreamWriter, Set[Key]] = {}
+        self.outboxes: Dict[asyncio.StreamWriter, asyncio.Queue] = {}
+        self.deadlines: List[Tuple[float, Key]] = []              # heap; stale entries skipped
+        self.stats = {"subscribed": 0, "published": 0, "delivered": 0, "held": 0, "expired": 0,
+                      "slow_disconnects": 0}
+        self.sweeper_task: Optional[asyncio.Task] = None
+
+    # ── routing ──
+
+    def send(self, writer: asyncio.StreamWriter, payload: dict):
+        outbox = self.outboxes.get(writer)
+        if outbox is None:
+            return   # the connection is gone
+        try:
+            outbox.put_nowait((json.dumps(payload) + "\n").encode())
+        except asyncio.QueueFull:
+            logging.info(f"Selection client {writer.get_extra_info('peername')} is not reading; disconnecting")
+            self.stats["slow_disconnects"] += 1
+            del self.outboxes[writer]
+            writer.transport.abort()   # its subscriptions are dropped as the connection closes
+
+    def deliver(self, subscription: Subscription, seat_id):
+        self.send(subscription.writer, {
+            "match_id": subscription.match_id,
+            "category": subscription.category,
+            "user": subscription.user,
+            "seat_id": seat_id
+        })
+        self.stats["delivered"] += 1
+
+    def subscribe(self, writer: asyncio.StreamWriter, msg: dict):
+        key = selection_key(msg)
+        held = self.choices.pop(key, None)
+        if held is not None:
+            self.deliver(Subscription(writer, msg, 0), held[0])
+            return
+        deadline = time.monotonic() + self.subscription_ttl
+        self.drop_subscription(key)   # a resubscribe moves the user to this connection
+        self.subscriptions[key] = Subscription(writer, msg, deadline)
+        self.by_connection.setdefault(writer, set()).add(key)
+        heapq.heappush(self.deadlines, (deadline, key))
+        self.stats["subscribed"] += 1
+
+    def drop_subscription(self, key: Key):
+        subscription = self.subscriptions.pop(key, None)
+        if subscription is not None:
+            self.by_connection.get(subscription.writer, set()).discard(key)
+
+    def publish(self, msg: dict):
+        key = selection_key(msg)
+        self.stats["published"] += 1
+        subscription = self.subscriptions.get(key)
+        if subscription is not None:
+            self.drop_subscription(key)
+            self.deliver(subscription, msg.get("seat_id"))
+            return
+        deadline = time.monotonic() + self.choice_ttl
+        self.choices[key] = (msg.get("seat_id"), deadline)
+        heapq.heappush(self.deadlines, (deadline, key))
+        self.stats["held"] += 1
+
+    def sweep(self, now: float):
+        """Expire subscriptions and held choices whose deadline passed"""
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self.deadlines)
+            subscription = self.subscriptions.get(key)
+            if subscription is not None and subscription.deadline == deadline:
+                self.drop_subscription(key)
+                self.stats["expired"] += 1
+            held = self.choices.get(key)
+            if held is not None and held[1] == deadline:
+                del self.choices[key]
+                self.stats["expired"] += 1
+
+    async def sweeper(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep(time.monotonic())
+
+    # ── connections ──
+
+    async def send_lines(self, writer: asyncio.StreamWriter, outbox: asyncio.Queue):
+        try:
+            while True:
+                writer.write(await outbox.get())
+                await writer.drain()
+        except ConnectionError:
+            pass   # the reading side notices the closed connection and cleans up
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        logging.info(f"Selection client connected: {peer}")
+        outbox = self.outboxes[writer] = asyncio.Queue(MAX_OUTBOX)
+        sender = asyncio.create_task(self.send_lines(writer, outbox))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                    cmd = msg["cmd"]
+                    if cmd == "SUBSCRIBE":
+                        self.subscribe(writer, msg)
+                    elif cmd == "UNSUBSCRIBE":
+                        key = selection_key(msg)
+                        if key in self.by_connection.get(writer, ()):
+                            self.drop_subscription(key)
+                    elif cmd == "PUBLISH":
+                        self.publish(msg)
+                    elif cmd == "STATS":
+                        self.send(writer, {**self.stats, "subscriptions": len(self.subscriptions),
+                                           "held_choices": len(self.choices)})
+                    else:
+                        logging.info(f"Unknown command from {peer}: {cmd!r}")
+                except (ValueError, KeyError, TypeError) as e:
+                    logging.info(f"Bad message from {peer}: {line!r} ({e})")
+        except ConnectionError as e:
+            logging.info(f"Selection client {peer} failed: {e}")
+        finally:
+            sender.cancel()
+            self.outboxes.pop(writer, None)
+            for key in self.by_connection.pop(writer, set()):
+                self.subscriptions.pop(key, None)
+            writer.close()
+            logging.info(f"Selection client disconnected: {peer}")
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.sweeper_task = asyncio.create_task(self.sweeper())
+        logging.info(f"Selection service listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.sweeper_task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seat-selection pub/sub service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(SelectionServer().serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# tests/test_queue_cluster.py
+"""
+Multi-instance queue service: a rebalance must not lose joins.
+
+Runs queue_cluster.py (local broker plus two queuing.py instances) against a
+stub match list, fills one topic's admission window on its owner, moves the
+topic to the other instance with PUT /peers and checks that the user in
+selection and the user whose join was read but not yet admitted both carry on
+there.
+"""
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("uvicorn")
+pytest.importorskip("httpx")
+websockets_client = pytest.importorskip("websockets.sync.client")
+
+import httpx
+
+import local_broker
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def matches_api():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            payload = json.dumps([{"match_id": "1", "team1_name": "A", "team2_name": "B",
+                                   "number_of_seats": "100"}]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api/general/matches"
+    server.shutdown()
+
+
+@contextmanager
+def running_cluster(matches_api: str, snapshot_dir, instances: int = 2, **env):
+    """queue_cluster.py with its instances up; yields ({instance: url}, broker address)"""
+    base_port = free_port()
+    broker_port = free_port()
+    env = {**os.environ, "MIN_QUEUE_SIZE": "1", "MAX_QUEUE_SIZE": "1", "HANDOFF_WAIT": "10",
+           "REGISTRATION_WAIT": "2", "DASHBOARD_URL": "http://127.0.0.1:9", "PYTHONUNBUFFERED": "1", **env}
+    process = subprocess.Popen(
+        [sys.executable, "queue_cluster.py", "--instances", str(instances), "--base-port", str(base_port),
+         "--broker-port", str(broker_port), "--matches-api", matches_api,
+         "--snapshot-dir", str(snapshot_dir)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    urls = {f"q{i}": f"http://127.0.0.1:{base_port + i}" for i in range(1, instances + 1)}
+    try:
+        for url in urls.values():
+            wait_until_up(url + "/topics")
+        yield urls, f"127.0.0.1:{broker_port}"
+    finally:
+        process.send_signal(signal.SIGINT)   # queue_cluster.py stops its children on Ctrl-C
+        process.wait(10)
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(url).raise_for_status()
+            return
+        except httpx.HTTPError:
+            if time.monotonic() > deadline:
+                pytest.fail(f"{url} did not come up")
+            time.sleep(0.2)
+
+
+@pytest.fixture
+def cluster(matches_api, tmp_path):
+    with running_cluster(matches_api, tmp_path) as running:
+        yield running
+
+
+@pytest.fixture
+def dashboard_url():
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "dashboard:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=dict(os.environ, DASHBOARD_EVENTS_MODE="http"),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(url + "/percentiles")
+        yield url
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def register(sockets: ExitStack, url: str, user_name: str, topic: str):
+    ws = sockets.enter_context(websockets_client.connect(url.replace("http", "ws", 1) + "/ws", open_timeout=5))
+    ws.send(json.dumps({"action": "register", "user_name": user_name,
+                        "matchId": topic.split(".")[1], "category": topic.split(".")[2]}))
+    assert json.loads(ws.recv(timeout=5))["type"] == "registered"
+    return ws
+
+
+def wait_for(ws, message_type: str, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while True:
+        message = json.loads(ws.recv(timeout=max(deadline - time.monotonic(), 0.01)))
+        if message["type"] == message_type:
+            return message
+
+
+def test_rebalance_keeps_admitted_and_unadmitted_joins(cluster):
+    urls, broker = cluster
+    with ExitStack() as sockets:
+        run_rebalance(sockets, urls, broker)
+
+
+def run_rebalance(sockets: ExitStack, urls: dict, broker: str):
+    owned = {instance: httpx.get(url + "/topics").json() for instance, url in urls.items()}
+    source = next(instance for instance, topics in owned.items() if topics)
+    target = next(instance for instance in urls if instance != source)
+    topic = owned[source][0]
+
+    first = register(sockets, urls[source], "fan_0", topic)
+    second = register(sockets, urls[source], "fan_1", topic)
+    producer = local_broker.Producer({"bootstrap.servers": broker})
+    for user_name in ("fan_0", "fan_1"):
+        producer.produce(topic, value=json.dumps({"username": user_name}))
+    producer.flush()
+
+    # a window of one: fan_0 is in selection, fan_1's join is read but waits
+    wait_for(first, "start_selection")
+    time.sleep(1.5)
+
+    only_target = {"peers": {target: urls[target]}}
+    for url in (urls[source], urls[target]):
+        assert httpx.put(url + "/peers", json=only_target, timeout=30).json()["status"] == "success"
+    assert wait_for(second, "redirect")["url"].startswith(urls[target].replace("http", "ws", 1))
+    assert topic in httpx.get(urls[target] + "/topics").json()
+
+    consumer = local_broker.Consumer({"bootstrap.servers": broker,
+                                      "group.id": "reservation-queue-service_" + topic})
+    assert consumer.committed([local_broker.TopicPartition(topic, 0)])[0].offset == 1
+
+    # fan_1 follows the redirect; once fan_0 finishes on the new owner, fan_1 is admitted there
+    second.close()
+    second = register(sockets, urls[target], "fan_1", topic)
+    finisher = register(sockets, urls[target], "fan_0", topic)
+    finisher.send(json.dumps({"action": "finish", "user_name": "fan_0",
+                              "matchId": topic.split(".")[1], "category": topic.split(".")[2]}))
+    assert wait_for(second, "start_selection")["category"] == topic.split(".")[2]
+
+
+def test_unregistered_join_is_dropped_after_registration_wait(cluster):
+    urls, broker = cluster
+    owned = {instance: httpx.get(url + "/topics").json() for instance, url in urls.items()}
+    source = next(instance for instance, topics in owned.items() if topics)
+    topic = owned[source][0]
+
+    with ExitStack() as sockets:
+        fan = register(sockets, urls[source], "fan_0", topic)
+        producer = local_broker.Producer({"bootstrap.servers": broker})
+        # the ghost never opens its WebSocket; fan_0 behind it is admitted once the ghost's join is dropped
+        for user_name in ("ghost", "fan_0"):
+            producer.produce(topic, value=json.dumps({"username": user_name}))
+        producer.flush()
+
+        started = time.monotonic()
+        wait_for(fan, "start_selection")
+        assert time.monotonic() - started >= 1.5
+
+
+def test_queue_wait_reaches_dashboard_percentiles(matches_api, tmp_path, dashboard_url):
+    with running_cluster(matches_api, tmp_path, instances=1, DASHBOARD_URL=dashboard_url) as (urls, broker), \
+            ExitStack() as sockets:
+        url = urls["q1"]
+        topic = httpx.get(url + "/topics").json()[0]
+        match_id, category = topic.split(".")[1], topic.split(".")[2]
+
+        # what SeatModal does: a "Waiting" request (no category, fresh request_id), register, join
+        httpx.post(dashboard_url + "/events", json={"type": "request_status", "data": {
+            "request_id": "waiting-request", "match_id": match_id, "catagory": None,
+            "status": "Waiting", "timestamp": "2026-01-01T10:00:00"}}).raise_for_status()
+        fan = register(sockets, url, "fan_0", topic)
+        time.sleep(0.5)
+        producer = local_broker.Producer({"bootstrap.servers": broker})
+        producer.produce(topic, value=json.dumps({"username": "fan_0"}))
+        producer.flush()
+
+        # ...and once admitted, a "Selecting" request under another request_id
+        wait_for(fan, "start_selection")
+        httpx.post(dashboard_url + "/events", json={"type": "request_status", "data": {
+            "request_id": "selecting-request", "match_id": match_id, "catagory": None,
+            "status": "Selecting", "timestamp": "2026-01-01T10:00:05"}}).raise_for_status()
+
+        deadline = time.monotonic() + 10
+        while True:
+            wait = httpx.get(dashboard_url + "/percentiles").json().get(match_id, {}).get("wait", {})
+            if category in wait or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        assert wait[category]["count"] == 1
+        assert wait[category]["p50"] >= 0.4
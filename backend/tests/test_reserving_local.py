@@ -0,0 +1,121 @@
+# tests/test_reserving_local.py
+"""
+reserving.py without MPI: the coordinator and local worker processes talk over
+LocalTransport, take users from an in-process ReservingServer and wait for
+seat choices from a stub selection service that picks a seat at once.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import socket
+import threading
+import time
+
+import pytest
+
+import reserving
+from reserving import LocalTransport, coordinator, run_local_worker
+from reserving_server import ReservingServer
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_in_thread(serve):
+    """Run an asyncio server coroutine on its own loop in a daemon thread"""
+    threading.Thread(target=lambda: asyncio.run(serve), daemon=True).start()
+
+
+async def instant_selection(host: str, port: int):
+    """Answers every SUBSCRIBE with a seat for that user"""
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            msg = json.loads(line)
+            if msg["cmd"] == "SUBSCRIBE":
+                writer.write((json.dumps({**msg, "seat_id": "A1"}) + "\n").encode())
+                await writer.drain()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+@pytest.fixture
+def services():
+    waiting_queues, lock = {}, threading.Lock()
+    reserving_server = ReservingServer(waiting_queues, lock)
+    server_port, selection_port = free_port(), free_port()
+    start_in_thread(reserving_server.serve("127.0.0.1", server_port))
+    start_in_thread(instant_selection("127.0.0.1", selection_port))
+    time.sleep(0.3)
+    return reserving_server, server_port, selection_port
+
+
+def run_coordinator(transport, port, errors):
+    try:
+        coordinator(transport, "127.0.0.1", port)
+    except Exception as e:   # the worker processes are gone at teardown
+        errors.append(e)
+
+
+def run_cluster(reserving_server, server_port, selections, users):
+    """Local workers (one per selection address) serve users; returns the coordinator's errors"""
+    for i in range(users):
+        reserving_server.enqueue(str(i % 2 + 1), "vip", f"fan_{i}")
+
+    ctx = multiprocessing.get_context("spawn")
+    inboxes = [ctx.Queue() for _ in range(len(selections) + 1)]
+    processes = {
+        rank: ctx.Process(target=run_local_worker, args=(rank, inboxes, selection), daemon=True)
+        for rank, selection in enumerate(selections, start=1)
+    }
+    for process in processes.values():
+        process.start()
+    errors = []
+    threading.Thread(target=run_coordinator, daemon=True,
+                     args=(LocalTransport(0, inboxes, processes), server_port, errors)).start()
+    try:
+        deadline = time.monotonic() + 60
+        while reserving_server.stats["done"] < users and time.monotonic() < deadline:
+            time.sleep(0.1)
+    finally:
+        for process in processes.values():
+            process.terminate()
+    return errors
+
+
+def test_local_workers_serve_every_user(services):
+    reserving_server, server_port, selection_port = services
+    selection = ("127.0.0.1", selection_port)
+    run_cluster(reserving_server, server_port, [selection, selection], users=200)
+
+    assert reserving_server.stats["done"] == 200
+    assert not any(reserving_server.waiting_queues.values())
+
+
+def test_users_of_a_dead_worker_are_reissued(services, monkeypatch):
+    monkeypatch.setattr(reserving, "WORKER_CHECK_INTERVAL", 0.1)
+    reserving_server, server_port, selection_port = services
+    # rank 1 cannot reach its selection service and exits right away
+    broken, working = ("127.0.0.1", free_port()), ("127.0.0.1", selection_port)
+    run_cluster(reserving_server, server_port, [broken, working], users=100)
+
+    assert reserving_server.stats["done"] == 100
+
+
+def test_transport_recv_waits_for_a_message():
+    inboxes = [multiprocessing.Queue(), multiprocessing.Queue()]
+    parent, child = LocalTransport(0, inboxes), LocalTransport(1, inboxes)
+
+    started = time.monotonic()
+    assert parent.recv(reserving.Tags.RESULT, 0.2) is None
+    assert time.monotonic() - started >= 0.2
+
+    child.send("work for later", dest=0, tag=reserving.Tags.WORK)
+    child.send(("1", "vip", "fan"), dest=0, tag=reserving.Tags.RESULT)
+    assert parent.recv(reserving.Tags.RESULT, 1) == (1, ("1", "vip", "fan"))
+    assert parent.try_recv(reserving.Tags.WORK) == (1, "work for later")
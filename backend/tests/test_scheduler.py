@@ -0,0 +1,79 @@
+# tests/test_scheduler.py
+"""
+NEXT scheduling policies of reserving_server.py, driven directly: every
+dispatch takes one user from the key the scheduler picks, as take_user does.
+"""
+
+from collections import Counter, deque
+
+from reserving_server import POLICIES
+
+
+def dispatch(scheduler, queues, count):
+    """Serve up to count users; returns how many each key got and the order of keys"""
+    for key, users in queues.items():
+        if users:
+            scheduler.mark_ready(key)
+    served, order = Counter(), []
+    for _ in range(count):
+        key = scheduler.next_key()
+        if key is None:
+            break
+        queues[key].popleft()
+        scheduler.took(key, len(queues[key]))
+        served[key] += 1
+        order.append(key)
+    return served, order
+
+
+def full_queues(*keys, users=1000):
+    return {key: deque(f"fan_{i}" for i in range(users)) for key in keys}
+
+
+def test_round_robin_serves_keys_in_turn():
+    a, b, c = ("1", "vip"), ("2", "vip"), ("3", "vip")
+    served, order = dispatch(POLICIES["round_robin"](), full_queues(a, b, c), 600)
+
+    assert served == {a: 200, b: 200, c: 200}
+    assert order[:6] == [a, b, c, a, b, c]
+
+
+def test_weighted_follows_category_weights():
+    vip, standard, other_vip = ("1", "vip"), ("1", "standard"), ("2", "VIP")
+    served, order = dispatch(POLICIES["weighted"](), full_queues(vip, standard, other_vip), 700)
+
+    assert served == {vip: 300, standard: 100, other_vip: 300}
+    assert order[:7] == [vip] * 3 + [standard] + [other_vip] * 3
+
+
+def test_deficit_seats_follows_remaining_seats():
+    big, also_big, small = ("1", "vip"), ("2", "vip"), ("3", "vip")
+    seats = {big: 500, also_big: 500, small: 50}
+    scheduler = POLICIES["deficit_seats"](lambda key: seats[key])
+    served, _ = dispatch(scheduler, full_queues(big, also_big, small), 630)
+
+    assert served == {big: 300, also_big: 300, small: 30}
+
+
+def test_sold_out_key_still_gets_a_turn():
+    open_key, sold_out = ("1", "vip"), ("2", "vip")
+    seats = {open_key: 500, sold_out: 0}
+    scheduler = POLICIES["deficit_seats"](lambda key: seats[key])
+    served, order = dispatch(scheduler, full_queues(open_key, sold_out), 22)
+
+    assert served == {open_key: 20, sold_out: 2}
+    assert order[10] == sold_out
+
+
+def test_idle_key_banks_no_credit():
+    busy, brief = ("1", "vip"), ("2", "vip")
+    queues = {busy: deque(f"fan_{i}" for i in range(100)), brief: deque(["late_fan"])}
+    scheduler = POLICIES["weighted"]()
+    served, _ = dispatch(scheduler, queues, 4)
+    assert served == {busy: 3, brief: 1}
+
+    # brief emptied and left; when users come back it rejoins behind busy with fresh credit
+    queues[brief].extend(["fan_a", "fan_b", "fan_c", "fan_d"])
+    served, order = dispatch(scheduler, queues, 6)
+    assert served == {busy: 3, brief: 3}
+    assert order == [busy] * 3 + [brief] * 3
@@ -1,18 +1,18 @@
 import os
+import queue
 import threading
 import time
 import uuid
-import multiprocessing
-from multiprocessing import Process, Queue
+import zlib
 from db.csv_api import *
 from threading import Lock
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 import asyncio
 from collections import deque
 from routes import general, reservation
-import socket
 import json
 import uvicorn
+from reserving_server import ReservingServer
 
 
 # Initialize FastAPI
@@ -38,23 +38,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 # Create a queue to store active WebSocket connections for FCFS
-connection_queue = Queue()
+connection_queue = queue.Queue()
 
 
 @app.on_event("startup")
 def start_background_tasks():
+    # started here rather than at import: uvicorn imports this module again as "waiting"
+    global recorder_pool
+    recorder_pool = RecorderPool()
+    if NEXT_POLICY == "deficit_seats":
+        threading.Thread(target=seat_counts.run, daemon=True).start()
     threading.Thread(
         target=waiting_queue_manager,
-        args=(waiting_queues, reserving_queues),
         daemon=True
     ).start()
     threading.Thread(
         target=reserving_queue_manager,
-        args=(reserving_queues, waiting_queues),
         daemon=True
     ).start()
 
 
+@app.on_event("shutdown")
+def stop_recorders():
+    if recorder_pool is not None:
+        recorder_pool.close()
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -81,11 +90,12 @@ writing_status_lock = Lock()
 
 # Configuration
 DATA_DIR = "./db"
-waiting_queues = {}
-waiting_queues_recorder = {}
-reserving_queues = {}
-
-worker_processes = {}
+RECORDER_WORKERS = int(os.getenv("RECORDER_WORKERS", "4"))
+RECORDER_BATCH = int(os.getenv("RECORDER_BATCH", "500"))     # records written per file operation
+RECORDER_LINGER = float(os.getenv("RECORDER_LINGER", "0.05"))  # seconds to wait for a batch to fill
+NEXT_POLICY = os.getenv("NEXT_POLICY", "round_robin")   # round_robin, weighted or deficit_seats
+SEATS_REFRESH = 30                                       # seconds between seat counts for deficit_seats
+waiting_queues = {}     # (match_id, category) -> deque of user names waiting for selection
 
 # SELECTION_HOST = "127.0.0.1"
 # SELECTION_PORT = 6000
@@ -118,36 +128,87 @@ def status_object(request_id, status):
         "timestamp": time.time()
     }
 
-def worker(match_id, category, waiting_queue, reserving_queue):
-    t1 = threading.Thread(target=waiting_recorder_thread, args=(match_id, category, waiting_queue))
-    t2 = threading.Thread(target=reserving_recorder_thread, args=(match_id, category, reserving_queue))
-    t1.start()
-    t2.start()
-    
+class RecorderPool:
+    """
+    Fixed pool of recorder threads that write request rows and status changes.
+
+    Each (match_id, category) key hashes to one worker, so the waiting,
+    selecting and done records of a user are written in order, while the
+    number of threads stays the same however many matches are on sale. A
+    worker drains up to RECORDER_BATCH records and writes them with one append
+    per CSV and one rewrite of requests.csv for the latest_status changes.
+    """
+
+    def __init__(self, size: int = RECORDER_WORKERS):
+        self.queues = [queue.Queue() for _ in range(size)]
+        self.threads = [
+            threading.Thread(target=self.run, args=(q,), name=f"recorder-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, kind, match_id, category, username):
+        """kind is 'waiting', 'selecting' or 'done'"""
+        index = zlib.crc32(f"{match_id}|{category}".encode()) % len(self.queues)
+        self.queues[index].put((kind, match_id, category, username))
+
+    def run(self, records):
+        stopping = False
+        while not stopping:
+            batch = [records.get()]
+            deadline = time.monotonic() + RECORDER_LINGER
+            while len(batch) < RECORDER_BATCH:
+                try:
+                    batch.append(records.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if None in batch:   # shutdown sentinel; write what came before it
+                batch = batch[:batch.index(None)]
+                stopping = True
+            try:
+                self.write(batch)
+            except Exception as e:
+                print(f"[Record] Failed to write {len(batch)} records: {e}")
+
+    def write(self, batch):
+        new_requests, statuses, latest = [], [], {}
+        for kind, match_id, category, username in batch:
+            request_id = f"{match_id}_{category}_{username}"
+            if kind == "waiting":
+                new_requests.append(request_object(request_id, username, match_id, category))
+            else:
+                latest[request_id] = {"latest_status": kind}
+            statuses.append(status_object(request_id, kind))
+
+        if new_requests:
+            with writing_request_lock:
+                add_records(requests_db, request_feild, new_requests)
+        if statuses:
+            with writing_status_lock:
+                add_records(requests_status_db, request_status_field, statuses)
+        if latest:
+            with writing_request_lock:
+                update_records(requests_db, request_feild, latest, id_field="request_id")
+        print(f"[Record] wrote {len(new_requests)} requests, {len(statuses)} status changes")
+
+    def close(self):
+        """Flush queued records and stop the workers"""
+        for records in self.queues:
+            records.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+recorder_pool = None   # RecorderPool, created at startup
 
 
 def log_selecting(match_id, category, username):
-    request_id = f"{match_id}_{category}_{username}"
-    with writing_request_lock:
-        update_record(
-            requests_db,
-            request_feild,
-            request_id,
-            {"latest_status": "selecting"},
-            id_field="request_id"
-        )
+    recorder_pool.submit("selecting", match_id, category, username)
     print(f"[Log] {username} marked as 'selecting' in {match_id}-{category}")
-    status_record = status_object(request_id, "selecting")
 
-    with writing_status_lock:
-        add_record(
-        requests_status_db,
-            request_status_field,
-            status_record
-        )
 
-
-def waiting_queue_manager(waiting_queues, reserving_queues):
+def waiting_queue_manager():
     """Simulate receiving users into the waiting queue (e.g. from API/socket)."""
     print(f"[Init] Waiting queue manager started.")
     while True:
@@ -158,180 +219,59 @@ def waiting_queue_manager(waiting_queues, reserving_queues):
         match_id = data["match_id"]
         category = data["category"]
 
-        key = (match_id, category)
-
-        with waiting_queues_lock:
-            if key not in waiting_queues:
-                waiting_queues[key] = Queue()
-                reserving_queues[key] = Queue()
-                waiting_queues_recorder[key] = Queue()
-                print(f"[Init] Queues created for {match_id}-{category}")
-
-                # Start a worker process per match-category pair
-                worker_process = Process(
-                    target=worker,
-                    args=(match_id, category, waiting_queues_recorder[key], reserving_queues[key])
-                )
-                worker_process.start()
-                worker_processes[key] = worker_process
-                print(f"[Init] Worker started for {match_id}-{category}")
-
-            # Add the user to the waiting queue
-            waiting_queues[key].put(username)
-            waiting_queues_recorder[key].put(username)
-            print(f"[Input] User '{username}' added to waiting queue for {match_id}-{category}")
-
-
-def reserving_queue_manager(waiting_queues, reserving_queues):
-    # 1) Set up server socket once
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((LISTEN_HOST, LISTEN_PORT))
-    server.listen()
-    print(f"[ReserveMgr] Listening on {LISTEN_HOST}:{LISTEN_PORT}…")
+        # Add the user to the waiting queue; the scheduler picks it up from there
+        reserving_server.enqueue(match_id, category, username)
+        recorder_pool.submit("waiting", match_id, category, username)
+        print(f"[Input] User '{username}' added to waiting queue for {match_id}-{category}")
 
-    while True:
-        conn, addr = server.accept()
-        print(f"[ReserveMgr] Connection from {addr}")
-        match_id = None
-        category = None
-        done_user = None
-        key = None
-        try:
-            with conn.makefile("r") as reader:
-                for line in reader:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    # parse the done-event
-                    try:
-                        msg = json.loads(line)
-                        print(f"[ReserveMgr] Received: {msg}")
-                        if "cmd" not in msg:
-                            print(f"[ReserveMgr] Invalid JSON, skipping: {line!r}")
-                            continue
-                        if msg["cmd"] == "DONE":
-                            
-                            match_id  = msg["match_id"]
-                            category  = msg["category"]
-                            done_user = msg["user_name"]
-                            key = (match_id, category)
-                            reserving_queues[key].put(done_user)
-                            key = (match_id, category)
-                            print(f"[Done] Worker finished {done_user} for {match_id}-{category}")
-
-                            update_record(
-                                requests_db,
-                                request_feild,
-                                f"{match_id}_{category}_{done_user}",
-                                {"latest_status": "done"},
-                                id_field="request_id"
-                            )
-                        if msg["cmd"] == "NEXT":
-                            # get the next user from any reserving queue
-                            for key in waiting_queues:
-                                if not waiting_queues[key].empty():
-                                    print(f"[ReserveMgr] Found reserving queue for {key}")
-                                    next_user = waiting_queues[key].get()
-                                    match_id, category = key
-                                    print(f"[ReserveMgr] '{next_user}' → selection for {match_id}-{category}")
-                                    log_selecting(match_id, category, next_user)
-
-                                    response = {
-                                        "match_id": match_id,
-                                        "category": category,
-                                        "user_name": next_user
-                                    }
-                                    conn.sendall((json.dumps(response) + "\n").encode())
-                                    break
-                            else:
-                                print(f"[ReserveMgr] no one reserving for {match_id}-{category}")
-
-                    except (ValueError, KeyError):
-                        print(f"[ReserveMgr] Invalid JSON, skipping: {line!r}")
-                        continue
-
-                    
-
-                    # mark the user as done in the reserving queue
-                    
-                    next_user = None
-
-
-                    # get next waiting user, if any
-                    with waiting_queues_lock:
-                        if key in waiting_queues and not waiting_queues[key].empty() and msg["cmd"] != "NEXT":
-                            next_user = waiting_queues[key].get()
-                            print(f"[Promote] '{next_user}' → selection for {match_id}-{category}")
-                            log_selecting(match_id, category, next_user)
-
-                            response = {
-                            "match_id": match_id,
-                            "category": category,
-                            "user": next_user
-                              }
-                            conn.sendall((json.dumps(response) + "\n").encode())
-                        elif msg["cmd"] != "NEXT":
-                            pass
-                        else:
-                            print(f"[Promote] no one waiting for {match_id}-{category}")
-
-                    # send back the next user (or null) as JSON
-                    
-
-        except Exception as e:
-            print(f"[ReserveMgr] Connection error: {e}")
-        finally:
-            conn.close()
-            print(f"[ReserveMgr] Disconnected {addr}, listening again…")
-
-def waiting_recorder_thread(match_id, category, queue):
-    while True:
-        username = queue.get()
-        request_id = f"{match_id}_{category}_{username}"
-        
-        request = request_object(request_id, username, match_id, category)
-        with writing_request_lock:
-            add_record(requests_db,
-                    request_feild,
-                    request)
-        status = status_object(request_id, "waiting")
-        with writing_status_lock:
-            add_record(requests_status_db,
-                    request_status_field,
-                    status)
-
-        print(f"[Record] {username} marked as 'waiting' in {match_id}-{category}")
-
-def reserving_recorder_thread(match_id, category, queue):
-    while True:
-        username = queue.get()
-        request_id = f"{match_id}_{category}_{username}"
-        status = status_object(request_id, "done")
-        with writing_status_lock:
-            add_record(requests_status_db,
-                    request_status_field,
-                    status)  
-        with writing_request_lock:
-            update_record(requests_db,
-                        request_feild,
-                        request_id,
-                        {"latest_status": "done"},
-                        id_field="request_id")
-            print(f"[LOG] {username} marked as 'done' in {match_id}-{category}")
-
-        print(f"[Record] {username} marked as 'done' in {match_id}-{category}")
-def main():
-    multiprocessing.freeze_support()
-    multiprocessing.set_start_method("spawn", force=True)
-    # Initialize the queues and worker processes
-    t_wait = threading.Thread(target=waiting_queue_manager, args=(waiting_queues, reserving_queues))
-    t_res = threading.Thread(target=reserving_queue_manager, args=(reserving_queues,waiting_queues))
 
-    t_wait.start()
-    t_res.start()
+def log_done(match_id, category, username):
+    recorder_pool.submit("done", match_id, category, username)
+    print(f"[Done] Worker finished {username} for {match_id}-{category}")
+
+
+class SeatCounts:
+    """Available seats per (match_id, category), refreshed in the background for the scheduler"""
+
+    def __init__(self, path=os.path.join(DATA_DIR, "seats.csv")):
+        self.path = path
+        self.counts = {}
 
+    def refresh(self):
+        counts = {}
+        for seat in read_all(self.path):
+            if seat["status"] == "available":
+                key = (seat["match_id"], seat["catagory"].lower())
+                counts[key] = counts.get(key, 0) + 1
+        self.counts = counts
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[Seats] Could not read {self.path}: {e}")
+            time.sleep(SEATS_REFRESH)
+
+    def remaining(self, key):
+        match_id, category = key
+        return self.counts.get((str(match_id), str(category).lower()), 0)
+
+
+seat_counts = SeatCounts()   # refreshed from startup when NEXT_POLICY is deficit_seats
+
+reserving_server = ReservingServer(waiting_queues, waiting_queues_lock,
+                                   on_selecting=log_selecting, on_done=log_done,
+                                   policy=NEXT_POLICY, remaining_seats=seat_counts.remaining)
+
+
+def reserving_queue_manager():
+    """Serve the NEXT/DONE protocol to any number of coordinators (see reserving_server.py)"""
+    asyncio.run(reserving_server.serve(LISTEN_HOST, LISTEN_PORT))
+
+
+def main():
+    # the startup event starts the queue managers and the recorder pool
     uvicorn.run("waiting:app", host="0.0.0.0", port=8000)
 
 
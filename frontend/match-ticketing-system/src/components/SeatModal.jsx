@@ -4,6 +4,9 @@ import StadiumSeats from './StadiumSeats';
 import axios from 'axios';
 import config from '../../config';
 
+// Admission leases in the queue service expire unless renewed
+const HEARTBEAT_INTERVAL_MS = 15000;
+
 const fetchSeatsFromAPI = async (matchId, category) => {
   try {
     const response = await axios.get(`${config.API_URL}/seats/${matchId}/${category}`);
@@ -35,6 +38,8 @@ export default function SeatModal({ onClose, category, match, match_id, requestI
   const [seats, setSeats] = useState([]);
   const [waitingWs, setWaitingWs] = useState(null);
   const wsInitialized = useRef(false);
+  const heartbeatRef = useRef(null);
+  const waitingRef = useRef(null); // current queue socket, replaced when the service redirects us
   const [isReserved, setIsReserved] = useState(false); // New state for reservation status
   
   const [reservationWs, setReservationWs] = useState(null);
@@ -46,6 +51,15 @@ export default function SeatModal({ onClose, category, match, match_id, requestI
     // Publish to queue service
     
     const waiting_service_ws = new WebSocket(config.WAITING_SERVER_URL);
+    waitingRef.current = waiting_service_ws;
+
+    const registerMessage = JSON.stringify({
+      action: "register".toLowerCase(),
+      request_id: requestId,
+      matchId: match_id,
+      category: category,
+      user_name: user_name,
+    });
     
     waiting_service_ws.onopen = async () => {
       console.log('Waiting WebSocket connected');
@@ -55,13 +69,7 @@ export default function SeatModal({ onClose, category, match, match_id, requestI
         user_name: user_name,
         latest_status: "Waiting"
       });
-      waiting_service_ws.send(JSON.stringify({
-        action: "register".toLowerCase(),
-        request_id: requestId,
-        matchId: match_id,
-        category: category,
-        user_name: user_name,
-      }));
+      waiting_service_ws.send(registerMessage);
     };
 
     // wait for response from waiting service
@@ -82,11 +90,31 @@ export default function SeatModal({ onClose, category, match, match_id, requestI
     };
     publishToQueue();
     
-    waiting_service_ws.onmessage = async (event) => {
+    const handleWaitingMessage = async (event) => {
       const data = JSON.parse(event.data);
       console.log('Received websocket message:', data);
-      if (data.type === 'start_selection'.toLowerCase()) {
+      if (data.type === 'redirect') {
+        // Another queue instance owns this match/category: move over and register there
+        console.log('Redirected to queue instance', data.url);
+        waitingRef.current.close();
+        const redirected = new WebSocket(data.url);
+        redirected.onopen = () => redirected.send(registerMessage);
+        redirected.onmessage = handleWaitingMessage;
+        waitingRef.current = redirected;
+        setWaitingWs(redirected);
+      } else if (data.type === 'start_selection'.toLowerCase()) {
         console.log('Received start_selection message');
+        clearInterval(heartbeatRef.current);
+        heartbeatRef.current = setInterval(() => {
+          if (waitingRef.current.readyState === WebSocket.OPEN) {
+            waitingRef.current.send(JSON.stringify({
+              action: "heartbeat",
+              matchId: match_id,
+              category: category,
+              user_name: user_name,
+            }));
+          }
+        }, HEARTBEAT_INTERVAL_MS);
         const fetchedSeats = await fetchSeatsFromAPI(match_id, category);
         setSeats(generateSeats(category, fetchedSeats));
         setInQueue(false);
@@ -94,13 +122,15 @@ export default function SeatModal({ onClose, category, match, match_id, requestI
         console.log('Not your request_id, ignoring message');
       }
     };
+    waiting_service_ws.onmessage = handleWaitingMessage;
 
     setWaitingWs(waiting_service_ws);
 
     // Cleanup function moved outside of onmessage
     return () => {
-      if (waiting_service_ws && waiting_service_ws.readyState === WebSocket.OPEN) {
-        waiting_service_ws.close();
+      clearInterval(heartbeatRef.current);
+      if (waitingRef.current && waitingRef.current.readyState === WebSocket.OPEN) {
+        waitingRef.current.close();
       }
     };
   }, [match_id, category, requestId, user_name]); // Added missing dependencies